@@ -3,14 +3,19 @@ API routes cho Chat Bot.
 Logic chat: instruction cố định + context sản phẩm lấy từ bảng Business (và Product theo business_id).
 Context được cache theo business_id — mỗi business có cache riêng.
 """
-from fastapi import APIRouter, status, Depends
+from fastapi import APIRouter, BackgroundTasks, Request, status, Depends
 from sqlalchemy.orm import Session
 import logging
 
 from schemas.chat import ChatRequest, ChatResponse
 from schemas.response import SuccessResponse, ErrorResponse
+from config import Config
 from database import get_db
+from utils.tracing import span
+from utils.metrics import set_request_labels
+from middleware.load_shedding import mark_request_dropped
 from services.gemini_service import GeminiService
+from services.conversation_store import get_conversation_store
 from services.business_context_service import (
     get_business_context_service,
     DEFAULT_CHAT_INSTRUCTION,
@@ -24,22 +29,26 @@ router = APIRouter(prefix="/api/chat", tags=["Chat Bot"])
 @router.post("/message", status_code=status.HTTP_200_OK)
 async def chat_message(
     request: ChatRequest,
+    background_tasks: BackgroundTasks,
+    http_request: Request,
     db: Session = Depends(get_db)
 ):
     """
     Xử lý tin nhắn từ khách hàng và trả về phản hồi từ bot.
 
     - **message**: Tin nhắn hiện tại của khách hàng
-    - **conversations**: Danh sách các cuộc trò chuyện gần đây
+    - **conversations**: Danh sách các cuộc trò chuyện gần đây (bỏ trống để dùng lịch sử lưu phía server)
     - **customer_id**: ID của khách hàng
     - **business_id**: ID của business (dùng để lấy thông tin cửa hàng + sản phẩm; context cache theo business_id)
     """
     try:
         business_id = request.business_id
+        set_request_labels(business_id=business_id)
 
         # Lấy context sản phẩm từ Business + Product, cache theo business_id
         context_service = get_business_context_service()
-        product_context = context_service.get_product_context(db, business_id, use_cache=False)
+        with span('db.product_context', business_id=business_id):
+            product_context = context_service.get_product_context(db, business_id, use_cache=False)
 
         # Chuyển conversations sang format cho GeminiService
         conversations = [
@@ -47,6 +56,12 @@ async def chat_message(
             for msg in request.conversations
         ]
 
+        # Client không gửi lịch sử: lấy lịch sử đã lưu phía server
+        conversation_store = get_conversation_store() if Config.CONVERSATION_STORE_ENABLED else None
+        stored_history = None
+        if conversation_store is not None and not conversations:
+            conversations = stored_history = conversation_store.get_history(business_id, request.customer_id)
+
         # Instruction cố định; context sản phẩm theo từng business
         gemini_service = GeminiService()
         response_text = gemini_service.generate_chat_response(
@@ -54,8 +69,25 @@ async def chat_message(
             conversations=conversations,
             instruction=DEFAULT_CHAT_INSTRUCTION,
             product_context=product_context,
+            context_key=business_id,
+            history_key=(business_id, request.customer_id),
         )
 
+        # Câu trả lời thay thế khi Gemini lỗi: vẫn trả HTTP 200 nhưng limiter tính là request lỗi
+        is_fallback = response_text in GeminiService.FALLBACK_REPLIES
+        if is_fallback:
+            mark_request_dropped(http_request)
+
+        # Câu trả lời thay thế không phải lượt hội thoại thật: không lưu vào lịch sử
+        if conversation_store is not None and not is_fallback:
+            new_messages = [
+                {"role": "user", "content": request.message},
+                {"role": "assistant", "content": response_text},
+            ]
+            # Cache RAM cập nhật ngay cho tin nhắn kế tiếp, ghi DB sau khi đã trả response
+            conversation_store.append(business_id, request.customer_id, new_messages, history=stored_history)
+            background_tasks.add_task(conversation_store.persist, business_id, request.customer_id, new_messages)
+
         data = ChatResponse(
             response=response_text,
             intent=None,
@@ -68,6 +100,7 @@ async def chat_message(
         )
     except Exception as e:
         logger.error(f"Lỗi khi xử lý chat: {str(e)}")
+        mark_request_dropped(http_request)
         return ErrorResponse(
             code="96",
             message=f"Lỗi khi xử lý tin nhắn: {str(e)}",
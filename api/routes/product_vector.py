@@ -2,7 +2,7 @@
 API routes cho Product Vector operations
 """
 from fastapi import APIRouter, HTTPException, status, Query
-from typing import List
+from typing import List, Optional
 import logging
 
 logger = logging.getLogger(__name__)
@@ -16,14 +16,15 @@ from schemas.product import (
     DeleteVectorData,
     BatchUpsertData
 )
+from schemas.job import JobCreatedData, JobStatusData
 from schemas.response import SuccessResponse, ErrorResponse
 from services.pinecone_service import get_pinecone_service
 from services.embedding_service import get_embedding_service
-from utils.product_helper import (
-    create_text_for_embedding, 
-    prepare_metadata_for_pinecone,
-    extract_image_urls
-)
+from services.retrieval_service import get_retrieval_service
+from services.product_indexing_service import build_product_vectors, upsert_product_requests
+from services.job_queue import get_job_queue, Job
+from services.reindex_service import ReindexService
+from services.product_sync_service import get_product_sync_service
 
 router = APIRouter(prefix="/api/products/vector", tags=["Product Vector"])
 
@@ -47,18 +48,8 @@ async def upsert_product_vector(
     - **metadata**: Metadata bổ sung (optional)
     """
     try:
-        # Tạo text để embedding từ thông tin sản phẩm trong request
-        text_for_embedding = create_text_for_embedding(
-            name=request.name,
-            description=request.description,
-            metadata=request.metadata
-        )
-        
-        # Tạo text embedding vector
-        text_vector = get_embedding_service().create_embedding(text_for_embedding)
-        
-        # Chuẩn bị metadata để lưu vào Pinecone
-        metadata = prepare_metadata_for_pinecone(
+        # Tạo text vector + image vectors (main + detail) từ thông tin sản phẩm trong request
+        vectors_to_upsert = build_product_vectors(
             product_id=request.product_id,
             business_id=request.business_id,
             name=request.name,
@@ -66,49 +57,11 @@ async def upsert_product_vector(
             status=request.status,
             quantity_avail=request.quantity_avail,
             description=request.description,
+            main_image_url=request.main_image_url,
+            detail_image_url=request.detail_image_url,
             metadata=request.metadata
         )
-        
-        # Thêm image URLs vào metadata
-        if request.main_image_url:
-            metadata['main_image_url'] = request.main_image_url
-        if request.detail_image_url:
-            metadata['detail_image_url'] = request.detail_image_url
-        
-        # Lưu text vector vào Pinecone
-        text_vector_id = f"{request.product_id}_text"
-        vectors_to_upsert = [{
-            'id': text_vector_id,
-            'values': text_vector,
-            'metadata': {**metadata, 'vector_type': 'text'}
-        }]
-        
-        # Tạo image embeddings cho tất cả các ảnh (main + detail)
-        all_image_urls = extract_image_urls(
-            request.main_image_url,
-            request.detail_image_url
-        )
-        
-        if all_image_urls:
-            for index, image_url in enumerate(all_image_urls):
-                try:
-                    image_vector = get_embedding_service().create_image_embedding(image_url)
-                    if image_vector:
-                        # Đặt tên vector: image_0 cho ảnh đầu tiên, image_1 cho ảnh thứ 2, etc.
-                        # Nếu là main_image_url (index 0) và có main_image_url, có thể đặt tên đặc biệt
-                        if index == 0 and request.main_image_url and image_url == request.main_image_url.strip():
-                            image_vector_id = f"{request.product_id}_image_main"
-                        else:
-                            image_vector_id = f"{request.product_id}_image_{index}"
-                        
-                        vectors_to_upsert.append({
-                            'id': image_vector_id,
-                            'values': image_vector,
-                            'metadata': {**metadata, 'vector_type': 'image', 'image_index': index}
-                        })
-                except Exception as img_error:
-                    # Log lỗi nhưng không fail toàn bộ request nếu image embedding thất bại
-                    logger.warning(f"Không thể tạo image embedding cho ảnh {index} của product {request.product_id}: {str(img_error)}")
+        text_vector_id = vectors_to_upsert[0]['id']
         
         # Upsert tất cả vectors cùng lúc
         get_pinecone_service().upsert_vectors_batch(
@@ -157,7 +110,7 @@ async def search_products_by_vector(
                 message="Phải có ít nhất query_text hoặc query_image_url"
             )
         
-        all_results = []
+        queries = []
         search_type = request.search_type.lower()
         
         # Chuẩn bị filter chung từ request.filter
@@ -166,109 +119,50 @@ async def search_products_by_vector(
         # Search theo text nếu có query_text và search_type cho phép
         if request.query_text and search_type in ['text', 'both']:
             try:
-                query_vector = get_embedding_service().create_embedding(request.query_text)
-                
+                query_vectors = get_embedding_service().create_text_vectors(request.query_text)
                 # Thêm filter để chỉ search text vectors
-                text_filter = {**base_filter}
-                text_filter['vector_type'] = 'text'
-                
-                text_results = get_pinecone_service().search_vectors(
-                    query_vector=query_vector,
-                    namespace=request.namespace,
-                    top_k=request.top_k,
-                    filter=text_filter
-                )
-                all_results.extend(text_results)
+                queries.append({
+                    'name': 'text',
+                    'vector': query_vectors['vector'],
+                    'index_vector': query_vectors['index_vector'],
+                    'top_k': request.top_k,
+                    'filter': {**base_filter, 'vector_type': 'text'}
+                })
             except Exception as e:
                 logger.warning(f"Lỗi khi search text: {str(e)}")
         
         # Search theo image nếu có query_image_url và search_type cho phép
         if request.query_image_url and search_type in ['image', 'both']:
             try:
-                image_vector = get_embedding_service().create_image_embedding(request.query_image_url)
-                if image_vector:
+                image_vectors = get_embedding_service().create_image_vectors(request.query_image_url)
+                if image_vectors is not None:
                     # Thêm filter để chỉ search image vectors
-                    image_filter = {**base_filter}
-                    image_filter['vector_type'] = 'image'
-                    
-                    image_results = get_pinecone_service().search_vectors(
-                        query_vector=image_vector,
-                        namespace=request.namespace,
-                        top_k=request.top_k,
-                        filter=image_filter
-                    )
-                    all_results.extend(image_results)
+                    queries.append({
+                        'name': 'image',
+                        'vector': image_vectors['vector'],
+                        'index_vector': image_vectors['index_vector'],
+                        'top_k': request.top_k,
+                        'filter': {**base_filter, 'vector_type': 'image'}
+                    })
             except Exception as e:
                 logger.warning(f"Lỗi khi search image: {str(e)}")
         
-        # Merge và deduplicate kết quả theo product_id, lấy score cao nhất
-        product_scores = {}
-        product_metadata = {}
-        
-        for result in all_results:
-            # Extract product_id từ vector_id
-            # Format có thể là: {product_id}_text, {product_id}_image_main, {product_id}_image_0, etc.
-            vector_id = result['id']
-            logger.debug(f"Đang xử lý vector_id: {vector_id}")
-            
-            product_id = None
-            
-            # Thử các cách extract product_id
-            if '_' in vector_id:
-                # Format: {product_id}_text hoặc {product_id}_image_* hoặc {product_id}_image_main
-                parts = vector_id.split('_')
-                if len(parts) >= 2:
-                    # Lấy phần đầu tiên (product_id)
-                    product_id_str = parts[0]
-                    logger.debug(f"Extract product_id_str từ vector_id '{vector_id}': '{product_id_str}'")
-                    
-                    try:
-                        product_id = int(product_id_str)
-                        logger.debug(f"Parse thành công product_id: {product_id}")
-                    except ValueError as e:
-                        logger.warning(
-                            f"Không thể parse product_id từ vector_id '{vector_id}': "
-                            f"product_id_str='{product_id_str}', error={str(e)}"
-                        )
-                        continue
-                else:
-                    logger.warning(f"Vector_id '{vector_id}' có format không hợp lệ (ít hơn 2 phần khi split)")
-                    continue
-            else:
-                # Fallback: thử parse trực tiếp (nếu không có dấu _)
-                logger.debug(f"Vector_id '{vector_id}' không có dấu _, thử parse trực tiếp")
-                try:
-                    product_id = int(vector_id)
-                    logger.debug(f"Parse trực tiếp thành công product_id: {product_id}")
-                except ValueError as e:
-                    logger.warning(
-                        f"Không thể parse product_id trực tiếp từ vector_id '{vector_id}': {str(e)}"
-                    )
-                    continue
-            
-            if product_id is None:
-                logger.warning(f"Không thể extract product_id từ vector_id: {vector_id}, bỏ qua")
-                continue
-            
-            # Lưu score cao nhất cho mỗi product
-            if product_id not in product_scores or result['score'] > product_scores[product_id]:
-                product_scores[product_id] = result['score']
-                product_metadata[product_id] = result.get('metadata', {})
-        
-        # Sắp xếp theo score và lấy top_k
-        sorted_products = sorted(
-            product_scores.items(),
-            key=lambda x: x[1],
-            reverse=True
-        )[:request.top_k]
+        # Text và image query chạy song song, merge và deduplicate theo product_id (lấy score cao nhất)
+        sorted_products = get_retrieval_service().retrieve(
+            queries,
+            namespace=request.namespace,
+            top_k=request.top_k,
+            raise_errors=False
+        )
         
         # Tạo kết quả
         results = []
         from schemas.product import ProductResponse
         from datetime import datetime
         
-        for product_id, score in sorted_products:
-            metadata = product_metadata[product_id]
+        for item in sorted_products:
+            product_id = item['product_id']
+            metadata = item['metadata']
             
             product_response = ProductResponse(
                 id=product_id,
@@ -289,7 +183,7 @@ async def search_products_by_vector(
             
             results.append(ProductSearchResult(
                 product_id=product_id,
-                score=score,
+                score=item['score'],
                 product=product_response
             ))
         
@@ -361,7 +255,8 @@ async def delete_product_vector(
 @router.post("/batch-upsert", status_code=status.HTTP_200_OK)
 async def batch_upsert_product_vectors(
     products: List[ProductVectorRequest],
-    namespace: str
+    namespace: str,
+    async_mode: bool = Query(False, description="True: chạy nền, trả về job_id ngay")
 ):
     """
     Lưu vector cho nhiều sản phẩm cùng lúc
@@ -370,107 +265,28 @@ async def batch_upsert_product_vectors(
     
     - **products**: List các ProductVectorRequest (mỗi item chứa đầy đủ thông tin sản phẩm)
     - **namespace**: Namespace trong Pinecone (có thể override namespace trong từng request)
+    - **async_mode**: True thì đưa vào job chạy nền và trả về job_id; tra cứu tiến độ qua GET /jobs/{job_id}
     """
     try:
-        results = []
-        errors = []
-        all_vectors_to_upsert = []
-        
-        for product_request in products:
-            try:
-                # Sử dụng namespace từ request hoặc từ parameter
-                target_namespace = product_request.namespace if product_request.namespace else namespace
-                
-                # Tạo text và embedding từ thông tin trong request
-                text_for_embedding = create_text_for_embedding(
-                    name=product_request.name,
-                    description=product_request.description,
-                    metadata=product_request.metadata
-                )
-                text_vector = get_embedding_service().create_embedding(text_for_embedding)
-                
-                # Chuẩn bị metadata
-                metadata = prepare_metadata_for_pinecone(
-                    product_id=product_request.product_id,
-                    business_id=product_request.business_id,
-                    name=product_request.name,
-                    price=product_request.price,
-                    status=product_request.status,
-                    quantity_avail=product_request.quantity_avail,
-                    description=product_request.description,
-                    metadata=product_request.metadata
-                )
-                
-                # Thêm image URLs vào metadata
-                if product_request.main_image_url:
-                    metadata['main_image_url'] = product_request.main_image_url
-                if product_request.detail_image_url:
-                    metadata['detail_image_url'] = product_request.detail_image_url
-                
-                # Thêm text vector
-                text_vector_id = f"{product_request.product_id}_text"
-                all_vectors_to_upsert.append({
-                    'id': text_vector_id,
-                    'values': text_vector,
-                    'metadata': {**metadata, 'vector_type': 'text'},
-                    'namespace': target_namespace
-                })
-                
-                # Tạo image embeddings cho tất cả các ảnh (main + detail)
-                all_image_urls = extract_image_urls(
-                    product_request.main_image_url,
-                    product_request.detail_image_url
-                )
-                
-                if all_image_urls:
-                    for index, image_url in enumerate(all_image_urls):
-                        try:
-                            image_vector = get_embedding_service().create_image_embedding(image_url)
-                            if image_vector:
-                                # Đặt tên vector: image_main cho ảnh đầu tiên nếu là main, hoặc image_0, image_1, etc.
-                                if index == 0 and product_request.main_image_url and image_url == product_request.main_image_url.strip():
-                                    image_vector_id = f"{product_request.product_id}_image_main"
-                                else:
-                                    image_vector_id = f"{product_request.product_id}_image_{index}"
-                                
-                                all_vectors_to_upsert.append({
-                                    'id': image_vector_id,
-                                    'values': image_vector,
-                                    'metadata': {**metadata, 'vector_type': 'image', 'image_index': index},
-                                    'namespace': target_namespace
-                                })
-                        except Exception as img_error:
-                            logger.warning(f"Không thể tạo image embedding cho ảnh {index} của product {product_request.product_id}: {str(img_error)}")
-                
-                results.append({
-                    "product_id": product_request.product_id,
-                    "namespace": target_namespace,
-                    "status": "success"
-                })
-            
-            except Exception as e:
-                errors.append(f"Lỗi với sản phẩm {product_request.product_id}: {str(e)}")
+        if async_mode:
+            job = get_job_queue().submit(
+                'batch_upsert',
+                lambda job: _run_batch_upsert_job(job, products, namespace),
+                total=len(products)
+            )
+            data = JobCreatedData(
+                job_id=job.id,
+                job_type=job.job_type,
+                status=job.status,
+                total=job.total
+            )
+            return SuccessResponse(
+                code="200",
+                message=f"Đã tạo job batch upsert cho {len(products)} sản phẩm",
+                data=data
+            )
         
-        # Upsert tất cả vectors theo namespace
-        if all_vectors_to_upsert:
-            # Nhóm vectors theo namespace
-            vectors_by_namespace = {}
-            for vec in all_vectors_to_upsert:
-                ns = vec.pop('namespace')
-                if ns not in vectors_by_namespace:
-                    vectors_by_namespace[ns] = []
-                vectors_by_namespace[ns].append(vec)
-            
-            # Upsert từng namespace
-            for ns, vectors in vectors_by_namespace.items():
-                try:
-                    get_pinecone_service().upsert_vectors_batch(
-                        vectors=vectors,
-                        namespace=ns
-                    )
-                except Exception as e:
-                    logger.error(f"Lỗi khi upsert vectors vào namespace {ns}: {str(e)}")
-                    errors.append(f"Lỗi khi upsert vào namespace {ns}: {str(e)}")
+        results, errors = upsert_product_requests(products, namespace)
         
         data = BatchUpsertData(
             success_count=len(results),
@@ -491,3 +307,108 @@ async def batch_upsert_product_vectors(
             message=f"Lỗi khi batch upsert: {str(e)}"
         )
 
+
+def _run_batch_upsert_job(job: Job, products: List[ProductVectorRequest], namespace: str) -> dict:
+    """Task chạy nền cho batch upsert, tiến độ cập nhật vào job"""
+    results, errors = upsert_product_requests(products, namespace, job=job)
+    return {
+        "success_count": len(results),
+        "error_count": len(errors)
+    }
+
+
+@router.post("/reindex", status_code=status.HTTP_200_OK)
+async def reindex_products(
+    business_id: Optional[int] = Query(None, description="Business cần reindex (bỏ trống = tất cả)"),
+    resume: bool = Query(True, description="True: chạy tiếp từ checkpoint, False: reindex lại từ đầu")
+):
+    """
+    Reindex sản phẩm từ bảng Product vào Pinecone (chạy nền)
+    
+    - **business_id**: Chỉ reindex business này (namespace business_{id}); bỏ trống để reindex tất cả
+    - **resume**: Chạy tiếp từ checkpoint của lần reindex bị gián đoạn
+    
+    Tra cứu tiến độ (sản phẩm/giây) qua GET /jobs/{job_id}
+    """
+    try:
+        business_ids = [business_id] if business_id is not None else None
+        job = get_job_queue().submit(
+            'reindex',
+            lambda job: ReindexService().reindex_all(business_ids=business_ids, resume=resume, job=job)
+        )
+        data = JobCreatedData(
+            job_id=job.id,
+            job_type=job.job_type,
+            status=job.status,
+            total=job.total
+        )
+        return SuccessResponse(
+            code="200",
+            message="Đã tạo job reindex" + (f" cho business {business_id}" if business_id is not None else ""),
+            data=data
+        )
+    
+    except Exception as e:
+        return ErrorResponse(
+            code="96",
+            message=f"Lỗi khi tạo job reindex: {str(e)}"
+        )
+
+
+@router.post("/sync", status_code=status.HTTP_200_OK)
+async def sync_products(
+    business_id: Optional[int] = Query(None, description="Business cần sync (bỏ trống = các business có thay đổi)")
+):
+    """
+    Đồng bộ thay đổi của bảng Product (theo updated_at) vào Pinecone ngay, không chờ worker nền (chạy nền)
+    
+    - **business_id**: Chỉ sync business này; bỏ trống để sync các business có sản phẩm thay đổi
+    
+    Tra cứu kết quả qua GET /jobs/{job_id}
+    """
+    try:
+        business_ids = [business_id] if business_id is not None else None
+        job = get_job_queue().submit(
+            'sync',
+            lambda job: get_product_sync_service().sync_all(business_ids=business_ids, job=job)
+        )
+        data = JobCreatedData(
+            job_id=job.id,
+            job_type=job.job_type,
+            status=job.status,
+            total=job.total
+        )
+        return SuccessResponse(
+            code="200",
+            message="Đã tạo job sync" + (f" cho business {business_id}" if business_id is not None else ""),
+            data=data
+        )
+    
+    except Exception as e:
+        return ErrorResponse(
+            code="96",
+            message=f"Lỗi khi tạo job sync: {str(e)}"
+        )
+
+
+@router.get("/jobs/{job_id}", status_code=status.HTTP_200_OK)
+async def get_job_status(job_id: str):
+    """
+    Tra cứu tiến độ job chạy nền (batch upsert, ...)
+    
+    - **job_id**: ID job trả về khi tạo job
+    
+    Trả về trạng thái, số sản phẩm đã xử lý, throughput (sản phẩm/giây) và lỗi từng sản phẩm
+    """
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return ErrorResponse(
+            code="404",
+            message=f"Không tìm thấy job {job_id}"
+        )
+    
+    return SuccessResponse(
+        code="200",
+        message="Lấy trạng thái job thành công",
+        data=JobStatusData(**job.to_dict())
+    )
@@ -0,0 +1,239 @@
+"""
+Micro-benchmark các bước dựng context / prompt chạy ở mỗi request
+
+- `BusinessContextService._build_context`: business có 10 / 1k / 10k sản phẩm (SQLite tổng hợp)
+- `GeminiService.build_chat_prompt` (phần dựng prompt của generate_chat_response): context của từng
+  catalog x lịch sử 0 / 20 / 200 tin nhắn
+- `create_text_for_embedding`: toàn bộ sản phẩm của catalog
+
+Mỗi case chạy lặp đến khi đủ `--min-time` giây (ít nhất `--min-rounds` lần), báo median / min / max
+thời gian; sau đó chạy thêm một lần dưới tracemalloc để đo số block được cấp phát và bộ nhớ đỉnh.
+Kết quả `--json` dùng làm baseline cho lần chạy sau (`--baseline`), case chậm hơn `--threshold` bị đánh dấu.
+
+Chạy:
+    python -m benchmarks.bench_context_assembly
+    python -m benchmarks.bench_context_assembly --products 10 1000 --history 0 20 --json before.json
+    python -m benchmarks.bench_context_assembly --baseline before.json
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+
+from benchmarks import fakes
+from benchmarks.synthetic import make_conversation, make_products
+
+DEFAULT_PRODUCTS = (10, 1000, 10000)
+DEFAULT_HISTORY = (0, 20, 200)
+
+
+def time_case(fn: Callable[[], Any], min_time: float, min_rounds: int, max_rounds: int) -> List[float]:
+    """Chạy `fn` lặp lại, trả về thời gian từng lần (giây)"""
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < max_rounds:
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+        if len(timings) >= min_rounds and time.perf_counter() - started >= min_time:
+            break
+    return timings
+
+
+def measure_allocations(fn: Callable[[], Any]) -> Dict[str, Any]:
+    """Một lần chạy dưới tracemalloc: số block / byte cấp phát mới và bộ nhớ đỉnh"""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        result = fn()
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    diff = after.compare_to(before, 'lineno')
+    return {
+        'alloc_blocks': sum(max(stat.count_diff, 0) for stat in diff),
+        'alloc_kib': round(sum(max(stat.size_diff, 0) for stat in diff) / 1024, 1),
+        'peak_kib': round(peak / 1024, 1),
+        'output_chars': len(result) if isinstance(result, str) else None
+    }
+
+
+def run_case(name: str, params: Dict[str, Any], fn: Callable[[], Any], args) -> Dict[str, Any]:
+    fn()  # warm-up (import, cache của SQLAlchemy...)
+    timings = time_case(fn, args.min_time, args.min_rounds, args.max_rounds)
+    result = {
+        'case': name,
+        'params': params,
+        'rounds': len(timings),
+        'median_ms': round(statistics.median(timings) * 1000, 3),
+        'min_ms': round(min(timings) * 1000, 3),
+        'max_ms': round(max(timings) * 1000, 3),
+        **measure_allocations(fn)
+    }
+    print_result(result)
+    return result
+
+
+def case_key(result: Dict[str, Any]) -> str:
+    params = ','.join(f"{k}={v}" for k, v in sorted(result['params'].items()))
+    return f"{result['case']}[{params}]"
+
+
+def print_result(result: Dict[str, Any]):
+    line = (
+        f"{case_key(result):<42} median={result['median_ms']:>10.3f}ms min={result['min_ms']:>10.3f}ms "
+        f"blocks={result['alloc_blocks']:>8} alloc={result['alloc_kib']:>10.1f}KiB peak={result['peak_kib']:>10.1f}KiB"
+    )
+    if result.get('output_chars') is not None:
+        line += f" chars={result['output_chars']}"
+    print(line)
+
+
+def compare(results: List[Dict[str, Any]], baseline_path: str, threshold: float) -> int:
+    """So median với baseline; trả về số case chậm hơn ngưỡng"""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {case_key(r): r for r in json.load(f)['results']}
+    
+    regressions = 0
+    print(f"\nSo với baseline {baseline_path}:")
+    for result in results:
+        previous = baseline.get(case_key(result))
+        if not previous or not previous['median_ms']:
+            continue
+        change = result['median_ms'] / previous['median_ms'] - 1
+        flag = ''
+        if change > threshold:
+            regressions += 1
+            flag = '  <-- chậm hơn'
+        print(
+            f"  {case_key(result):<42} {previous['median_ms']:>10.3f}ms -> {result['median_ms']:>10.3f}ms "
+            f"({change * 100:+.1f}%) blocks {previous['alloc_blocks']} -> {result['alloc_blocks']}{flag}"
+        )
+    return regressions
+
+
+def prepare_catalogs(product_counts: List[int], seed: int):
+    """Mỗi business một kích thước catalog: business_id = vị trí + 1"""
+    from sqlalchemy import text
+    from benchmarks.synthetic import seed_database
+    from database import engine
+    
+    seed_database(engine, 0, 0, seed=seed)
+    business_ids = {}
+    next_id = 1
+    with engine.begin() as conn:
+        for position, count in enumerate(product_counts):
+            business_id = position + 1
+            business_ids[count] = business_id
+            conn.execute(
+                text("INSERT INTO Business (id, name, phone, address, description, status, metadata) "
+                     "VALUES (:id, :name, :phone, :address, :description, 1, :metadata)"),
+                {
+                    'id': business_id,
+                    'name': f"Shop thời trang {business_id}",
+                    'phone': '0900000000',
+                    'address': f"{business_id} Nguyễn Trãi, Quận 1, TP.HCM",
+                    'description': 'Chuyên quần áo, giày dép, phụ kiện thời trang nam nữ',
+                    'metadata': json.dumps({'Giờ mở cửa': '8h - 22h'}, ensure_ascii=False)
+                }
+            )
+            products = make_products(business_id, count, seed=seed, start_id=next_id)
+            next_id += count
+            # Toàn bộ còn hàng để context đúng bằng kích thước catalog
+            conn.execute(
+                text("INSERT INTO Product (id, business_id, name, description, price, main_image_url, "
+                     "detail_image_url, quantity_avail, status, metadata) VALUES (:id, :business_id, :name, "
+                     ":description, :price, :main_image_url, :detail_image_url, :quantity_avail, '1', :metadata)"),
+                [{**p, 'metadata': json.dumps(p['metadata'], ensure_ascii=False)} for p in products]
+            )
+    return business_ids
+
+
+def run(args) -> List[Dict[str, Any]]:
+    state_dir = tempfile.mkdtemp(prefix='bench-context-')
+    fakes.apply_fake_env(f"sqlite:///{os.path.join(state_dir, 'context.db')}", state_dir=state_dir)
+    
+    from database import SessionLocal
+    from services.business_context_service import BusinessContextService, DEFAULT_CHAT_INSTRUCTION
+    from services.gemini_service import GeminiService
+    from utils.product_helper import create_text_for_embedding
+    logging.getLogger().setLevel(args.log_level)
+    
+    business_ids = prepare_catalogs(args.products, args.seed)
+    service = BusinessContextService()
+    histories = {length: make_conversation(length, seed=args.seed) for length in args.history}
+    message = 'Shop ơi áo thun đen còn size M không ạ?'
+    
+    results = []
+    db = SessionLocal()
+    try:
+        for count in args.products:
+            business_id = business_ids[count]
+            
+            def build_context():
+                # Bỏ object đã load ở lần trước để lần nào cũng đọc lại từ DB
+                db.expire_all()
+                return service._build_context(db, business_id)
+            
+            results.append(run_case('build_context', {'products': count}, build_context, args))
+            
+            product_context = service._build_context(db, business_id)
+            for length, conversations in histories.items():
+                results.append(run_case(
+                    'build_chat_prompt',
+                    {'products': count, 'history': length},
+                    lambda: GeminiService.build_chat_prompt(
+                        message, conversations, DEFAULT_CHAT_INSTRUCTION, product_context
+                    ),
+                    args
+                ))
+            
+            products = make_products(business_id, count, seed=args.seed)
+            
+            def embedding_texts():
+                return [
+                    create_text_for_embedding(name=p['name'], description=p['description'], metadata=p['metadata'])
+                    for p in products
+                ]
+            
+            results.append(run_case('create_text_for_embedding', {'products': count}, embedding_texts, args))
+    finally:
+        db.close()
+    return results
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, nargs='+', default=list(DEFAULT_PRODUCTS), help='Kích thước catalog')
+    parser.add_argument('--history', type=int, nargs='+', default=list(DEFAULT_HISTORY), help='Số tin nhắn lịch sử')
+    parser.add_argument('--min-time', type=float, default=0.5, help='Thời gian tối thiểu mỗi case (giây)')
+    parser.add_argument('--min-rounds', type=int, default=5)
+    parser.add_argument('--max-rounds', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='Ghi kết quả ra file JSON')
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--baseline', help='File JSON của lần chạy trước để so sánh')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Ngưỡng chậm hơn baseline (0.2 = 20%%)')
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    results = run(args)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'args': vars(args), 'results': results}, f, ensure_ascii=False, indent=2)
+    if args.baseline and compare(results, args.baseline, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark bộ nhớ / CPU của embedding dạng list float so với np.ndarray float32
+
+Mô phỏng reindex N sản phẩm (mặc định 10k): mỗi sản phẩm nhận một response protobuf
+(giống `res.predictions[0]['textEmbedding']` của Vertex AI), chuyển sang vector, giữ lại
+đến khi upsert và dựng payload gửi Pinecone theo batch.
+
+Chạy:
+    python -m benchmarks.bench_embedding_buffers
+    python -m benchmarks.bench_embedding_buffers --products 10000 --dimension 1408
+"""
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+from google.protobuf import struct_pb2
+
+
+def make_prediction(rng: np.random.Generator, dimension: int) -> struct_pb2.Struct:
+    """Response protobuf giả lập cho một sản phẩm"""
+    prediction = struct_pb2.Struct()
+    prediction.update({'textEmbedding': rng.standard_normal(dimension).tolist()})
+    return prediction
+
+
+def upsert_chunks(ids_and_values, batch_size: int):
+    """Dựng payload Pinecone theo từng batch (payload batch trước được giải phóng)"""
+    chunk = []
+    for vector_id, values in ids_and_values:
+        chunk.append({'id': vector_id, 'values': values, 'metadata': {}})
+        if len(chunk) >= batch_size:
+            chunk = []
+    return chunk
+
+
+def reindex_with_lists(predictions, dimension: int, batch_size: int):
+    """Luồng cũ: list(...) cho mỗi vector, giữ list đến khi upsert"""
+    vectors = [list(p['textEmbedding']) for p in predictions]
+    upsert_chunks(((f"{i}_text", v) for i, v in enumerate(vectors)), batch_size)
+    return vectors
+
+
+def reindex_with_numpy(predictions, dimension: int, batch_size: int):
+    """Luồng mới: np.fromiter vào ma trận 2-D float32, tolist() theo batch ở biên Pinecone"""
+    matrix = np.empty((len(predictions), dimension), dtype=np.float32)
+    for row, p in enumerate(predictions):
+        values = p['textEmbedding']
+        matrix[row] = np.fromiter(values, dtype=np.float32, count=len(values))
+    for start in range(0, len(matrix), batch_size):
+        rows = matrix[start:start + batch_size].tolist()
+        upsert_chunks(((f"{start + i}_text", v) for i, v in enumerate(rows)), batch_size)
+    return matrix
+
+
+def measure(label: str, fn):
+    """Đo thời gian CPU (không bật tracemalloc) và bộ nhớ giữ lại / đỉnh"""
+    start = time.process_time()
+    vectors = fn()
+    cpu = time.process_time() - start
+    del vectors
+
+    tracemalloc.start()
+    vectors = fn()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del vectors
+    print(f"  {label:<8} cpu={cpu:7.3f}s  retained={retained / 2**20:8.1f} MiB  peak={peak / 2**20:8.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark embedding list float vs np.ndarray float32")
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--dimension', type=int, default=1408)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    predictions = [make_prediction(rng, args.dimension) for _ in range(args.products)]
+
+    print(f"Reindex {args.products} sản phẩm, dimension={args.dimension}")
+    measure('list', lambda: reindex_with_lists(predictions, args.dimension, args.batch_size))
+    measure('numpy', lambda: reindex_with_numpy(predictions, args.dimension, args.batch_size))
+
+
+if __name__ == "__main__":
+    main()
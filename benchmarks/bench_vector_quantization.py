@@ -0,0 +1,162 @@
+"""
+Benchmark nén / giảm chiều vector embedding
+
+Đo cho từng cấu hình (VECTOR_INDEX_DIMENSION, VECTOR_RERANK_PRECISION):
+- Bộ nhớ mỗi vector (list Python, float32, float16, int8)
+- Kích thước payload upsert (JSON gửi lên Pinecone)
+- Recall@k so với tìm kiếm chính xác trên vector float32 đầy đủ
+
+Chạy:
+    python -m benchmarks.bench_vector_quantization
+    python -m benchmarks.bench_vector_quantization --vectors embeddings.npy --queries queries.npy \
+        --index-vectors embeddings_256.npy --index-queries queries_256.npy
+
+Mặc định dùng dữ liệu tổng hợp có phương sai giảm dần theo chiều và index giảm chiều bằng cách cắt
+prefix — chỉ để minh họa: multimodalembedding@001 không phải model Matryoshka, service lấy vector
+giảm chiều trực tiếp từ Vertex AI (tham số dimension). Trước khi đổi VECTOR_INDEX_DIMENSION, đo recall
+bằng --index-vectors / --index-queries là embedding thật của cùng dữ liệu tạo với dimension nhỏ.
+"""
+import argparse
+import json
+import sys
+
+import numpy as np
+
+from utils.vector_quantization import (
+    SUPPORTED_PRECISIONS,
+    reduce_dimension,
+    encode_vector,
+    decode_vector
+)
+
+
+def make_synthetic(n_docs: int, n_queries: int, dimension: int, seed: int):
+    """Sinh corpus + query tổng hợp, query là nhiễu quanh một document"""
+    rng = np.random.default_rng(seed)
+    decay = 1.0 / np.sqrt(1.0 + np.arange(dimension) / 32.0)
+    docs = rng.standard_normal((n_docs, dimension)).astype(np.float32) * decay
+    targets = rng.integers(0, n_docs, n_queries)
+    queries = docs[targets] + 0.6 * rng.standard_normal((n_queries, dimension)).astype(np.float32) * decay
+    return normalize_rows(docs), normalize_rows(queries)
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32)
+
+
+def top_k_ids(queries: np.ndarray, docs: np.ndarray, k: int) -> np.ndarray:
+    scores = queries @ docs.T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+
+def recall(found: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+
+def python_list_bytes(dimension: int) -> int:
+    """Dung lượng list Python chứa `dimension` float (list + từng object float)"""
+    values = [float(i) + 0.5 for i in range(dimension)]
+    return sys.getsizeof(values) + sum(sys.getsizeof(v) for v in values)
+
+
+def payload_bytes(full: np.ndarray, index_dimension: int, precision: str) -> int:
+    """Kích thước JSON của 1 vector upsert theo cấu hình"""
+    metadata = {'product_id': 1, 'business_id': 1, 'name': 'Áo thun nam', 'status': '1', 'vector_type': 'text'}
+    if index_dimension < full.shape[-1]:
+        values = reduce_dimension(full, index_dimension).tolist()
+        metadata = {**metadata, **encode_vector(full, precision)}
+    else:
+        values = full.tolist()
+    return len(json.dumps({'id': '1_text', 'values': values, 'metadata': metadata}))
+
+
+def run(docs: np.ndarray, queries: np.ndarray, k: int, oversample: int, index_docs=None, index_queries=None):
+    dimension = docs.shape[1]
+    truth = top_k_ids(queries, docs, k)
+
+    print(f"Corpus: {docs.shape[0]} vectors x {dimension} chiều, {queries.shape[0]} queries, recall@{k}\n")
+
+    print("== Bộ nhớ mỗi vector ==")
+    print(f"  list[float] Python : {python_list_bytes(dimension):>8} bytes")
+    print(f"  float32            : {dimension * 4:>8} bytes")
+    print(f"  float16            : {dimension * 2:>8} bytes")
+    print(f"  int8 (+scale)      : {dimension + 4:>8} bytes")
+    print()
+
+    # Lượng tử hóa toàn bộ vector, search không re-rank
+    print("== Search trên vector lượng tử hóa (không giảm chiều) ==")
+    for precision in SUPPORTED_PRECISIONS:
+        decoded = np.stack([decode_vector(encode_vector(v, precision)) for v in docs])
+        found = top_k_ids(queries, decoded, k)
+        print(f"  {precision:<8} recall={recall(found, truth):.4f}")
+    print()
+
+    if index_docs is not None:
+        print(f"== Index {index_docs.shape[1]} chiều (vector từ Vertex AI) + re-rank full precision ==")
+    else:
+        print("== Index giảm chiều (cắt prefix, chỉ minh họa) + re-rank full precision ==")
+    print(f"  {'index_dim':>9} {'precision':>9} {'payload':>9} {'recall_coarse':>14} {'recall_rerank':>14}")
+    full_payload = payload_bytes(docs[0], dimension, 'float32')
+    print(f"  {dimension:>9} {'-':>9} {full_payload:>9} {recall(truth, truth):>14.4f} {'-':>14}")
+    index_dimensions = (index_docs.shape[1],) if index_docs is not None else (128, 256, 512)
+    for index_dimension in index_dimensions:
+        if index_dimension >= dimension:
+            continue
+        if index_docs is not None:
+            coarse_docs, coarse_queries = index_docs, index_queries
+        else:
+            coarse_docs = normalize_rows(docs[:, :index_dimension])
+            coarse_queries = normalize_rows(queries[:, :index_dimension])
+        coarse_found = top_k_ids(coarse_queries, coarse_docs, k)
+        candidates = top_k_ids(coarse_queries, coarse_docs, k * oversample)
+        for precision in SUPPORTED_PRECISIONS:
+            decoded = np.stack([decode_vector(encode_vector(v, precision)) for v in docs])
+            reranked = []
+            for qi, cand in enumerate(candidates):
+                scores = decoded[cand] @ queries[qi]
+                reranked.append(cand[np.argsort(-scores)[:k]])
+            print(
+                f"  {index_dimension:>9} {precision:>9} {payload_bytes(docs[0], index_dimension, precision):>9} "
+                f"{recall(coarse_found, truth):>14.4f} {recall(np.array(reranked), truth):>14.4f}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark nén / giảm chiều vector embedding")
+    parser.add_argument('--vectors', help="File .npy chứa embedding corpus (N x D)")
+    parser.add_argument('--queries', help="File .npy chứa embedding query (Q x D)")
+    parser.add_argument('--index-vectors', help="File .npy chứa embedding corpus tạo với dimension nhỏ (N x d)")
+    parser.add_argument('--index-queries', help="File .npy chứa embedding query tạo với dimension nhỏ (Q x d)")
+    parser.add_argument('--docs', type=int, default=5000)
+    parser.add_argument('--num-queries', type=int, default=200)
+    parser.add_argument('--dimension', type=int, default=1408)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--oversample', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    if args.vectors:
+        docs = normalize_rows(np.load(args.vectors).astype(np.float32))
+        if args.queries:
+            queries = normalize_rows(np.load(args.queries).astype(np.float32))
+        else:
+            rng = np.random.default_rng(args.seed)
+            queries = docs[rng.integers(0, docs.shape[0], args.num_queries)]
+    else:
+        docs, queries = make_synthetic(args.docs, args.num_queries, args.dimension, args.seed)
+
+    index_docs = index_queries = None
+    if args.index_vectors:
+        if not (args.vectors and args.queries and args.index_queries):
+            parser.error("--index-vectors cần --vectors, --queries và --index-queries")
+        index_docs = normalize_rows(np.load(args.index_vectors).astype(np.float32))
+        index_queries = normalize_rows(np.load(args.index_queries).astype(np.float32))
+    
+    run(docs, queries, args.k, args.oversample, index_docs, index_queries)
+
+
+if __name__ == "__main__":
+    main()
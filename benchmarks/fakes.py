@@ -0,0 +1,276 @@
+"""
+Stand-in chạy local cho Gemini, Vertex AI và Pinecone (cho load test / benchmark offline)
+
+Các fake thay ở tầng SDK (genai.GenerativeModel, PredictionServiceClient, Pinecone Index) nên
+GeminiService / EmbeddingService / PineconeService vẫn chạy code thật (build prompt, parse protobuf,
+giảm chiều, re-rank...), chỉ lời gọi mạng là giả:
+
+- FakeGenerativeModel: độ trễ cố định + thời gian sinh token theo tốc độ cấu hình (token/giây);
+  prompt phân loại intent trả JSON hợp lệ
+- FakePredictionClient: vector chuẩn hóa sinh từ seed = hash(nội dung) nên cùng text luôn ra cùng vector
+- InMemoryIndex: cosine search brute-force, filter metadata cùng format Pinecone
+
+Dùng:
+    from benchmarks import fakes
+    fakes.apply_fake_env('sqlite:////tmp/bench.db')   # trước khi import config / main
+    fakes.install_fakes(fakes.FakeSettings(gemini_latency=0.8))
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+# Giá trị giả đủ để Config.validate() pass (không service nào dùng tới khi đã cài fake)
+FAKE_ENV = {
+    'PINECONE_API_KEY': 'fake-pinecone-key',
+    'GEMINI_API_KEY': 'fake-gemini-key',
+    'GOOGLE_PROJECT_ID': 'fake-project',
+    'GOOGLE_APPLICATION_CREDENTIALS': 'fake-credentials.json',
+}
+
+
+class FakeSettings:
+    """Độ trễ mô phỏng của các dịch vụ ngoài (giây)"""
+    
+    def __init__(
+        self,
+        gemini_latency: float = 0.5,
+        gemini_tokens_per_second: float = 100.0,
+        gemini_reply_tokens: int = 40,
+        vertex_latency: float = 0.08,
+        pinecone_latency: float = 0.03,
+        seed: int = 0
+    ):
+        """
+        Args:
+            gemini_latency: Thời gian tới token đầu tiên
+            gemini_tokens_per_second: Tốc độ sinh token
+            gemini_reply_tokens: Số token mỗi câu trả lời
+            vertex_latency: Độ trễ mỗi lần tạo embedding
+            pinecone_latency: Độ trễ mỗi thao tác Pinecone
+            seed: Seed sinh vector
+        """
+        self.gemini_latency = gemini_latency
+        self.gemini_tokens_per_second = gemini_tokens_per_second
+        self.gemini_reply_tokens = gemini_reply_tokens
+        self.vertex_latency = vertex_latency
+        self.pinecone_latency = pinecone_latency
+        self.seed = seed
+        # False: bỏ qua độ trễ (dùng khi nạp dữ liệu trước benchmark)
+        self.enabled = True
+
+
+def apply_fake_env(database_url: str, state_dir: Optional[str] = None):
+    """
+    Đặt biến môi trường giả; phải gọi trước khi import config
+    
+    Args:
+        database_url: DB dùng cho benchmark (thường là SQLite tạm)
+        state_dir: Thư mục cho checkpoint reindex / state sync / cache ảnh (tránh ghi vào .cache của project)
+    """
+    for key, value in FAKE_ENV.items():
+        os.environ.setdefault(key, value)
+    os.environ['DATABASE_URL'] = database_url
+    if state_dir:
+        os.environ['REINDEX_CHECKPOINT_DIR'] = os.path.join(state_dir, 'reindex')
+        os.environ['PRODUCT_SYNC_STATE_DIR'] = os.path.join(state_dir, 'sync')
+        os.environ['IMAGE_CACHE_DIR'] = os.path.join(state_dir, 'images')
+
+
+def estimate_tokens(text: str) -> int:
+    """Ước lượng số token (~4 ký tự / token)"""
+    return max(1, len(text) // 4)
+
+
+def _seeded_vector(content: str, dimension: int, seed: int) -> List[float]:
+    digest = hashlib.sha256(f"{seed}:{content}".encode('utf-8')).digest()
+    rng = np.random.default_rng(int.from_bytes(digest[:8], 'little'))
+    vector = rng.standard_normal(dimension).astype(np.float32)
+    vector /= np.linalg.norm(vector) or 1.0
+    return vector.tolist()
+
+
+class FakeGenerativeModel:
+    """Thay cho genai.GenerativeModel"""
+    
+    def __init__(self, model_name: str, settings: FakeSettings):
+        self.model_name = model_name
+        self.settings = settings
+        self.calls = 0
+    
+    def generate_content(self, prompt: str, generation_config: Optional[Dict[str, Any]] = None, **kwargs):
+        self.calls += 1
+        if 'intent classifier' in prompt:
+            text = self._classify(prompt)
+        else:
+            text = ("Dạ shop còn hàng ạ, bạn chọn size nào nha " * self.settings.gemini_reply_tokens)[
+                :self.settings.gemini_reply_tokens * 4
+            ].strip()
+        
+        if self.settings.enabled:
+            generation_time = estimate_tokens(text) / max(self.settings.gemini_tokens_per_second, 1e-6)
+            time.sleep(self.settings.gemini_latency + generation_time)
+        return SimpleNamespace(text=text, usage_metadata=SimpleNamespace(
+            prompt_token_count=estimate_tokens(prompt),
+            candidates_token_count=estimate_tokens(text)
+        ))
+    
+    def _classify(self, prompt: str) -> str:
+        intents_block = re.search(r'INTENTS:\s*(.*?)\s*Conversation:', prompt, re.S)
+        intents = [line.strip() for line in (intents_block.group(1) if intents_block else '').splitlines() if line.strip()]
+        if not intents:
+            intents = ['others']
+        digest = int(hashlib.md5(prompt.encode('utf-8')).hexdigest(), 16)
+        return json.dumps({'intent': intents[digest % len(intents)], 'confidence': 0.9, 'related_intents': []})
+
+
+class FakePredictionClient:
+    """Thay cho aiplatform.gapic.PredictionServiceClient (multimodalembedding)"""
+    
+    def __init__(self, settings: FakeSettings):
+        self.settings = settings
+        self.calls = 0
+    
+    def predict(self, endpoint: str, instances: List[Any], parameters: Any, timeout: Optional[float] = None):
+        self.calls += 1
+        dimension = int(parameters['dimension'])
+        predictions = []
+        for instance in instances:
+            if 'text' in instance:
+                predictions.append({'textEmbedding': _seeded_vector(instance['text'], dimension, self.settings.seed)})
+            else:
+                image = instance['image']['bytesBase64Encoded']
+                predictions.append({'imageEmbedding': _seeded_vector(image, dimension, self.settings.seed)})
+        if self.settings.enabled:
+            time.sleep(self.settings.vertex_latency)
+        return SimpleNamespace(predictions=predictions)
+
+
+class InMemoryIndex:
+    """Thay cho pinecone Index: upsert / query / update / delete trong RAM"""
+    
+    def __init__(self, settings: FakeSettings):
+        self.settings = settings
+        self._namespaces: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+    
+    def _sleep(self):
+        if self.settings.enabled:
+            time.sleep(self.settings.pinecone_latency)
+    
+    def upsert(self, vectors: List[Dict[str, Any]], namespace: str = ''):
+        with self._lock:
+            store = self._namespaces.setdefault(namespace, {})
+            for vector in vectors:
+                values = np.asarray(vector['values'], dtype=np.float32)
+                norm = np.linalg.norm(values) or 1.0
+                store[str(vector['id'])] = (values / norm, dict(vector.get('metadata') or {}))
+        self._sleep()
+        return SimpleNamespace(upserted_count=len(vectors))
+    
+    def query(self, vector, top_k: int = 10, namespace: str = '', include_metadata: bool = True, filter=None, **kwargs):
+        # Import muộn: module fakes phải import được trước khi set biến môi trường / import config
+        from utils.search_filter_parser import matches_filter
+        
+        with self._lock:
+            items = list(self._namespaces.get(namespace, {}).items())
+        if filter:
+            items = [item for item in items if matches_filter(item[1][1], filter)]
+        
+        matches = []
+        if items:
+            query = np.asarray(vector, dtype=np.float32)
+            query /= np.linalg.norm(query) or 1.0
+            matrix = np.vstack([values for _, (values, _) in items])
+            scores = matrix @ query
+            k = min(top_k, len(items))
+            top = np.argpartition(-scores, k - 1)[:k]
+            for position in top[np.argsort(-scores[top])]:
+                vector_id, (_, metadata) = items[position]
+                matches.append(SimpleNamespace(
+                    id=vector_id,
+                    score=float(scores[position]),
+                    metadata=dict(metadata) if include_metadata else None
+                ))
+        self._sleep()
+        return SimpleNamespace(matches=matches)
+    
+    def update(self, id: str, set_metadata: Optional[Dict[str, Any]] = None, namespace: str = '', **kwargs):
+        with self._lock:
+            entry = self._namespaces.get(namespace, {}).get(str(id))
+            if entry is not None and set_metadata:
+                entry[1].update(set_metadata)
+        self._sleep()
+    
+    def delete(self, ids: Optional[List[str]] = None, namespace: str = '', delete_all: bool = False, **kwargs):
+        with self._lock:
+            if delete_all:
+                self._namespaces.pop(namespace, None)
+            else:
+                store = self._namespaces.get(namespace, {})
+                for vector_id in ids or []:
+                    store.pop(str(vector_id), None)
+        self._sleep()
+    
+    def count(self, namespace: str) -> int:
+        return len(self._namespaces.get(namespace, {}))
+
+
+class FakePinecone:
+    """Thay cho pinecone.Pinecone client"""
+    
+    def __init__(self, index: InMemoryIndex, index_name: str):
+        self.index = index
+        self.index_name = index_name
+    
+    def list_indexes(self):
+        return [SimpleNamespace(name=self.index_name)]
+    
+    def Index(self, name: str) -> InMemoryIndex:
+        return self.index
+
+
+def install_fakes(settings: Optional[FakeSettings] = None) -> SimpleNamespace:
+    """
+    Thay client Gemini / Vertex AI / Pinecone bằng fake và gắn vào singleton của các service
+    
+    Returns:
+        SimpleNamespace: settings, index (InMemoryIndex), vertex (FakePredictionClient)
+    """
+    import services.embedding_service as embedding_module
+    import services.gemini_service as gemini_module
+    import services.pinecone_service as pinecone_module
+    from config import Config
+    
+    settings = settings or FakeSettings()
+    
+    # Gemini: GeminiService() tạo model qua genai.GenerativeModel
+    gemini_module.genai.GenerativeModel = lambda model_name, **kwargs: FakeGenerativeModel(model_name, settings)
+    
+    # Vertex AI: bỏ qua __init__ (cần file credentials), dùng client giả
+    vertex = FakePredictionClient(settings)
+    embedding_service = embedding_module.EmbeddingService.__new__(embedding_module.EmbeddingService)
+    embedding_service.project_id = Config.GOOGLE_PROJECT_ID
+    embedding_service.location = Config.GOOGLE_LOCATION
+    embedding_service.dimension = Config.EMBEDDING_DIMENSION
+    embedding_service.client = vertex
+    embedding_service.endpoint = 'fake/multimodalembedding@001'
+    embedding_module._embedding_service_instance = embedding_service
+    
+    # Pinecone: index trong RAM
+    index = InMemoryIndex(settings)
+    pinecone_service = pinecone_module.PineconeService.__new__(pinecone_module.PineconeService)
+    pinecone_service.pc = FakePinecone(index, Config.PINECONE_INDEX_NAME)
+    pinecone_service.index_name = Config.PINECONE_INDEX_NAME
+    pinecone_service.index_dimension = Config.VECTOR_INDEX_DIMENSION
+    pinecone_service.rerank_precision = Config.VECTOR_RERANK_PRECISION
+    pinecone_service.rerank_oversample = max(1, Config.VECTOR_RERANK_OVERSAMPLE)
+    pinecone_module._pinecone_service_instance = pinecone_service
+    
+    return SimpleNamespace(settings=settings, index=index, vertex=vertex)
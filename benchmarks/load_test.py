@@ -0,0 +1,289 @@
+"""
+Load test offline cho /api/chat/message, /api/products/vector/search và /api/products/vector/batch-upsert
+
+Mặc định chạy app trong cùng process (httpx + ASGITransport) với fake Gemini / Vertex AI / Pinecone
+(benchmarks/fakes.py) và SQLite tổng hợp, nên không cần credentials hay mạng. Báo cáo throughput
+và latency p50/p90/p95/p99 cho từng endpoint.
+
+Chạy:
+    python -m benchmarks.load_test
+    python -m benchmarks.load_test --scenario chat --concurrency 32 --requests 500 --gemini-latency 0.8
+    python -m benchmarks.load_test --json result.json        # lưu kết quả để so sánh giữa các lần chạy
+    python -m benchmarks.load_test --serve 8001              # chạy uvicorn với fake cho công cụ ngoài (wrk, k6...)
+    python -m benchmarks.load_test --base-url http://localhost:8001   # bắn vào server đang chạy
+
+Cần thêm: pip install httpx
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from benchmarks import fakes
+from benchmarks.synthetic import make_conversation, make_products
+
+SCENARIOS = ('batch-upsert', 'search', 'chat')
+
+_SEARCH_QUERIES = [
+    'áo thun đen', 'quần jean co giãn', 'giày sneaker trắng', 'túi xách da', 'váy liền màu be',
+    'áo khoác nỉ', 'mũ lưỡi trai', 'áo sơ mi linen'
+]
+_CHAT_MESSAGES = [
+    'Shop ơi còn áo thun đen size M không?', 'Quần jean giá bao nhiêu vậy shop?',
+    'Ship về Đà Nẵng mấy ngày ạ?', 'Cho mình xem mẫu váy màu be', 'Áo khoác nỉ còn hàng không shop'
+]
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Percentile theo nearest-rank trên list đã sort"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(fraction * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(name: str, latencies: List[float], errors: int, elapsed: float, concurrency: int) -> Dict[str, Any]:
+    ordered = sorted(latencies)
+    total = len(latencies) + errors
+    return {
+        'scenario': name,
+        'concurrency': concurrency,
+        'requests': total,
+        'errors': errors,
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed > 0 else 0.0,
+        'p50_ms': round(percentile(ordered, 0.50) * 1000, 1),
+        'p90_ms': round(percentile(ordered, 0.90) * 1000, 1),
+        'p95_ms': round(percentile(ordered, 0.95) * 1000, 1),
+        'p99_ms': round(percentile(ordered, 0.99) * 1000, 1),
+        'max_ms': round((ordered[-1] if ordered else 0.0) * 1000, 1)
+    }
+
+
+async def run_scenario(
+    client,
+    name: str,
+    make_request: Callable[[int], Dict[str, Any]],
+    total_requests: int,
+    concurrency: int
+) -> Dict[str, Any]:
+    """
+    Gửi `total_requests` request với tối đa `concurrency` request đồng thời
+    
+    Args:
+        client: httpx.AsyncClient
+        name: Tên scenario
+        make_request: Hàm (index) -> {'method', 'url', 'json', 'params'}
+        total_requests: Tổng số request
+        concurrency: Số worker gửi song song
+    """
+    latencies: List[float] = []
+    errors = 0
+    counter = iter(range(total_requests))
+    
+    async def worker():
+        nonlocal errors
+        for index in counter:
+            request = make_request(index)
+            start_time = time.perf_counter()
+            try:
+                response = await client.request(
+                    request.get('method', 'POST'),
+                    request['url'],
+                    json=request.get('json'),
+                    params=request.get('params')
+                )
+                body = response.json()
+                ok = response.status_code == 200 and str(body.get('code')) == '200'
+            except Exception:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - start_time)
+            else:
+                errors += 1
+    
+    start_time = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(name, latencies, errors, time.perf_counter() - start_time, concurrency)
+
+
+def build_requests(args, business_ids: List[int]) -> Dict[str, Callable[[int], Dict[str, Any]]]:
+    rng = random.Random(args.seed)
+    
+    def chat_request(index: int) -> Dict[str, Any]:
+        business_id = business_ids[index % len(business_ids)]
+        return {
+            'url': '/api/chat/message',
+            'json': {
+                'message': rng.choice(_CHAT_MESSAGES),
+                'conversations': make_conversation(args.history, seed=index),
+                'customer_id': 1000 + index,
+                'business_id': business_id
+            }
+        }
+    
+    def search_request(index: int) -> Dict[str, Any]:
+        business_id = business_ids[index % len(business_ids)]
+        return {
+            'url': '/api/products/vector/search',
+            'json': {
+                'query_text': rng.choice(_SEARCH_QUERIES),
+                'namespace': f"business_{business_id}",
+                'top_k': 10,
+                'filter': {'status': '1'},
+                'search_type': 'text'
+            }
+        }
+    
+    def batch_upsert_request(index: int) -> Dict[str, Any]:
+        # Business riêng cho batch-upsert để không làm đổi kết quả search
+        business_id = 900000 + index
+        products = make_products(business_id, args.batch_size, seed=args.seed, start_id=index * args.batch_size + 1)
+        namespace = f"business_{business_id}"
+        return {
+            'url': '/api/products/vector/batch-upsert',
+            'params': {'namespace': namespace},
+            'json': [
+                {
+                    'product_id': product['id'],
+                    'namespace': namespace,
+                    'business_id': business_id,
+                    'name': product['name'],
+                    'description': product['description'],
+                    'price': product['price'],
+                    'quantity_avail': product['quantity_avail'],
+                    'status': product['status'],
+                    'metadata': product['metadata']
+                }
+                for product in products
+            ]
+        }
+    
+    return {'chat': chat_request, 'search': search_request, 'batch-upsert': batch_upsert_request}
+
+
+def prepare_local_app(args):
+    """Cài fake, sinh DB + index tổng hợp, trả về (app, business_ids)"""
+    state_dir = tempfile.mkdtemp(prefix='bench-')
+    db_path = args.db or os.path.join(state_dir, 'bench.db')
+    fakes.apply_fake_env(f"sqlite:///{db_path}", state_dir=state_dir)
+    
+    settings = fakes.FakeSettings(
+        gemini_latency=args.gemini_latency,
+        gemini_tokens_per_second=args.gemini_tps,
+        gemini_reply_tokens=args.reply_tokens,
+        vertex_latency=args.vertex_latency,
+        pinecone_latency=args.pinecone_latency,
+        seed=args.seed
+    )
+    installed = fakes.install_fakes(settings)
+    
+    import main
+    from database import engine
+    # Log INFO của từng request làm sai lệch số đo
+    logging.getLogger().setLevel(args.log_level)
+    from benchmarks.synthetic import seed_database
+    from services.reindex_service import ReindexService
+    
+    business_ids = seed_database(engine, args.businesses, args.products, seed=args.seed)
+    # App không chạy startup event: tạo bảng Conversation_Message giống lúc khởi động
+    main.prepare_conversation_store()
+    
+    # Nạp vector cho catalog tổng hợp (không tính độ trễ giả)
+    settings.enabled = False
+    reindex = ReindexService()
+    for business_id in business_ids:
+        reindex.reindex_business(business_id, resume=False)
+    settings.enabled = True
+    print(
+        f"Đã chuẩn bị {len(business_ids)} business x {args.products} sản phẩm "
+        f"({sum(installed.index.count(f'business_{b}') for b in business_ids)} vectors), DB: {db_path}",
+        file=sys.stderr
+    )
+    return main.app, business_ids
+
+
+async def run(args) -> List[Dict[str, Any]]:
+    import httpx
+    
+    if args.base_url:
+        transport = None
+        base_url = args.base_url
+        business_ids = list(range(1, args.businesses + 1))
+    else:
+        app, business_ids = prepare_local_app(args)
+        transport = httpx.ASGITransport(app=app)
+        base_url = 'http://loadtest'
+    
+    builders = build_requests(args, business_ids)
+    scenarios = SCENARIOS if args.scenario == 'all' else (args.scenario,)
+    results = []
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=args.timeout) as client:
+        for name in scenarios:
+            result = await run_scenario(client, name, builders[name], args.requests, args.concurrency)
+            results.append(result)
+            print_result(result)
+    return results
+
+
+def print_result(result: Dict[str, Any]):
+    print(
+        f"{result['scenario']:<13} c={result['concurrency']:<4} n={result['requests']:<6} "
+        f"lỗi={result['errors']:<4} {result['throughput_rps']:>8.2f} req/s  "
+        f"p50={result['p50_ms']:>8.1f}ms p90={result['p90_ms']:>8.1f}ms "
+        f"p95={result['p95_ms']:>8.1f}ms p99={result['p99_ms']:>8.1f}ms max={result['max_ms']:>8.1f}ms"
+    )
+
+
+def serve(args):
+    """Chạy uvicorn với fake đã cài để dùng công cụ load test bên ngoài"""
+    import uvicorn
+    
+    app, _ = prepare_local_app(args)
+    uvicorn.run(app, host='127.0.0.1', port=args.serve, log_level='warning')
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', choices=SCENARIOS + ('all',), default='all')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=200, help='Số request mỗi scenario')
+    parser.add_argument('--businesses', type=int, default=3)
+    parser.add_argument('--products', type=int, default=200, help='Số sản phẩm mỗi business')
+    parser.add_argument('--history', type=int, default=10, help='Số tin nhắn lịch sử mỗi request chat')
+    parser.add_argument('--batch-size', type=int, default=20, help='Số sản phẩm mỗi request batch-upsert')
+    parser.add_argument('--gemini-latency', type=float, default=0.5)
+    parser.add_argument('--gemini-tps', type=float, default=100.0, help='Token/giây khi sinh câu trả lời')
+    parser.add_argument('--reply-tokens', type=int, default=40)
+    parser.add_argument('--vertex-latency', type=float, default=0.08)
+    parser.add_argument('--pinecone-latency', type=float, default=0.03)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--timeout', type=float, default=120.0)
+    parser.add_argument('--db', help='File SQLite (mặc định tạo file tạm)')
+    parser.add_argument('--base-url', help='Bắn vào server đang chạy thay vì app trong process')
+    parser.add_argument('--serve', type=int, metavar='PORT', help='Chạy server với fake thay vì load test')
+    parser.add_argument('--json', help='Ghi kết quả ra file JSON')
+    parser.add_argument('--log-level', default='WARNING')
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    if args.serve:
+        serve(args)
+        return
+    
+    results = asyncio.run(run(args))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'args': vars(args), 'results': results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""
+Dữ liệu tổng hợp cho benchmark: business, sản phẩm, lịch sử chat (deterministic theo seed)
+"""
+import json
+import random
+from typing import Any, Dict, List
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+_PRODUCT_TYPES = ['Áo thun', 'Áo sơ mi', 'Quần jean', 'Váy liền', 'Giày sneaker', 'Túi xách', 'Mũ lưỡi trai', 'Áo khoác']
+_ADJECTIVES = ['basic', 'oversize', 'form rộng', 'cổ tròn', 'cao cấp', 'thể thao', 'vintage', 'trơn']
+_COLORS = ['đen', 'trắng', 'đỏ', 'xanh navy', 'be', 'xám', 'hồng', 'nâu']
+_MATERIALS = ['cotton 100%', 'linen', 'jean co giãn', 'da PU', 'nỉ bông', 'kaki']
+_SIZES = ['S', 'M', 'L', 'XL', 'XXL']
+_USER_MESSAGES = [
+    'Shop ơi áo thun đen còn size M không ạ?',
+    'Cho mình xem mẫu quần jean dưới 300k',
+    'Ship về Hà Nội mất mấy ngày vậy shop?',
+    'Áo này chất liệu gì vậy ạ?',
+    'Mình muốn đặt 2 cái, giao tới quận 7',
+    'Có mẫu nào màu be không shop'
+]
+_BOT_MESSAGES = [
+    'Dạ còn size M ạ',
+    'Dạ shop gửi bạn mẫu SP012 giá 259.000đ nha',
+    'Dạ giao Hà Nội 2-3 ngày ạ',
+    'Dạ chất cotton 100% mặc mát lắm ạ'
+]
+
+# DDL tối giản cho SQLite (model Product khai báo ForeignKey tới 'business' nên không create_all được)
+_SQLITE_DDL = [
+    """CREATE TABLE IF NOT EXISTS Business (
+        id INTEGER PRIMARY KEY, name VARCHAR(255) NOT NULL, phone VARCHAR(20), address VARCHAR(255),
+        description TEXT, status INTEGER DEFAULT 1, metadata JSON, style JSON,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )""",
+    """CREATE TABLE IF NOT EXISTS Product (
+        id INTEGER PRIMARY KEY, business_id INTEGER NOT NULL, name VARCHAR(255) NOT NULL, description TEXT,
+        price DECIMAL(10, 2) NOT NULL, main_image_url VARCHAR(255), detail_image_url TEXT,
+        quantity_avail INTEGER DEFAULT 0, status VARCHAR(50) DEFAULT '1', metadata TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )"""
+]
+
+
+def make_business(business_id: int) -> Dict[str, Any]:
+    """Thông tin cửa hàng tổng hợp"""
+    return {
+        'id': business_id,
+        'name': f"Shop thời trang {business_id}",
+        'phone': f"09{business_id:08d}"[-10:],
+        'address': f"{business_id} Nguyễn Trãi, Quận 1, TP.HCM",
+        'description': 'Chuyên quần áo, giày dép, phụ kiện thời trang nam nữ',
+        'status': 1,
+        'metadata': {'Giờ mở cửa': '8h - 22h', 'Chính sách đổi trả': 'Đổi trong 7 ngày'}
+    }
+
+
+def make_products(business_id: int, count: int, seed: int = 0, start_id: int = 1) -> List[Dict[str, Any]]:
+    """
+    Sinh `count` sản phẩm cho business
+    
+    Returns:
+        List[Dict]: Cùng field với bảng Product (metadata là dict)
+    """
+    rng = random.Random(f"{seed}:{business_id}")
+    products = []
+    for offset in range(count):
+        product_type = rng.choice(_PRODUCT_TYPES)
+        color = rng.choice(_COLORS)
+        name = f"{product_type} {rng.choice(_ADJECTIVES)} {color} SP{start_id + offset:05d}"
+        products.append({
+            'id': start_id + offset,
+            'business_id': business_id,
+            'name': name,
+            'description': (
+                f"{product_type} chất liệu {rng.choice(_MATERIALS)}, màu {color}, "
+                f"phù hợp đi làm, đi chơi. Giặt máy được, không phai màu."
+            ),
+            'price': float(rng.randrange(99, 1500) * 1000),
+            'main_image_url': None,
+            'detail_image_url': None,
+            'quantity_avail': rng.randrange(0, 200),
+            'status': '1' if rng.random() < 0.9 else '2',
+            'metadata': {
+                'size': ', '.join(rng.sample(_SIZES, rng.randrange(1, len(_SIZES) + 1))),
+                'chất liệu': rng.choice(_MATERIALS)
+            }
+        })
+    return products
+
+
+def make_conversation(length: int, seed: int = 0) -> List[Dict[str, str]]:
+    """Lịch sử chat xen kẽ user / assistant"""
+    rng = random.Random(seed)
+    return [
+        {
+            'role': 'user' if i % 2 == 0 else 'assistant',
+            'content': rng.choice(_USER_MESSAGES if i % 2 == 0 else _BOT_MESSAGES)
+        }
+        for i in range(length)
+    ]
+
+
+def seed_database(engine: Engine, businesses: int, products_per_business: int, seed: int = 0) -> List[int]:
+    """
+    Tạo bảng (SQLite) và ghi business + sản phẩm tổng hợp
+    
+    Returns:
+        List[int]: business_id đã tạo
+    """
+    business_ids = list(range(1, businesses + 1))
+    with engine.begin() as conn:
+        if engine.dialect.name == 'sqlite':
+            for ddl in _SQLITE_DDL:
+                conn.execute(text(ddl))
+        conn.execute(text("DELETE FROM Product"))
+        conn.execute(text("DELETE FROM Business"))
+        
+        next_id = 1
+        for business_id in business_ids:
+            business = make_business(business_id)
+            conn.execute(
+                text(
+                    "INSERT INTO Business (id, name, phone, address, description, status, metadata) "
+                    "VALUES (:id, :name, :phone, :address, :description, :status, :metadata)"
+                ),
+                {**business, 'metadata': json.dumps(business['metadata'], ensure_ascii=False)}
+            )
+            products = make_products(business_id, products_per_business, seed=seed, start_id=next_id)
+            next_id += len(products)
+            if products:
+                conn.execute(
+                    text(
+                        "INSERT INTO Product (id, business_id, name, description, price, main_image_url, "
+                        "detail_image_url, quantity_avail, status, metadata) VALUES (:id, :business_id, :name, "
+                        ":description, :price, :main_image_url, :detail_image_url, :quantity_avail, :status, :metadata)"
+                    ),
+                    [{**product, 'metadata': json.dumps(product['metadata'], ensure_ascii=False)} for product in products]
+                )
+    return business_ids
@@ -4,6 +4,8 @@ Configuration cho ứng dụng
 import os
 from dotenv import load_dotenv
 
+from utils.vector_quantization import SUPPORTED_EMBEDDING_DIMENSIONS, SUPPORTED_PRECISIONS
+
 # Load environment variables từ file .env
 load_dotenv()
 
@@ -39,11 +41,148 @@ class Config:
     GOOGLE_LOCATION = os.getenv('GOOGLE_LOCATION', 'us-central1')
     EMBEDDING_DIMENSION = int(os.getenv('EMBEDDING_DIMENSION', '1408'))
     
+    # Giảm chiều / nén vector lưu trong Pinecone
+    # VECTOR_INDEX_DIMENSION < EMBEDDING_DIMENSION: index lưu vector Vertex AI tạo với dimension nhỏ
+    # (thêm 1 lời gọi Vertex AI mỗi embedding), vector đầy đủ được nén (float16/int8) trong metadata để re-rank
+    VECTOR_INDEX_DIMENSION = int(os.getenv('VECTOR_INDEX_DIMENSION', str(EMBEDDING_DIMENSION)))
+    VECTOR_RERANK_PRECISION = os.getenv('VECTOR_RERANK_PRECISION', 'int8')  # float32 | float16 | int8
+    VECTOR_RERANK_OVERSAMPLE = int(os.getenv('VECTOR_RERANK_OVERSAMPLE', '4'))  # top_k * oversample ứng viên
+    
     # Gemini LLM
     GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
     
     # Giới hạn tải ảnh (bytes) khi tạo embedding - giảm băng thông
     MAX_IMAGE_DOWNLOAD_BYTES = int(os.getenv('MAX_IMAGE_DOWNLOAD_BYTES', '2_097_152'))  # mặc định 2MB
+    # Ảnh được thu nhỏ về cạnh dài tối đa và nén JPEG trước khi gửi Vertex AI - giảm payload upload
+    EMBEDDING_IMAGE_MAX_SIDE = int(os.getenv('EMBEDDING_IMAGE_MAX_SIDE', '512'))
+    EMBEDDING_IMAGE_JPEG_QUALITY = int(os.getenv('EMBEDDING_IMAGE_JPEG_QUALITY', '85'))
+    
+    # HTTP client dùng chung khi tải ảnh (keep-alive, giới hạn kết nối mỗi host)
+    HTTP_POOL_CONNECTIONS = int(os.getenv('HTTP_POOL_CONNECTIONS', '10'))  # số host giữ pool
+    HTTP_POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', '8'))  # số kết nối tối đa mỗi host
+    # Cache ảnh theo ETag/Last-Modified (để trống để tắt)
+    IMAGE_CACHE_DIR = os.getenv('IMAGE_CACHE_DIR', os.path.join(os.path.dirname(__file__), '.cache', 'images'))
+    IMAGE_CACHE_MAX_ENTRIES = int(os.getenv('IMAGE_CACHE_MAX_ENTRIES', '20000'))
+    
+    # Batch upsert / job chạy nền
+    VECTOR_UPSERT_BATCH_SIZE = int(os.getenv('VECTOR_UPSERT_BATCH_SIZE', '50'))  # số sản phẩm mỗi lần upsert
+    VECTOR_UPSERT_EMBED_WORKERS = int(os.getenv('VECTOR_UPSERT_EMBED_WORKERS', '4'))  # số sản phẩm tạo vectors song song mỗi batch
+    VECTOR_JOB_WORKERS = int(os.getenv('VECTOR_JOB_WORKERS', '2'))  # số job chạy đồng thời
+    VECTOR_JOB_MAX_PENDING = int(os.getenv('VECTOR_JOB_MAX_PENDING', '100'))  # số job chưa xong tối đa
+    
+    # Reindex toàn bộ catalog từ bảng Product
+    REINDEX_BATCH_SIZE = int(os.getenv('REINDEX_BATCH_SIZE', '50'))  # số sản phẩm mỗi batch đọc DB / upsert
+    REINDEX_EMBED_WORKERS = int(os.getenv('REINDEX_EMBED_WORKERS', '4'))  # số thread gọi Vertex AI song song
+    REINDEX_CHECKPOINT_DIR = os.getenv('REINDEX_CHECKPOINT_DIR', os.path.join(os.path.dirname(__file__), '.cache', 'reindex'))
+    
+    # Incremental sync theo Product.updated_at
+    PRODUCT_SYNC_INTERVAL_SECONDS = int(os.getenv('PRODUCT_SYNC_INTERVAL_SECONDS', '0'))  # 0 = tắt worker nền
+    PRODUCT_SYNC_BATCH_SIZE = int(os.getenv('PRODUCT_SYNC_BATCH_SIZE', '100'))  # số sản phẩm thay đổi mỗi batch
+    PRODUCT_SYNC_LAG_SECONDS = int(os.getenv('PRODUCT_SYNC_LAG_SECONDS', '5'))  # bỏ qua thay đổi mới hơn now - lag
+    PRODUCT_SYNC_STATE_DIR = os.getenv('PRODUCT_SYNC_STATE_DIR', os.path.join(os.path.dirname(__file__), '.cache', 'sync'))
+    PRODUCT_SYNC_COMPACT_BATCHES = int(os.getenv('PRODUCT_SYNC_COMPACT_BATCHES', '50'))  # số batch ghi journal trước khi ghi lại toàn bộ state
+    PINECONE_UPDATE_WORKERS = int(os.getenv('PINECONE_UPDATE_WORKERS', '8'))  # số request update metadata Pinecone song song
+    
+    # Hybrid search: BM25 theo từ khóa + vector search, gộp bằng Reciprocal Rank Fusion
+    HYBRID_SEARCH_ENABLED = os.getenv('HYBRID_SEARCH_ENABLED', 'true').lower() == 'true'
+    HYBRID_VECTOR_TOP_K = int(os.getenv('HYBRID_VECTOR_TOP_K', '6'))  # số vector lấy từ Pinecone
+    HYBRID_LEXICAL_TOP_K = int(os.getenv('HYBRID_LEXICAL_TOP_K', '10'))  # số sản phẩm lấy từ BM25
+    HYBRID_RRF_K = int(os.getenv('HYBRID_RRF_K', '60'))
+    LEXICAL_INDEX_TTL_SECONDS = int(os.getenv('LEXICAL_INDEX_TTL_SECONDS', '300'))  # thời gian giữ index BM25 mỗi business
+    CONTEXT_FRAGMENT_MAX_BUSINESSES = int(os.getenv('CONTEXT_FRAGMENT_MAX_BUSINESSES', '200'))  # số business giữ fragment context đã render
+    
+    # Trích xuất điều kiện lọc (giá, còn hàng, danh mục) từ tin nhắn tìm sản phẩm
+    FILTERED_VECTOR_TOP_K = int(os.getenv('FILTERED_VECTOR_TOP_K', '4'))  # top_k khi đã có filter (kết quả đã đúng điều kiện)
+    SEARCH_CATEGORY_FIELD = os.getenv('SEARCH_CATEGORY_FIELD', '')  # trường metadata chứa danh mục, ví dụ 'category' (trống = không lọc)
+    
+    # Tracing theo request (span OpenTelemetry-compatible)
+    TRACE_EXPORT_FILE = os.getenv('TRACE_EXPORT_FILE', '')  # file JSON lines OTLP (trống = không ghi)
+    TRACE_OTLP_ENDPOINT = os.getenv('TRACE_OTLP_ENDPOINT', '')  # collector OTLP/HTTP, ví dụ http://localhost:4318/v1/traces
+    TRACE_SERVICE_NAME = os.getenv('TRACE_SERVICE_NAME', 'product-vector-api')
+    TRACE_TIMING_HEADER = os.getenv('TRACE_TIMING_HEADER', 'false').lower() == 'true'  # trả header Server-Timing
+    
+    # Prometheus metrics (/metrics)
+    METRICS_MAX_BUSINESS_LABELS = int(os.getenv('METRICS_MAX_BUSINESS_LABELS', '50'))  # business vượt quá gộp thành 'other'
+    
+    # Gemini context caching: instruction + context sản phẩm cache phía Gemini theo business
+    GEMINI_CONTEXT_CACHE_ENABLED = os.getenv('GEMINI_CONTEXT_CACHE_ENABLED', 'false').lower() == 'true'
+    GEMINI_CONTEXT_CACHE_TTL_SECONDS = int(os.getenv('GEMINI_CONTEXT_CACHE_TTL_SECONDS', '3600'))
+    GEMINI_CONTEXT_CACHE_MIN_TOKENS = int(os.getenv('GEMINI_CONTEXT_CACHE_MIN_TOKENS', '4096'))  # prefix nhỏ hơn gửi thẳng trong prompt
+    
+    # Lịch sử chat trong prompt: ngân sách token + tóm tắt cuộn phần cũ theo khách hàng
+    HISTORY_TOKEN_BUDGET_CHAT = int(os.getenv('HISTORY_TOKEN_BUDGET_CHAT', '1200'))  # generate_chat_response
+    HISTORY_TOKEN_BUDGET_RESPONSE = int(os.getenv('HISTORY_TOKEN_BUDGET_RESPONSE', '300'))  # generate_response (orchestrator)
+    HISTORY_TOKEN_BUDGET_INTENT = int(os.getenv('HISTORY_TOKEN_BUDGET_INTENT', '150'))  # classify_intent (không tóm tắt)
+    HISTORY_MIN_RECENT_MESSAGES = int(os.getenv('HISTORY_MIN_RECENT_MESSAGES', '2'))  # luôn giữ nguyên văn dù vượt ngân sách
+    HISTORY_SUMMARY_MODE = os.getenv('HISTORY_SUMMARY_MODE', 'extractive')  # 'extractive' (rule) hoặc 'llm' (Gemini)
+    HISTORY_SUMMARY_MAX_TOKENS = int(os.getenv('HISTORY_SUMMARY_MAX_TOKENS', '300'))
+    HISTORY_SUMMARY_CACHE_SIZE = int(os.getenv('HISTORY_SUMMARY_CACHE_SIZE', '10000'))  # số khách hàng giữ tóm tắt
+    HISTORY_SUMMARY_TTL_SECONDS = int(os.getenv('HISTORY_SUMMARY_TTL_SECONDS', '86400'))
+    
+    # Lưu lịch sử chat phía server theo (business_id, customer_id): bảng Conversation_Message + cache RAM
+    CONVERSATION_STORE_ENABLED = os.getenv('CONVERSATION_STORE_ENABLED', 'true').lower() == 'true'
+    CONVERSATION_MAX_MESSAGES = int(os.getenv('CONVERSATION_MAX_MESSAGES', '200'))  # số tin nhắn gần nhất đọc / giữ mỗi khách
+    CONVERSATION_HOT_CUSTOMERS = int(os.getenv('CONVERSATION_HOT_CUSTOMERS', '10000'))  # số cuộc trò chuyện giữ trong RAM
+    CONVERSATION_HOT_TTL_SECONDS = int(os.getenv('CONVERSATION_HOT_TTL_SECONDS', '300'))  # đọc lại DB sau khoảng này (nhiều worker)
+    CONVERSATION_RETENTION_DAYS = int(os.getenv('CONVERSATION_RETENTION_DAYS', '90'))  # xóa tin nhắn cũ hơn (0 = giữ mãi)
+    
+    # Cache câu trả lời theo độ tương đồng của câu hỏi (intent ít phụ thuộc ngữ cảnh)
+    RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+    RESPONSE_CACHE_INTENTS = [
+        intent.strip() for intent in os.getenv('RESPONSE_CACHE_INTENTS', 'store_info,policy_shipping,greetings').split(',')
+        if intent.strip()
+    ]
+    RESPONSE_CACHE_SIMILARITY = float(os.getenv('RESPONSE_CACHE_SIMILARITY', '0.92'))  # cosine tối thiểu để dùng lại câu trả lời
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '200'))  # số câu hỏi mỗi (business, intent)
+    RESPONSE_CACHE_TTL_SECONDS = int(os.getenv('RESPONSE_CACHE_TTL_SECONDS', '3600'))
+    
+    # Memo kết quả Gemini cho lời gọi temperature 0 (cùng model + prompt -> cùng kết quả)
+    GEMINI_MEMO_ENABLED = os.getenv('GEMINI_MEMO_ENABLED', 'true').lower() == 'true'
+    GEMINI_MEMO_TTL_SECONDS = int(os.getenv('GEMINI_MEMO_TTL_SECONDS', '600'))
+    GEMINI_MEMO_MAX_ENTRIES = int(os.getenv('GEMINI_MEMO_MAX_ENTRIES', '5000'))  # số entry trong RAM mỗi worker
+    GEMINI_MEMO_DIR = os.getenv('GEMINI_MEMO_DIR', '')  # thư mục dùng chung giữa các worker (trống = chỉ RAM)
+    GEMINI_MEMO_DISK_MAX_ENTRIES = int(os.getenv('GEMINI_MEMO_DISK_MAX_ENTRIES', '50000'))
+    
+    # Gộp các lời gọi Gemini / embedding / Pinecone giống hệt nhau đang chạy đồng thời thành một request
+    SINGLE_FLIGHT_ENABLED = os.getenv('SINGLE_FLIGHT_ENABLED', 'true').lower() == 'true'
+    
+    # Quota Gemini phía client (mỗi worker; chia quota của project cho số worker). 0 = không giới hạn
+    GEMINI_RPM = int(os.getenv('GEMINI_RPM', '1000'))  # request / phút
+    GEMINI_TPM = int(os.getenv('GEMINI_TPM', '1000000'))  # token / phút (prompt + output ước lượng)
+    GEMINI_OUTPUT_TOKENS_ESTIMATE = int(os.getenv('GEMINI_OUTPUT_TOKENS_ESTIMATE', '512'))
+    GEMINI_MAX_QUEUE = int(os.getenv('GEMINI_MAX_QUEUE', '200'))  # số lời gọi chờ lượt tối đa
+    GEMINI_QUEUE_TIMEOUT_SECONDS = float(os.getenv('GEMINI_QUEUE_TIMEOUT_SECONDS', '20'))
+    GEMINI_BACKGROUND_TIMEOUT_SECONDS = float(os.getenv('GEMINI_BACKGROUND_TIMEOUT_SECONDS', '5'))  # tác vụ phụ có fallback
+    GEMINI_MAX_RETRIES = int(os.getenv('GEMINI_MAX_RETRIES', '3'))  # thử lại khi 429 / 503
+    GEMINI_RETRY_BASE_SECONDS = float(os.getenv('GEMINI_RETRY_BASE_SECONDS', '0.5'))
+    GEMINI_RETRY_MAX_SECONDS = float(os.getenv('GEMINI_RETRY_MAX_SECONDS', '8'))
+    
+    # Giới hạn đồng thời tự điều chỉnh cho /api/chat/message và /api/products/vector/search (mỗi worker)
+    CONCURRENCY_LIMIT_ENABLED = os.getenv('CONCURRENCY_LIMIT_ENABLED', 'true').lower() == 'true'
+    CONCURRENCY_LIMIT_INITIAL = int(os.getenv('CONCURRENCY_LIMIT_INITIAL', '20'))
+    CONCURRENCY_LIMIT_MIN = int(os.getenv('CONCURRENCY_LIMIT_MIN', '2'))
+    CONCURRENCY_LIMIT_MAX = int(os.getenv('CONCURRENCY_LIMIT_MAX', '200'))
+    CONCURRENCY_LIMIT_TOLERANCE = float(os.getenv('CONCURRENCY_LIMIT_TOLERANCE', '2.0'))  # latency được tăng tới 2x trước khi giảm limit
+    
+    # Deadline của request và ngân sách thời gian từng bước (giây)
+    CHAT_DEADLINE_SECONDS = float(os.getenv('CHAT_DEADLINE_SECONDS', '30'))  # /api/chat/message
+    SEARCH_DEADLINE_SECONDS = float(os.getenv('SEARCH_DEADLINE_SECONDS', '10'))  # /api/products/vector/search
+    STAGE_TIMEOUT_INTENT_SECONDS = float(os.getenv('STAGE_TIMEOUT_INTENT_SECONDS', '6'))
+    STAGE_TIMEOUT_EMBEDDING_SECONDS = float(os.getenv('STAGE_TIMEOUT_EMBEDDING_SECONDS', '4'))
+    STAGE_TIMEOUT_VECTOR_SEARCH_SECONDS = float(os.getenv('STAGE_TIMEOUT_VECTOR_SEARCH_SECONDS', '3'))
+    STAGE_TIMEOUT_IMAGE_DOWNLOAD_SECONDS = float(os.getenv('STAGE_TIMEOUT_IMAGE_DOWNLOAD_SECONDS', '10'))
+    STAGE_TIMEOUT_LLM_SECONDS = float(os.getenv('STAGE_TIMEOUT_LLM_SECONDS', '20'))
+    # Thời gian giữ lại cho bước tạo câu trả lời: còn ít hơn thì bỏ vector search, trả lời từ context có sẵn
+    RESPONSE_RESERVE_SECONDS = float(os.getenv('RESPONSE_RESERVE_SECONDS', '8'))
+    SEARCH_FALLBACK_MAX_PRODUCTS = int(os.getenv('SEARCH_FALLBACK_MAX_PRODUCTS', '20'))  # số sản phẩm còn hàng đưa vào context khi không tìm kiếm được
+    DEADLINE_EXECUTOR_WORKERS = int(os.getenv('DEADLINE_EXECUTOR_WORKERS', '32'))  # thread cho lời gọi Gemini có timeout
+    
+    # Circuit breaker cho Gemini / Vertex AI / Pinecone: tỉ lệ lỗi vượt ngưỡng thì ngắt, dùng fallback
+    CIRCUIT_BREAKER_ENABLED = os.getenv('CIRCUIT_BREAKER_ENABLED', 'true').lower() == 'true'
+    CIRCUIT_FAILURE_RATE = float(os.getenv('CIRCUIT_FAILURE_RATE', '0.5'))  # tỉ lệ lỗi để mở circuit
+    CIRCUIT_MIN_CALLS = int(os.getenv('CIRCUIT_MIN_CALLS', '10'))  # số lời gọi tối thiểu trong cửa sổ
+    CIRCUIT_WINDOW_SECONDS = float(os.getenv('CIRCUIT_WINDOW_SECONDS', '30'))
+    CIRCUIT_OPEN_SECONDS = float(os.getenv('CIRCUIT_OPEN_SECONDS', '15'))  # thời gian ngắt trước khi gọi thử
     
     @classmethod
     def validate(cls):
@@ -59,10 +198,34 @@ class Config:
         if not cls.GOOGLE_PROJECT_ID:
             errors.append("GOOGLE_PROJECT_ID không được tìm thấy")
         
-        if cls.PINECONE_DIMENSION != cls.EMBEDDING_DIMENSION:
+        if cls.EMBEDDING_DIMENSION not in SUPPORTED_EMBEDDING_DIMENSIONS:
+            errors.append(
+                f"EMBEDDING_DIMENSION ({cls.EMBEDDING_DIMENSION}) phải là một trong "
+                f"{SUPPORTED_EMBEDDING_DIMENSIONS}"
+            )
+        
+        if cls.VECTOR_INDEX_DIMENSION not in SUPPORTED_EMBEDDING_DIMENSIONS:
+            errors.append(
+                f"VECTOR_INDEX_DIMENSION ({cls.VECTOR_INDEX_DIMENSION}) phải là một trong "
+                f"{SUPPORTED_EMBEDDING_DIMENSIONS}"
+            )
+        
+        if cls.VECTOR_INDEX_DIMENSION > cls.EMBEDDING_DIMENSION:
+            errors.append(
+                f"VECTOR_INDEX_DIMENSION ({cls.VECTOR_INDEX_DIMENSION}) "
+                f"không được lớn hơn EMBEDDING_DIMENSION ({cls.EMBEDDING_DIMENSION})"
+            )
+        
+        if cls.VECTOR_RERANK_PRECISION not in SUPPORTED_PRECISIONS:
+            errors.append(
+                f"VECTOR_RERANK_PRECISION ({cls.VECTOR_RERANK_PRECISION}) phải là một trong "
+                f"{SUPPORTED_PRECISIONS}"
+            )
+        
+        if cls.PINECONE_DIMENSION != cls.VECTOR_INDEX_DIMENSION:
             errors.append(
                 f"PINECONE_DIMENSION ({cls.PINECONE_DIMENSION}) "
-                f"phải khớp với EMBEDDING_DIMENSION ({cls.EMBEDDING_DIMENSION})"
+                f"phải khớp với VECTOR_INDEX_DIMENSION ({cls.VECTOR_INDEX_DIMENSION})"
             )
         
         if errors:
@@ -1,10 +1,13 @@
 """
 Database configuration và session management
 """
-from sqlalchemy import create_engine
+from datetime import datetime
+
+from sqlalchemy import create_engine, func, select
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.pool import NullPool
 from config import Config
+from utils.metrics import instrument_engine
 
 # Tạo engine
 engine = create_engine(
@@ -12,6 +15,8 @@ engine = create_engine(
     poolclass=NullPool,
     echo=False  # Set True để debug SQL queries
 )
+# Đếm số câu lệnh SQL / thời gian chạy cho /metrics
+instrument_engine(engine)
 
 # Tạo session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -28,3 +33,11 @@ def get_db():
     finally:
         db.close()
 
+
+def get_db_now(db: Session) -> datetime:
+    """Thời gian hiện tại theo DB (cùng múi giờ với các cột created_at / updated_at)"""
+    now = db.execute(select(func.now())).scalar()
+    if isinstance(now, str):
+        # SQLite trả CURRENT_TIMESTAMP dạng chuỗi
+        now = datetime.fromisoformat(now)
+    return now
@@ -1,7 +1,7 @@
 """
 Main application entry point
 """
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import RequestValidationError
 import logging
@@ -12,6 +12,13 @@ from middleware.exception_handler import (
     validation_exception_handler,
     general_exception_handler
 )
+from middleware.tracing import TracingMiddleware
+from middleware.load_shedding import LoadSheddingMiddleware
+from middleware.deadline import DeadlineMiddleware
+from utils.concurrency_limiter import AdaptiveConcurrencyLimiter
+from utils.tracing import get_trace_exporter
+from utils.metrics import render_metrics
+from utils.circuit_breaker import get_circuit_states
 
 # Validate config khi khởi động
 try:
@@ -44,6 +51,22 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Deadline cho request chat / search: các bước bên trong lấy timeout theo thời gian còn lại
+app.add_middleware(DeadlineMiddleware, deadlines={
+    '/api/chat/message': Config.CHAT_DEADLINE_SECONDS,
+    '/api/products/vector/search': Config.SEARCH_DEADLINE_SECONDS,
+})
+
+# Giới hạn đồng thời cho các route gọi Gemini / Vertex AI / Pinecone: quá tải thì trả 503 ngay
+if Config.CONCURRENCY_LIMIT_ENABLED:
+    app.add_middleware(LoadSheddingMiddleware, limiters={
+        '/api/chat/message': AdaptiveConcurrencyLimiter('chat'),
+        '/api/products/vector/search': AdaptiveConcurrencyLimiter('search'),
+    })
+
+# Trace từng request (span cho DB, intent, embedding, vector search, prompt, LLM)
+app.add_middleware(TracingMiddleware)
+
 # Đăng ký exception handlers
 app.add_exception_handler(RequestValidationError, validation_exception_handler)
 app.add_exception_handler(Exception, general_exception_handler)
@@ -52,6 +75,38 @@ app.add_exception_handler(Exception, general_exception_handler)
 app.include_router(product_vector.router)
 app.include_router(chat.router)
 
+# Worker incremental sync Product -> Pinecone (bật khi PRODUCT_SYNC_INTERVAL_SECONDS > 0)
+product_sync_worker = None
+
+
+@app.on_event("startup")
+def start_product_sync_worker():
+    global product_sync_worker
+    if Config.PRODUCT_SYNC_INTERVAL_SECONDS > 0 and Config.DATABASE_URL:
+        from services.product_sync_service import ProductSyncWorker, get_product_sync_service
+        product_sync_worker = ProductSyncWorker(get_product_sync_service(), Config.PRODUCT_SYNC_INTERVAL_SECONDS)
+        product_sync_worker.start()
+
+
+@app.on_event("startup")
+def prepare_conversation_store():
+    if Config.CONVERSATION_STORE_ENABLED and Config.DATABASE_URL:
+        from services.conversation_store import get_conversation_store
+        if not get_conversation_store().ensure_table():
+            # Không có bảng thì client phải tự gửi lịch sử như trước
+            Config.CONVERSATION_STORE_ENABLED = False
+
+
+@app.on_event("shutdown")
+def stop_product_sync_worker():
+    if product_sync_worker is not None:
+        product_sync_worker.stop(timeout=10)
+
+
+@app.on_event("shutdown")
+def flush_traces():
+    get_trace_exporter().flush()
+
 
 @app.get("/")
 async def root():
@@ -62,12 +117,20 @@ async def root():
     }
 
 
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Prometheus metrics (latency gọi Gemini / Vertex AI / Pinecone, cache hit/miss, số câu lệnh SQL)"""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint chi tiết"""
     return {
         "status": "healthy",
-        "service": "Product Vector API"
+        "service": "Product Vector API",
+        "dependencies": get_circuit_states()
     }
 
 
@@ -0,0 +1,31 @@
+"""
+Middleware đặt deadline cho request theo route
+"""
+from typing import Dict
+
+from fastapi import Request
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from utils.deadline import deadline_scope
+
+
+class DeadlineMiddleware(BaseHTTPMiddleware):
+    """
+    Đặt deadline (contextvars) trước khi vào route; embedding / Pinecone / Gemini trong request
+    lấy timeout theo thời gian còn lại (utils.deadline.stage_timeout)
+    """
+    
+    def __init__(self, app, deadlines: Dict[str, float]):
+        """
+        Args:
+            deadlines: path -> số giây (ví dụ {'/api/chat/message': Config.CHAT_DEADLINE_SECONDS})
+        """
+        super().__init__(app)
+        self.deadlines = deadlines
+    
+    async def dispatch(self, request: Request, call_next):
+        seconds = self.deadlines.get(request.url.path)
+        if seconds is None:
+            return await call_next(request)
+        with deadline_scope(seconds):
+            return await call_next(request)
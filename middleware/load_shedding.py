@@ -0,0 +1,61 @@
+"""
+Middleware giới hạn số request đồng thời cho các route nặng (chat, search)
+"""
+import time
+from typing import Dict
+
+from fastapi import Request, status
+from fastapi.responses import JSONResponse
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from schemas.response import ErrorResponse
+from utils.concurrency_limiter import AdaptiveConcurrencyLimiter
+
+# Key trong request.state: route đánh dấu request thất bại dù vẫn trả HTTP 200 (ví dụ câu trả lời thay thế khi Gemini lỗi)
+DROPPED_STATE_KEY = 'load_shedding_dropped'
+
+
+def mark_request_dropped(request: Request):
+    """Báo cho limiter rằng request này thất bại (tính là dropped khi điều chỉnh limit)"""
+    setattr(request.state, DROPPED_STATE_KEY, True)
+
+
+class LoadSheddingMiddleware(BaseHTTPMiddleware):
+    """
+    Route có limiter: vượt limit thì trả ngay HTTP 503 + Retry-After, body code "503"
+    để client / load balancer thử lại sau thay vì xếp hàng chờ Gemini
+    
+    Request tính là dropped khi response >= 500 hoặc route đã gọi mark_request_dropped
+    """
+    
+    def __init__(self, app, limiters: Dict[str, AdaptiveConcurrencyLimiter]):
+        """
+        Args:
+            limiters: path -> limiter (ví dụ {'/api/chat/message': AdaptiveConcurrencyLimiter('chat')})
+        """
+        super().__init__(app)
+        self.limiters = limiters
+    
+    async def dispatch(self, request: Request, call_next):
+        limiter = self.limiters.get(request.url.path)
+        if limiter is None:
+            return await call_next(request)
+        
+        if not limiter.try_acquire():
+            return JSONResponse(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': '1'},
+                content=ErrorResponse(
+                    code="503",
+                    message="Hệ thống đang quá tải, vui lòng thử lại sau"
+                ).dict()
+            )
+        
+        start_time = time.perf_counter()
+        dropped = True
+        try:
+            response = await call_next(request)
+            dropped = response.status_code >= 500 or getattr(request.state, DROPPED_STATE_KEY, False)
+            return response
+        finally:
+            limiter.release(time.perf_counter() - start_time, dropped=dropped)
@@ -0,0 +1,27 @@
+"""
+Middleware mở root span cho mỗi request HTTP
+"""
+from fastapi import Request
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from config import Config
+from utils.tracing import span, server_timing
+
+
+class TracingMiddleware(BaseHTTPMiddleware):
+    """
+    Mỗi request là một trace; các span trong route/service tự gắn vào làm span con
+    Khi TRACE_TIMING_HEADER=true, response có thêm header Server-Timing (thời gian từng bước) và X-Trace-Id
+    """
+    
+    async def dispatch(self, request: Request, call_next):
+        with span(f"{request.method} {request.url.path}", **{
+            'http.method': request.method,
+            'http.target': request.url.path
+        }) as root:
+            response = await call_next(request)
+            root.set_attribute('http.status_code', response.status_code)
+            if Config.TRACE_TIMING_HEADER:
+                response.headers['Server-Timing'] = server_timing(root)
+                response.headers['X-Trace-Id'] = root.trace_id
+            return response
@@ -6,5 +6,6 @@ from models.product import Product
 from models.business import Business
 from models.intent import Intent
 from models.business_intent import BusinessIntent
+from models.conversation_message import ConversationMessage
 
-__all__ = ['Base', 'Product', 'Business', 'Intent', 'BusinessIntent']
+__all__ = ['Base', 'Product', 'Business', 'Intent', 'BusinessIntent', 'ConversationMessage']
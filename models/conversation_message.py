@@ -0,0 +1,34 @@
+"""
+Model cho bảng Conversation_Message (lịch sử chat lưu phía server)
+"""
+from sqlalchemy import Column, BigInteger, Integer, String, Text, TIMESTAMP, Index
+from sqlalchemy.sql import func
+from models.base import Base
+
+
+class ConversationMessage(Base):
+    """Một tin nhắn trong cuộc trò chuyện giữa khách hàng và bot (chỉ ghi thêm, không sửa)"""
+    __tablename__ = 'Conversation_Message'
+    __table_args__ = (
+        Index('ix_conversation_message_customer', 'business_id', 'customer_id', 'id'),
+        Index('ix_conversation_message_created_at', 'created_at'),
+    )
+    
+    # SQLite chỉ tự tăng với INTEGER PRIMARY KEY
+    id = Column(BigInteger().with_variant(Integer, 'sqlite'), primary_key=True, autoincrement=True)
+    business_id = Column(BigInteger, nullable=False)
+    customer_id = Column(BigInteger, nullable=False)
+    role = Column(String(20), nullable=False)  # 'user' hoặc 'assistant'
+    content = Column(Text, nullable=False)
+    created_at = Column(TIMESTAMP, server_default=func.now())
+    
+    def to_dict(self):
+        """Chuyển đổi model thành dictionary"""
+        return {
+            'id': self.id,
+            'business_id': self.business_id,
+            'customer_id': self.customer_id,
+            'role': self.role,
+            'content': self.content,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
@@ -6,6 +6,7 @@ from sqlalchemy.sql import func
 from datetime import datetime
 import json
 from models.base import Base
+from utils.product_helper import create_text_for_embedding
 
 
 class Product(Base):
@@ -45,25 +46,16 @@ class Product(Base):
     def get_text_for_embedding(self):
         """
         Tạo text để tạo embedding vector từ thông tin sản phẩm
-        Kết hợp name, description và metadata để tạo text đầy đủ
+        Kết hợp name, description và metadata để tạo text đầy đủ (cùng create_text_for_embedding)
         """
-        text_parts = []
-        
-        if self.name:
-            text_parts.append(f"Tên sản phẩm: {self.name}")
-        
-        if self.description:
-            text_parts.append(f"Mô tả: {self.description}")
-        
+        metadata_dict = None
         if self.meta_data:
             try:
                 metadata_dict = json.loads(self.meta_data)
-                # Thêm các thuộc tính từ metadata vào text
-                for key, value in metadata_dict.items():
-                    if isinstance(value, (str, int, float)):
-                        text_parts.append(f"{key}: {value}")
-            except:
+            except ValueError:
                 pass
+        if not isinstance(metadata_dict, dict):
+            metadata_dict = None
         
-        return " ".join(text_parts)
+        return create_text_for_embedding(name=self.name, description=self.description, metadata=metadata_dict)
 
@@ -0,0 +1,40 @@
+"""
+CLI reindex toàn bộ sản phẩm từ bảng Product vào Pinecone
+
+Ví dụ:
+    python reindex.py                       # tất cả business, chạy tiếp từ checkpoint
+    python reindex.py --business-id 1 2     # chỉ business 1 và 2
+    python reindex.py --business-id 1 --restart --batch-size 100
+"""
+import argparse
+import json
+import logging
+
+from config import Config
+from services.reindex_service import ReindexService
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reindex sản phẩm từ MySQL vào Pinecone")
+    parser.add_argument('--business-id', type=int, nargs='*', help="Business cần reindex (mặc định tất cả)")
+    parser.add_argument('--batch-size', type=int, default=None, help=f"Số sản phẩm mỗi batch (mặc định {Config.REINDEX_BATCH_SIZE})")
+    parser.add_argument('--workers', type=int, default=None, help=f"Số thread tạo embedding (mặc định {Config.REINDEX_EMBED_WORKERS})")
+    parser.add_argument('--restart', action='store_true', help="Bỏ checkpoint, reindex lại từ đầu")
+    args = parser.parse_args()
+    
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    Config.validate()
+    
+    service = ReindexService(batch_size=args.batch_size, embed_workers=args.workers)
+    summary = service.reindex_all(
+        business_ids=args.business_id or None,
+        resume=not args.restart
+    )
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -17,7 +17,10 @@ class ChatRequest(BaseModel):
     message: str = Field(..., description="Tin nhắn hiện tại của khách hàng")
     conversations: List[ConversationMessage] = Field(
         default_factory=list,
-        description="Danh sách các cuộc trò chuyện gần đây"
+        description=(
+            "Danh sách các cuộc trò chuyện gần đây. Có thể bỏ trống khi bật CONVERSATION_STORE_ENABLED: "
+            "server tự lấy lịch sử đã lưu theo (business_id, customer_id)"
+        )
     )
     customer_id: int = Field(..., description="ID của khách hàng")
     business_id: int = Field(..., description="ID của business")
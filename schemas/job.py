@@ -0,0 +1,36 @@
+"""
+Schema cho các job chạy nền
+"""
+from pydantic import BaseModel, Field
+from typing import Optional, List, Dict, Any
+
+
+class JobCreatedData(BaseModel):
+    """Data response khi tạo job"""
+    job_id: str = Field(..., description="ID của job, dùng để tra cứu tiến độ qua /jobs/{job_id}")
+    job_type: str
+    status: str
+    total: Optional[int] = None
+
+
+class JobErrorItem(BaseModel):
+    """Lỗi của một item trong job"""
+    product_id: Any
+    error: str
+
+
+class JobStatusData(BaseModel):
+    """Data response cho trạng thái job"""
+    job_id: str
+    job_type: str
+    status: str = Field(..., description="pending | running | succeeded | failed")
+    total: Optional[int] = None
+    processed: int
+    success_count: int
+    error_count: int
+    progress: Optional[float] = Field(None, description="Tỉ lệ hoàn thành 0.0-1.0 (None nếu chưa biết total)")
+    elapsed_seconds: float
+    throughput_per_second: Optional[float] = Field(None, description="Số item xử lý mỗi giây")
+    message: Optional[str] = None
+    result: Optional[Dict[str, Any]] = None
+    errors: List[JobErrorItem] = Field(default_factory=list)
@@ -5,11 +5,17 @@ Cache context theo business_id để mỗi business có cache riêng, giảm que
 import json
 import time
 import logging
-from typing import Optional
+import threading
+from collections import OrderedDict
+from typing import Iterable, List, Optional
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 
+from config import Config
+
 from models.business import Business
 from models.product import Product
+from utils.metrics import record_cache
 
 logger = logging.getLogger(__name__)
 
@@ -30,19 +36,75 @@ DEFAULT_CHAT_INSTRUCTION = (
 )
 
 
+# Số sản phẩm mỗi câu IN khi render lại fragment
+_RENDER_BATCH_SIZE = 500
+
+
+def render_business_header(business: Business) -> str:
+    """Phần thông tin cửa hàng trong context"""
+    lines = ["--- THÔNG TIN CỬA HÀNG ---", f"Tên cửa hàng: {business.name}"]
+    if business.phone:
+        lines.append(f"Số điện thoại: {business.phone}")
+    if business.address:
+        lines.append(f"Địa chỉ: {business.address}")
+    if business.description:
+        lines.append(f"Mô tả: {business.description}")
+    if business.meta_data:
+        if isinstance(business.meta_data, dict):
+            for k, v in business.meta_data.items():
+                lines.append(f"{k}: {v}")
+        else:
+            lines.append(f"Thông tin bổ sung: {business.meta_data}")
+    return "\n".join(lines)
+
+
+def render_product_fragment(p: Product) -> str:
+    """Phần context của một sản phẩm (giá, mô tả, ảnh, tồn kho, metadata)"""
+    item = [
+        f"Tên: {p.name}",
+        f"Giá: {float(p.price):,.0f} VNĐ" if p.price else "",
+        f"Mô tả: {p.description}" if p.description else "",
+    ]
+    if p.main_image_url:
+        item.append(f"Ảnh chính: {p.main_image_url}")
+    if p.detail_image_url:
+        item.append(f"Ảnh chi tiết: {p.detail_image_url}")
+    if p.quantity_avail is not None:
+        item.append(f"Số lượng còn: {p.quantity_avail}")
+    if p.meta_data:
+        try:
+            meta = json.loads(p.meta_data) if isinstance(p.meta_data, str) else p.meta_data
+            if isinstance(meta, dict):
+                for k, v in meta.items():
+                    item.append(f"{k}: {v}")
+        except Exception:
+            pass
+    return "\n".join(x for x in item if x)
+
+
 class BusinessContextService:
     """
     Lấy và cache context sản phẩm theo business_id.
     Mỗi business_id có cache riêng; TTL (giây) để làm mới khi dữ liệu thay đổi.
+    Ngoài ra giữ fragment đã render của header cửa hàng và từng sản phẩm, nên khi build lại
+    chỉ sản phẩm thay đổi mới phải format lại.
     """
 
-    def __init__(self, ttl_seconds: int = 0):
+    def __init__(self, ttl_seconds: int = 0, max_fragment_businesses: Optional[int] = None):
         """
         Args:
             ttl_seconds: Thời gian sống cache (mặc định 0 = không cache).
+            max_fragment_businesses: Số business tối đa giữ fragment (mặc định CONTEXT_FRAGMENT_MAX_BUSINESSES).
         """
         self._cache: dict[int, tuple[str, float]] = {}  # business_id -> (context, expiry_at)
         self._ttl = ttl_seconds
+        # business_id -> {'header': (updated_at, text), 'products': {product_id: ((updated_at, quantity_avail), text)}}
+        self._fragments: OrderedDict[int, dict] = OrderedDict()
+        # Nhiều request chat build context đồng thời: mọi thao tác đọc/ghi _fragments đi qua lock (không giữ lock khi query DB)
+        self._fragments_lock = threading.Lock()
+        self._max_fragment_businesses = (
+            Config.CONTEXT_FRAGMENT_MAX_BUSINESSES if max_fragment_businesses is None else max_fragment_businesses
+        )
 
     def get_product_context(self, db: Session, business_id: int, use_cache: bool = False) -> str:
         """
@@ -64,10 +126,13 @@ class BusinessContextService:
                 context, expiry_at = cached
                 if now < expiry_at:
                     logger.debug(f"[BusinessContext] Cache hit business_id={business_id}")
+                    record_cache('business_context', hit=True)
                     return context
                 # Hết hạn -> xóa và build lại
                 self._cache.pop(business_id, None)
 
+            record_cache('business_context', hit=False)
+
         context = self._build_context(db, business_id)
         if use_cache and self._ttl > 0:
             self._cache[business_id] = (context, time.time() + self._ttl)
@@ -75,6 +140,32 @@ class BusinessContextService:
 
         return context
 
+    def get_product_excerpt(self, db: Session, business_id: int, max_products: int) -> str:
+        """
+        Tối đa max_products sản phẩm còn hàng đầu tiên (dùng fragment đã render nếu còn mới),
+        context có kích thước cố định khi không tìm kiếm được thay vì cả catalog
+        """
+        products = db.execute(
+            select(Product).where(
+                Product.business_id == business_id,
+                Product.status == '1',
+                Product.quantity_avail > 0
+            ).order_by(Product.id).limit(max(0, max_products))
+        ).scalars().all()
+        if not products:
+            return ""
+
+        with self._fragments_lock:
+            fragments = self._fragments.get(business_id)
+            cached = dict(fragments['products']) if fragments is not None else {}
+        parts = []
+        for p in products:
+            fragment = cached.get(p.id)
+            if fragment is None or fragment[0] != (p.updated_at, p.quantity_avail):
+                fragment = ((p.updated_at, p.quantity_avail), render_product_fragment(p))
+            parts.append(fragment[1])
+        return "\n\n".join(parts)
+
     def invalidate_cache(self, business_id: Optional[int] = None):
         """
         Xóa cache. Nếu business_id=None thì xóa toàn bộ.
@@ -82,13 +173,48 @@ class BusinessContextService:
         """
         if business_id is not None:
             self._cache.pop(business_id, None)
+            with self._fragments_lock:
+                self._fragments.pop(business_id, None)
             logger.info(f"[BusinessContext] Invalidated cache for business_id={business_id}")
         else:
             self._cache.clear()
+            with self._fragments_lock:
+                self._fragments.clear()
             logger.info("[BusinessContext] Invalidated all context cache")
 
+    def invalidate_products(self, business_id: int, product_ids: Optional[Iterable[int]] = None):
+        """
+        Đánh dấu fragment sản phẩm cần render lại (product_ids=None: cả business, gồm header cửa hàng).
+        Gọi khi biết chính xác sản phẩm nào vừa đổi (sync sản phẩm) để không phụ thuộc độ phân giải updated_at.
+        """
+        self._cache.pop(business_id, None)
+        with self._fragments_lock:
+            fragments = self._fragments.get(business_id)
+            if fragments is None:
+                return
+            if product_ids is None:
+                self._fragments.pop(business_id, None)
+                return
+            for product_id in product_ids:
+                fragments['products'].pop(product_id, None)
+
+    def _get_fragments(self, business_id: int) -> dict:
+        """Fragment đã render của business (LRU theo số business), gọi khi đang giữ _fragments_lock"""
+        fragments = self._fragments.get(business_id)
+        if fragments is None:
+            fragments = {'header': None, 'products': {}}
+            self._fragments[business_id] = fragments
+            while len(self._fragments) > self._max_fragment_businesses:
+                self._fragments.popitem(last=False)
+        else:
+            self._fragments.move_to_end(business_id)
+        return fragments
+
     def _build_context(self, db: Session, business_id: int) -> str:
-        """Query DB: Business + Products theo business_id, build chuỗi context."""
+        """
+        Query DB: Business + Products theo business_id, ghép chuỗi context từ fragment đã render.
+        Mỗi sản phẩm chỉ render lại khi (updated_at, quantity_avail) đổi so với lần render trước.
+        """
         parts = []
 
         # 1. Thông tin cửa hàng từ bảng Business
@@ -98,60 +224,90 @@ class BusinessContextService:
         ).first()
 
         if business:
-            parts.append("--- THÔNG TIN CỬA HÀNG ---")
-            parts.append(f"Tên cửa hàng: {business.name}")
-            if business.phone:
-                parts.append(f"Số điện thoại: {business.phone}")
-            if business.address:
-                parts.append(f"Địa chỉ: {business.address}")
-            if business.description:
-                parts.append(f"Mô tả: {business.description}")
-            if business.meta_data:
-                if isinstance(business.meta_data, dict):
-                    for k, v in business.meta_data.items():
-                        parts.append(f"{k}: {v}")
-                else:
-                    parts.append(f"Thông tin bổ sung: {business.meta_data}")
+            with self._fragments_lock:
+                header = self._get_fragments(business_id)['header']
+            if header is None or header[0] is None or header[0] != business.updated_at:
+                header = (business.updated_at, render_business_header(business))
+                with self._fragments_lock:
+                    self._get_fragments(business_id)['header'] = header
+            parts.append(header[1])
             parts.append("")
 
-        # 2. Danh sách sản phẩm từ bảng Product (status = '1' = available)
-        products = db.query(Product).filter(
-            Product.business_id == business_id,
-            Product.status == '1'
+        # 2. Danh sách sản phẩm từ bảng Product (status = '1' = available): chỉ lấy khóa phiên bản
+        rows = db.execute(
+            select(Product.id, Product.updated_at, Product.quantity_avail).where(
+                Product.business_id == business_id,
+                Product.status == '1'
+            )
         ).all()
 
-        if products:
+        if rows:
+            # Lấy fragment còn mới ra bản local: request khác invalidate / evict giữa chừng không làm thiếu sản phẩm
+            fragments = {}
+            stale_ids = []
+            with self._fragments_lock:
+                cached = self._get_fragments(business_id)['products']
+                for row in rows:
+                    fragment = cached.get(row.id)
+                    if fragment is None or fragment[0] != (row.updated_at, row.quantity_avail):
+                        stale_ids.append(row.id)
+                    else:
+                        fragments[row.id] = fragment
+            # Render ngoài lock (query DB), sau đó mới ghi vào fragment dùng chung
+            if stale_ids:
+                rendered = self._render_products(db, business_id, stale_ids, all_stale=len(stale_ids) == len(rows))
+                fragments.update(rendered)
+                logger.debug(f"[BusinessContext] Rendered {len(stale_ids)}/{len(rows)} product fragments business_id={business_id}")
+            else:
+                rendered = {}
+
+            with self._fragments_lock:
+                cached = self._get_fragments(business_id)['products']
+                cached.update(rendered)
+
+                # Bỏ fragment của sản phẩm đã xóa / hết bán
+                if len(cached) > len(rows):
+                    available_ids = {row.id for row in rows}
+                    for product_id in [pid for pid in cached if pid not in available_ids]:
+                        cached.pop(product_id, None)
+
             parts.append("--- DANH SÁCH SẢN PHẨM ---")
-            for p in products:
-                item = [
-                    f"Tên: {p.name}",
-                    f"Giá: {float(p.price):,.0f} VNĐ" if p.price else "",
-                    f"Mô tả: {p.description}" if p.description else "",
-                ]
-                if p.main_image_url:
-                    item.append(f"Ảnh chính: {p.main_image_url}")
-                if p.detail_image_url:
-                    item.append(f"Ảnh chi tiết: {p.detail_image_url}")
-                if p.quantity_avail is not None:
-                    item.append(f"Số lượng còn: {p.quantity_avail}")
-                if p.meta_data:
-                    try:
-                        meta = json.loads(p.meta_data) if isinstance(p.meta_data, str) else p.meta_data
-                        if isinstance(meta, dict):
-                            for k, v in meta.items():
-                                item.append(f"{k}: {v}")
-                    except Exception:
-                        pass
-                parts.append("\n".join(x for x in item if x))
+            for row in rows:
+                fragment = fragments.get(row.id)
+                if fragment is None:
+                    # Sản phẩm bị xóa giữa hai câu query
+                    continue
+                parts.append(fragment[1])
                 parts.append("")
             parts.append("")
         else:
+            with self._fragments_lock:
+                self._get_fragments(business_id)['products'] = {}
             parts.append("--- DANH SÁCH SẢN PHẨM ---")
             parts.append("Chưa có sản phẩm nào.")
             parts.append("")
 
         return "\n".join(parts).strip()
 
+    def _render_products(self, db: Session, business_id: int, product_ids: List[int], all_stale: bool) -> dict:
+        """Load đầy đủ các sản phẩm cần render lại, trả về {product_id: ((updated_at, quantity_avail), text)}"""
+        if all_stale:
+            # Lần đầu / cả catalog đổi: một query giống trước đây thay vì nhiều câu IN
+            batches = [db.query(Product).filter(
+                Product.business_id == business_id,
+                Product.status == '1'
+            ).all()]
+        else:
+            batches = (
+                db.query(Product).filter(Product.id.in_(product_ids[i:i + _RENDER_BATCH_SIZE])).all()
+                for i in range(0, len(product_ids), _RENDER_BATCH_SIZE)
+            )
+        rendered = {}
+        for products in batches:
+            for p in products:
+                rendered[p.id] = ((p.updated_at, p.quantity_avail), render_product_fragment(p))
+        return rendered
+
 
 # Singleton cho app (cache dùng chung, mỗi business_id một context)
 _business_context_service: Optional[BusinessContextService] = None
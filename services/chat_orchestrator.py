@@ -1,13 +1,17 @@
 """
 Bộ điều phối trung tâm cho chat bot
 """
-import time
 from typing import Dict, List, Optional
 from sqlalchemy.orm import Session
 import logging
 
 from services.intent_service import IntentService
 from services.gemini_service import GeminiService
+from services.response_cache import get_response_cache
+from utils.tracing import span
+from utils.metrics import set_request_labels
+from utils.deadline import deadline_scope
+from config import Config
 from services.context_builders import (
     GreetingsContextBuilder,
     StoreInfoContextBuilder,
@@ -69,81 +73,91 @@ class ChatOrchestrator:
         Returns:
             Dict: {'response': str, 'intent': str, 'confidence': float}
         """
-        total_start_time = time.perf_counter()
-        try:
-            # Bước 1: Lấy danh sách intent đang bật của business
-            db_start_time = time.perf_counter()
-            available_intents = self.intent_service.get_active_intents_by_business(
-                self.db, business_id
-            )
-            db_elapsed = time.perf_counter() - db_start_time
-            logger.info(f"[DB Query] Lấy intent cho business_id={business_id} - Thời gian: {db_elapsed:.3f}s")
-            
-            if not available_intents:
-                logger.warning(f"Không tìm thấy intent nào cho business_id={business_id}")
-                # Fallback về intent others
-                intent_result = {
-                    'intent': 'others',
-                    'confidence': 0.5,
-                    'related_intents': []
-                }
-            else:
-                # Bước 2: Phân loại intent bằng Gemini
-                intent_result = self.gemini_service.classify_intent(
+        set_request_labels(business_id=business_id)
+        # Deadline của cả pipeline; từng bước (intent, embedding, vector search, LLM) lấy timeout trong phần còn lại
+        with deadline_scope(Config.CHAT_DEADLINE_SECONDS), span('chat.process', business_id=business_id) as total_span:
+            try:
+                # Bước 1: Lấy danh sách intent đang bật của business
+                with span('db.active_intents', business_id=business_id) as db_span:
+                    available_intents = self.intent_service.get_active_intents_by_business(
+                        self.db, business_id
+                    )
+                logger.info(f"[DB Query] Lấy intent cho business_id={business_id} - Thời gian: {db_span.duration:.3f}s")
+                
+                if not available_intents:
+                    logger.warning(f"Không tìm thấy intent nào cho business_id={business_id}")
+                    # Fallback về intent others
+                    intent_result = {
+                        'intent': 'others',
+                        'confidence': 0.5,
+                        'related_intents': []
+                    }
+                else:
+                    # Bước 2: Phân loại intent bằng Gemini
+                    intent_result = self.gemini_service.classify_intent(
+                        message=message,
+                        conversations=conversations,
+                        available_intents=available_intents
+                    )
+                
+                intent_type = intent_result.get('intent', 'others')
+                confidence = intent_result.get('confidence', 0.5)
+                total_span.set_attribute('intent', intent_type)
+                set_request_labels(intent=intent_type)
+                
+                # Bước 3: Xây dựng context dựa trên intent
+                with span('context.build', intent=intent_type) as context_span:
+                    context_builder_class = self.context_builders.get(
+                        intent_type,
+                        OthersContextBuilder  # Fallback về others
+                    )
+                    
+                    context_builder = context_builder_class(
+                        db=self.db,
+                        business_id=business_id,
+                        customer_id=customer_id
+                    )
+                    
+                    context = context_builder.build_context(
+                        message=message,
+                        conversations=conversations
+                    )
+                logger.info(f"[Context Builder] Xây dựng context cho intent '{intent_type}' - Thời gian: {context_span.duration:.3f}s")
+                
+                # Bước 4: Gọi Gemini để tạo phản hồi (intent như store_info / policy_shipping / greetings
+                # dùng lại câu trả lời của câu hỏi tương tự trong cùng business khi context chưa đổi)
+                response = get_response_cache().get_or_generate(
+                    business_id=business_id,
+                    intent=intent_type,
+                    context=context,
                     message=message,
-                    conversations=conversations,
-                    available_intents=available_intents
+                    generate=lambda: self.gemini_service.generate_response(
+                        message=message,
+                        conversations=conversations,
+                        context=context,
+                        intent=intent_type,
+                        history_key=(business_id, customer_id)
+                    ),
+                    cacheable=lambda reply: reply not in GeminiService.FALLBACK_REPLIES
                 )
+                
+                logger.info(
+                    f"[Tổng thời gian] Xử lý chat request - business_id={business_id}, intent={intent_type} - "
+                    f"Thời gian tổng: {total_span.duration:.3f}s"
+                )
+                
+                return {
+                    'response': response,
+                    'intent': intent_type,
+                    'confidence': confidence
+                }
             
-            intent_type = intent_result.get('intent', 'others')
-            confidence = intent_result.get('confidence', 0.5)
-            
-            # Bước 3: Xây dựng context dựa trên intent
-            context_start_time = time.perf_counter()
-            context_builder_class = self.context_builders.get(
-                intent_type,
-                OthersContextBuilder  # Fallback về others
-            )
-            
-            context_builder = context_builder_class(
-                db=self.db,
-                business_id=business_id,
-                customer_id=customer_id
-            )
-            
-            context = context_builder.build_context(
-                message=message,
-                conversations=conversations
-            )
-            context_elapsed = time.perf_counter() - context_start_time
-            logger.info(f"[Context Builder] Xây dựng context cho intent '{intent_type}' - Thời gian: {context_elapsed:.3f}s")
-            
-            # Bước 4: Gọi Gemini để tạo phản hồi
-            response = self.gemini_service.generate_response(
-                message=message,
-                conversations=conversations,
-                context=context,
-                intent=intent_type
-            )
-            
-            total_elapsed = time.perf_counter() - total_start_time
-            logger.info(
-                f"[Tổng thời gian] Xử lý chat request - business_id={business_id}, intent={intent_type} - "
-                f"Thời gian tổng: {total_elapsed:.3f}s"
-            )
-            
-            return {
-                'response': response,
-                'intent': intent_type,
-                'confidence': confidence
-            }
-            
-        except Exception as e:
-            logger.error(f"Lỗi khi xử lý chat: {str(e)}")
-            # Trả về phản hồi mặc định khi có lỗi
-            return {
-                'response': 'Xin lỗi, tôi gặp sự cố kỹ thuật. Vui lòng thử lại sau.',
-                'intent': 'others',
-                'confidence': 0.0
-            }
+            except Exception as e:
+                logger.error(f"Lỗi khi xử lý chat: {str(e)}")
+                # Trả về phản hồi mặc định khi có lỗi
+                return {
+                    'response': 'Xin lỗi, tôi gặp sự cố kỹ thuật. Vui lòng thử lại sau.',
+                    'intent': 'others',
+                    'confidence': 0.0
+                }
 
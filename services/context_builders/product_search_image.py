@@ -5,7 +5,7 @@ from typing import Dict, List
 from sqlalchemy.orm import Session
 from services.context_builders.base import BaseContextBuilder
 from services.embedding_service import get_embedding_service
-from services.pinecone_service import get_pinecone_service
+from services.retrieval_service import get_retrieval_service
 import re
 
 
@@ -15,7 +15,7 @@ class ProductSearchImageContextBuilder(BaseContextBuilder):
     def __init__(self, db: Session, business_id: int, customer_id: int):
         super().__init__(db, business_id, customer_id)
         self.embedding_service = get_embedding_service()
-        self.pinecone_service = get_pinecone_service()
+        self.retrieval_service = get_retrieval_service()
     
     def extract_image_url(self, message: str) -> str:
         """Trích xuất URL ảnh từ message"""
@@ -38,66 +38,31 @@ class ProductSearchImageContextBuilder(BaseContextBuilder):
             if image_url:
                 try:
                     # Tạo embedding từ ảnh
-                    image_vector = self.embedding_service.create_image_embedding(image_url)
+                    image_vectors = self.embedding_service.create_image_vectors(image_url)
                     
-                    if image_vector:
+                    if image_vectors is not None:
                         # Search trong Pinecone
                         namespace = f"business_{self.business_id}"
-                        results = self.pinecone_service.search_vectors(
-                            query_vector=image_vector,
+                        # Lấy nhiều vector hơn để sau khi gộp theo sản phẩm vẫn đủ top 5
+                        sorted_products = self.retrieval_service.retrieve(
+                            [{
+                                'name': 'image',
+                                'vector': image_vectors['vector'],
+                                'index_vector': image_vectors['index_vector'],
+                                'top_k': 10,
+                                'filter': {'status': '1', 'business_id': self.business_id, 'vector_type': 'image'}
+                            }],
                             namespace=namespace,
-                            top_k=10,  # Lấy nhiều hơn để có thể deduplicate
-                            filter={'status': '1', 'business_id': self.business_id, 'vector_type': 'image'}
+                            top_k=5
                         )
                         
-                        if results:
-                            # Deduplicate theo product_id - giữ lại sản phẩm có score cao nhất
-                            unique_products = {}
-                            for result in results:
-                                vector_id = result.get('id', '')
-                                metadata = result.get('metadata', {})
-                                
-                                # Extract product_id từ vector_id
-                                product_id = None
-                                if '_' in vector_id:
-                                    parts = vector_id.split('_')
-                                    if parts:
-                                        try:
-                                            product_id = int(parts[0])
-                                        except ValueError:
-                                            product_id = metadata.get('product_id')
-                                else:
-                                    try:
-                                        product_id = int(vector_id)
-                                    except ValueError:
-                                        product_id = metadata.get('product_id')
-                                
-                                if product_id:
-                                    # Giữ lại sản phẩm có score cao nhất
-                                    if product_id not in unique_products or result.get('score', 0) > unique_products[product_id].get('score', 0):
-                                        unique_products[product_id] = {
-                                            'product_id': product_id,
-                                            'name': metadata.get('name', 'Không có tên'),
-                                            'price': metadata.get('price', 0),
-                                            'score': result.get('score', 0),
-                                            'metadata': metadata
-                                        }
-                            
-                            # Sắp xếp theo score và lấy top 5
-                            sorted_products = sorted(
-                                unique_products.values(),
-                                key=lambda x: x['score'],
-                                reverse=True
-                            )[:5]
-                            
-                            if sorted_products:
-                                context_parts.append("\nCác sản phẩm tương tự tìm thấy:")
-                                for idx, product in enumerate(sorted_products, 1):
-                                    context_parts.append(
-                                        f"{idx}. {product['name']} - Giá: {product['price']:,.0f} VNĐ"
-                                    )
-                            else:
-                                context_parts.append("Không tìm thấy sản phẩm tương tự.")
+                        if sorted_products:
+                            context_parts.append("\nCác sản phẩm tương tự tìm thấy:")
+                            for idx, product in enumerate(sorted_products, 1):
+                                metadata = product['metadata']
+                                context_parts.append(
+                                    f"{idx}. {metadata.get('name', 'Không có tên')} - Giá: {metadata.get('price', 0):,.0f} VNĐ"
+                                )
                         else:
                             context_parts.append("Không tìm thấy sản phẩm tương tự.")
                     else:
@@ -1,12 +1,28 @@
 """
 Context builder cho intent product_search_text
 """
-from typing import Dict, List
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Dict, List, Optional
+import logging
 from sqlalchemy.orm import Session
+from config import Config
 from services.context_builders.base import BaseContextBuilder
 from models.product import Product
 from services.embedding_service import get_embedding_service
-from services.pinecone_service import get_pinecone_service
+from services.retrieval_service import get_retrieval_service
+from services.lexical_index import get_lexical_index_service, reciprocal_rank_fusion
+from services.business_context_service import get_business_context_service
+from utils.search_filter_parser import parse_search_filters, build_metadata_filter, has_filters
+from utils.tracing import span, wrap_context
+from utils.deadline import DeadlineExceeded, remaining
+from utils.circuit_breaker import CircuitOpenError, get_circuit_breaker
+from utils.metrics import record_deadline_exceeded
+
+logger = logging.getLogger(__name__)
+
+# Thread pool chạy vector search song song với BM25 search (dùng chung cho mọi request)
+_vector_search_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='vector-search')
 
 
 class ProductSearchTextContextBuilder(BaseContextBuilder):
@@ -15,7 +31,107 @@ class ProductSearchTextContextBuilder(BaseContextBuilder):
     def __init__(self, db: Session, business_id: int, customer_id: int):
         super().__init__(db, business_id, customer_id)
         self.embedding_service = get_embedding_service()
-        self.pinecone_service = get_pinecone_service()
+        self.retrieval_service = get_retrieval_service()
+    
+    def _vector_search(self, query: str, metadata_filter: Dict, top_k: int) -> List[Dict]:
+        """
+        Tạo embedding từ query và search trong Pinecone (chạy trên thread pool)
+        
+        Returns:
+            List[Dict]: Sản phẩm đã gộp theo product_id, sắp xếp theo score giảm dần
+        """
+        query_vectors = self.embedding_service.create_text_vectors(query)
+        
+        # Search trong Pinecone với namespace là business_id
+        namespace = f"business_{self.business_id}"
+        return self.retrieval_service.retrieve(
+            [{
+                'name': 'text',
+                'vector': query_vectors['vector'],
+                'index_vector': query_vectors['index_vector'],
+                'top_k': top_k,
+                'filter': metadata_filter
+            }],
+            namespace=namespace,
+            top_k=top_k
+        )
+    
+    def _parse_filters(self, message: str) -> Dict:
+        """Trích xuất điều kiện giá / còn hàng / danh mục từ message"""
+        categories = None
+        if Config.SEARCH_CATEGORY_FIELD and Config.HYBRID_SEARCH_ENABLED:
+            try:
+                categories = get_lexical_index_service().get_categories(self.db, self.business_id)
+            except Exception as e:
+                logger.warning(f"[Search Filter] Không lấy được danh mục: {str(e)}")
+        return parse_search_filters(message, categories)
+    
+    def _describe_filters(self, parsed: Dict) -> str:
+        """Mô tả ngắn điều kiện lọc để đưa vào context"""
+        conditions = []
+        if parsed['price_min'] is not None:
+            conditions.append(f"giá từ {parsed['price_min']:,.0f} VNĐ")
+        if parsed['price_max'] is not None:
+            conditions.append(f"giá đến {parsed['price_max']:,.0f} VNĐ")
+        if parsed['in_stock']:
+            conditions.append("còn hàng")
+        if parsed['categories']:
+            conditions.append(f"danh mục {', '.join(parsed['categories'])}")
+        return ", ".join(conditions)
+    
+    def _lexical_search(self, message: str, metadata_filter: Dict) -> List[Dict]:
+        """BM25 search theo từ khóa (mã sản phẩm, size, thương hiệu...)"""
+        if not Config.HYBRID_SEARCH_ENABLED:
+            return []
+        try:
+            with span('lexical.search', business_id=self.business_id):
+                return get_lexical_index_service().search(
+                    self.db,
+                    self.business_id,
+                    message,
+                    top_k=Config.HYBRID_LEXICAL_TOP_K,
+                    metadata_filter=metadata_filter
+                )
+        except Exception as e:
+            logger.warning(f"[Hybrid Search] BM25 search lỗi, chỉ dùng vector search: {str(e)}")
+            return []
+    
+    def _vector_budget(self) -> float:
+        """
+        Thời gian chờ vector search (embedding + Pinecone), chừa RESPONSE_RESERVE_SECONDS cho bước tạo câu trả lời
+        
+        Returns:
+            float: Số giây; <= 0 = không đủ thời gian, bỏ vector search
+        """
+        budget = Config.STAGE_TIMEOUT_EMBEDDING_SECONDS + Config.STAGE_TIMEOUT_VECTOR_SEARCH_SECONDS
+        left = remaining()
+        if left is None:
+            return budget
+        return min(budget, left - Config.RESPONSE_RESERVE_SECONDS)
+    
+    def _open_dependency(self) -> Optional[str]:
+        """Tên dịch vụ của vector search (Vertex AI / Pinecone) đang bị circuit breaker ngắt, None nếu không có"""
+        for name in ('vertex', 'pinecone'):
+            if get_circuit_breaker(name).is_open():
+                return name
+        return None
+    
+    def _catalog_context(self) -> str:
+        """
+        Một số sản phẩm còn hàng của shop khi không tìm kiếm được kịp thời
+        (tối đa SEARCH_FALLBACK_MAX_PRODUCTS: quá tải thì không đưa cả catalog vào prompt)
+        """
+        try:
+            with span('context.catalog_fallback', business_id=self.business_id):
+                catalog = get_business_context_service().get_product_excerpt(
+                    self.db, self.business_id, Config.SEARCH_FALLBACK_MAX_PRODUCTS
+                )
+        except Exception as e:
+            logger.warning(f"[Search] Không lấy được context sản phẩm của shop: {str(e)}")
+            catalog = ""
+        if not catalog:
+            return "Không thể tìm kiếm sản phẩm lúc này."
+        return f"Không tìm kiếm kịp lúc này, dưới đây là một số sản phẩm còn hàng của shop:\n{catalog}"
     
     def build_context(self, message: str, conversations: List[Dict]) -> str:
         """Xây dựng context cho product_search_text"""
@@ -25,67 +141,78 @@ class ProductSearchTextContextBuilder(BaseContextBuilder):
                 f"Khách hàng đang tìm kiếm sản phẩm với từ khóa: '{message}'"
             ]
             
-            # Tìm kiếm sản phẩm trong Pinecone
+            # Điều kiện giá / còn hàng / danh mục được đẩy vào filter metadata thay vì để LLM tự loại
+            parsed = self._parse_filters(message)
+            metadata_filter = build_metadata_filter(
+                parsed,
+                base_filter={'status': '1'},
+                category_field=Config.SEARCH_CATEGORY_FIELD or None
+            )
+            filtered = has_filters(parsed)
+            # Có filter thì kết quả đã đúng điều kiện, không cần lấy nhiều; BM25 bù phần recall
+            vector_top_k = Config.FILTERED_VECTOR_TOP_K if filtered else Config.HYBRID_VECTOR_TOP_K
+            if filtered:
+                context_parts.append(f"Điều kiện lọc: {self._describe_filters(parsed)}")
+            
+            # Vector search (Pinecone) chạy song song với BM25 search (DB session chỉ dùng ở thread hiện tại)
             try:
-                # Tạo embedding từ message
-                query_vector = self.embedding_service.create_embedding(message)
-                
-                # Search trong Pinecone với namespace là business_id
-                namespace = f"business_{self.business_id}"
-                results = self.pinecone_service.search_vectors(
-                    query_vector=query_vector,
-                    namespace=namespace,
-                    top_k=10,  # Lấy nhiều hơn để có thể deduplicate
-                    filter={'status': '1'}
-                )
+                vector_budget = self._vector_budget()
+                vector_deadline = time.monotonic() + vector_budget
+                vector_future = None
+                open_dependency = self._open_dependency()
+                if open_dependency is not None:
+                    # Vertex AI / Pinecone đang lỗi: không gọi (và không chờ timeout), dùng BM25 / context có sẵn
+                    logger.warning(
+                        f"[Search] Circuit '{open_dependency}' đang mở, bỏ vector search, business_id={self.business_id}"
+                    )
+                elif vector_budget > 0:
+                    vector_future = _vector_search_executor.submit(
+                        wrap_context(self._vector_search), parsed['query'], metadata_filter, vector_top_k
+                    )
+                else:
+                    # Request sắp hết thời gian: bỏ vector search, chỉ dùng BM25 / context có sẵn
+                    record_deadline_exceeded('vector_search')
+                    logger.warning(f"[Search] Không đủ thời gian cho vector search, business_id={self.business_id}")
+                lexical_results = self._lexical_search(parsed['query'], metadata_filter)
+                vector_ranking = []
+                degraded = vector_future is None
+                if vector_future is not None:
+                    try:
+                        vector_ranking = vector_future.result(timeout=max(0.0, vector_deadline - time.monotonic()))
+                    except FutureTimeoutError:
+                        record_deadline_exceeded('vector_search')
+                        logger.warning(f"[Hybrid Search] Vector search quá {vector_budget:.1f}s, bỏ qua")
+                        degraded = True
+                    except (DeadlineExceeded, CircuitOpenError) as skip_error:
+                        logger.warning(f"[Hybrid Search] Bỏ vector search: {str(skip_error)}")
+                        degraded = True
+                    except Exception as vector_error:
+                        if not lexical_results:
+                            raise
+                        logger.warning(f"[Hybrid Search] Vector search lỗi, chỉ dùng BM25: {str(vector_error)}")
                 
-                if results:
-                    # Deduplicate theo product_id - giữ lại sản phẩm có score cao nhất
-                    unique_products = {}
-                    for result in results:
-                        vector_id = result.get('id', '')
-                        metadata = result.get('metadata', {})
-                        
-                        # Extract product_id từ vector_id
-                        # Format: {product_id}_text hoặc {product_id}_image_*
-                        product_id = None
-                        if '_' in vector_id:
-                            parts = vector_id.split('_')
-                            if parts:
-                                try:
-                                    product_id = int(parts[0])
-                                except ValueError:
-                                    # Nếu không parse được, thử lấy từ metadata
-                                    product_id = metadata.get('product_id')
-                        else:
-                            try:
-                                product_id = int(vector_id)
-                            except ValueError:
-                                product_id = metadata.get('product_id')
-                        
-                        if product_id:
-                            # Giữ lại sản phẩm có score cao nhất
-                            if product_id not in unique_products or result.get('score', 0) > unique_products[product_id].get('score', 0):
-                                unique_products[product_id] = {
-                                    'product_id': product_id,
-                                    'name': metadata.get('name', 'Không có tên'),
-                                    'price': metadata.get('price', 0),
-                                    'score': result.get('score', 0),
-                                    'metadata': metadata
-                                }
-                    
-                    # Sắp xếp theo score và lấy top 5
-                    sorted_products = sorted(
-                        unique_products.values(),
-                        key=lambda x: x['score'],
-                        reverse=True
-                    )[:5]
+                if degraded and not lexical_results:
+                    context_parts.append(self._catalog_context())
+                elif vector_ranking or lexical_results:
+                    # Gộp xếp hạng vector và BM25 bằng Reciprocal Rank Fusion, lấy top 5
+                    unique_products = {product['product_id']: product for product in vector_ranking}
+                    for result in lexical_results:
+                        unique_products.setdefault(result['product_id'], result)
+                    fused = reciprocal_rank_fusion(
+                        [
+                            [product['product_id'] for product in vector_ranking],
+                            [result['product_id'] for result in lexical_results]
+                        ],
+                        k=Config.HYBRID_RRF_K
+                    )
+                    sorted_products = [unique_products[product_id] for product_id, _ in fused[:5]]
                     
                     if sorted_products:
                         context_parts.append("\nCác sản phẩm tìm thấy:")
                         for idx, product in enumerate(sorted_products, 1):
+                            metadata = product['metadata']
                             context_parts.append(
-                                f"{idx}. {product['name']} - Giá: {product['price']:,.0f} VNĐ"
+                                f"{idx}. {metadata.get('name', 'Không có tên')} - Giá: {metadata.get('price', 0):,.0f} VNĐ"
                             )
                     else:
                         context_parts.append("Không tìm thấy sản phẩm phù hợp.")
@@ -0,0 +1,180 @@
+"""
+Cache phần prompt tĩnh (instruction + context sản phẩm) phía Gemini theo từng business
+
+- Mỗi business một cached content, khóa theo version = sha1(prefix): catalog đổi -> context đổi ->
+  tạo cached content mới và xóa bản cũ; mọi cuộc trò chuyện của shop dùng chung một bản
+- Cached content được tạo lại trước khi hết GEMINI_CONTEXT_CACHE_TTL_SECONDS
+- Trả None (GeminiService gửi prompt đầy đủ như cũ) khi: tắt GEMINI_CONTEXT_CACHE_ENABLED, SDK không có
+  module `google.generativeai.caching`, prefix nhỏ hơn GEMINI_CONTEXT_CACHE_MIN_TOKENS hoặc tạo cache lỗi
+"""
+import hashlib
+import logging
+import threading
+import time
+from datetime import timedelta
+from typing import Any, Dict, Optional
+
+import google.generativeai as genai
+
+from config import Config
+from utils.metrics import record_cache
+from utils.tokens import estimate_tokens
+from utils.tracing import span
+
+try:
+    from google.generativeai import caching as genai_caching
+except ImportError:  # google-generativeai < 0.7
+    genai_caching = None
+
+logger = logging.getLogger(__name__)
+
+# Sau khi tạo cache lỗi, chờ bấy nhiêu giây mới thử lại (trong lúc đó gửi prompt đầy đủ)
+_FAILURE_BACKOFF_SECONDS = 60
+
+
+class ContextCacheService:
+    """Quản lý cached content Gemini theo key (business_id)"""
+    
+    def __init__(
+        self,
+        enabled: Optional[bool] = None,
+        ttl_seconds: Optional[int] = None,
+        min_tokens: Optional[int] = None
+    ):
+        enabled = Config.GEMINI_CONTEXT_CACHE_ENABLED if enabled is None else enabled
+        if enabled and genai_caching is None:
+            logger.warning("[ContextCache] SDK google-generativeai không hỗ trợ context caching, dùng prompt đầy đủ")
+        self.enabled = enabled and genai_caching is not None
+        self.ttl_seconds = Config.GEMINI_CONTEXT_CACHE_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self.min_tokens = Config.GEMINI_CONTEXT_CACHE_MIN_TOKENS if min_tokens is None else min_tokens
+        # Tạo lại trước khi Gemini xóa cache để request không rơi vào cache vừa hết hạn
+        self._refresh_margin = min(300, self.ttl_seconds // 10)
+        self._entries: Dict[Any, Dict[str, Any]] = {}  # key -> {'version', 'model_name', 'cached', 'model', 'expire_at'}
+        self._lock = threading.Lock()
+        # key -> [lock, số request đang giữ / chờ]; bỏ khi không còn ai dùng để dict không phình theo số business
+        self._create_locks: Dict[Any, list] = {}
+    
+    @staticmethod
+    def context_version(prefix: str) -> str:
+        """Version của context: đổi khi instruction hoặc catalog đổi"""
+        return hashlib.sha1(prefix.encode('utf-8')).hexdigest()
+    
+    def get_model(self, model_name: str, key: Any, prefix: str):
+        """
+        Model Gemini gắn cached content chứa `prefix`
+        
+        Args:
+            model_name: Model dùng để tạo cache (cache chỉ dùng được với đúng model đó)
+            key: Khóa cache, thường là business_id
+            prefix: Phần prompt tĩnh (instruction + context sản phẩm)
+        
+        Returns:
+            GenerativeModel hoặc None nếu không dùng cache (gửi prompt đầy đủ)
+        """
+        if not self.enabled or key is None or estimate_tokens(prefix) < self.min_tokens:
+            return None
+        
+        version = self.context_version(prefix)
+        entry = self._lookup(key, version, model_name)
+        if entry is not None:
+            record_cache('gemini_context', hit=entry['model'] is not None)
+            return entry['model']
+        
+        record_cache('gemini_context', hit=False)
+        with self._lock:
+            create_lock = self._create_locks.setdefault(key, [threading.Lock(), 0])
+            create_lock[1] += 1
+        try:
+            # Chỉ một request tạo cache cho mỗi business, các request khác chờ và dùng lại
+            with create_lock[0]:
+                entry = self._lookup(key, version, model_name)
+                if entry is not None:
+                    return entry['model']
+                entry = self._create(model_name, key, version, prefix)
+                # Ghi dưới cùng lock với invalidate để không mất cập nhật
+                with self._lock:
+                    previous = self._entries.get(key)
+                    self._entries[key] = entry
+        finally:
+            with self._lock:
+                create_lock[1] -= 1
+                if create_lock[1] == 0:
+                    self._create_locks.pop(key, None)
+        
+        if previous is not None and previous['cached'] is not None:
+            self._delete(previous['cached'])
+        return entry['model']
+    
+    def invalidate(self, key: Any = None):
+        """Bỏ cached content của key (None: tất cả), ví dụ khi model bị Gemini trả lỗi cache không tồn tại"""
+        with self._lock:
+            if key is None:
+                entries = list(self._entries.values())
+                self._entries.clear()
+            else:
+                entry = self._entries.pop(key, None)
+                entries = [entry] if entry is not None else []
+        for entry in entries:
+            if entry['cached'] is not None:
+                self._delete(entry['cached'])
+    
+    def _lookup(self, key: Any, version: str, model_name: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if (
+            entry is not None
+            and entry['version'] == version
+            and entry['model_name'] == model_name
+            and time.time() < entry['expire_at']
+        ):
+            return entry
+        return None
+    
+    def _create(self, model_name: str, key: Any, version: str, prefix: str) -> Dict[str, Any]:
+        try:
+            with span('gemini.create_cached_content', key=str(key), prefix_chars=len(prefix)) as create_span:
+                cached = genai_caching.CachedContent.create(
+                    model=model_name,
+                    display_name=f"context-{key}-{version[:12]}",
+                    contents=[prefix],
+                    ttl=timedelta(seconds=self.ttl_seconds)
+                )
+                model = genai.GenerativeModel.from_cached_content(cached_content=cached)
+            logger.info(
+                f"[ContextCache] Tạo cached content key={key} version={version[:12]} "
+                f"(~{estimate_tokens(prefix)} tokens) - Thời gian xử lý: {create_span.duration:.3f}s"
+            )
+            return {
+                'version': version,
+                'model_name': model_name,
+                'cached': cached,
+                'model': model,
+                'expire_at': time.time() + self.ttl_seconds - self._refresh_margin
+            }
+        except Exception as e:
+            logger.warning(f"[ContextCache] Không tạo được cached content key={key}: {str(e)}")
+            return {
+                'version': version,
+                'model_name': model_name,
+                'cached': None,
+                'model': None,
+                'expire_at': time.time() + _FAILURE_BACKOFF_SECONDS
+            }
+    
+    def _delete(self, cached):
+        try:
+            cached.delete()
+        except Exception as e:
+            # Cache cũ tự hết hạn theo TTL
+            logger.debug(f"[ContextCache] Không xóa được cached content: {str(e)}")
+
+
+# Singleton instance
+_context_cache_service_instance: Optional[ContextCacheService] = None
+
+
+def get_context_cache_service() -> ContextCacheService:
+    """Lấy singleton ContextCacheService"""
+    global _context_cache_service_instance
+    if _context_cache_service_instance is None:
+        _context_cache_service_instance = ContextCacheService()
+    return _context_cache_service_instance
@@ -0,0 +1,229 @@
+"""
+Lưu lịch sử chat phía server theo (business_id, customer_id)
+
+- Bảng Conversation_Message (SQLite/MySQL, chỉ INSERT) là nguồn dữ liệu chính
+- Hot tier trong RAM: CONVERSATION_MAX_MESSAGES tin nhắn gần nhất của CONVERSATION_HOT_CUSTOMERS cuộc
+  trò chuyện dùng gần nhất (LRU); đọc lại từ DB sau CONVERSATION_HOT_TTL_SECONDS để các worker khác
+  nhau không lệch nhau quá lâu
+- Tin nhắn cũ hơn CONVERSATION_RETENTION_DAYS được xóa định kỳ ở thread nền
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, select
+
+from config import Config
+from database import SessionLocal, engine, get_db_now
+from models.conversation_message import ConversationMessage
+from utils.metrics import record_cache
+from utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Khoảng cách giữa hai lần xóa tin nhắn hết hạn (giây)
+_PRUNE_INTERVAL_SECONDS = 3600
+
+
+class ConversationStore:
+    """Lịch sử chat: ghi thêm vào DB, đọc qua cache RAM"""
+    
+    def __init__(
+        self,
+        max_messages: Optional[int] = None,
+        hot_customers: Optional[int] = None,
+        hot_ttl_seconds: Optional[int] = None,
+        retention_days: Optional[int] = None
+    ):
+        self.max_messages = Config.CONVERSATION_MAX_MESSAGES if max_messages is None else max_messages
+        self._hot_customers = Config.CONVERSATION_HOT_CUSTOMERS if hot_customers is None else hot_customers
+        self._hot_ttl = Config.CONVERSATION_HOT_TTL_SECONDS if hot_ttl_seconds is None else hot_ttl_seconds
+        self.retention_days = Config.CONVERSATION_RETENTION_DAYS if retention_days is None else retention_days
+        # (business_id, customer_id) -> (deque tin nhắn, expire_at)
+        self._hot: OrderedDict[Tuple[int, int], Tuple[deque, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_prune = 0.0
+        self._prune_lock = threading.Lock()
+    
+    def ensure_table(self) -> bool:
+        """Tạo bảng Conversation_Message nếu chưa có (gọi khi khởi động app)"""
+        try:
+            ConversationMessage.__table__.create(bind=engine, checkfirst=True)
+            return True
+        except Exception as e:
+            logger.error(f"[Conversation] Không tạo được bảng Conversation_Message: {str(e)}")
+            return False
+    
+    def get_history(self, business_id: int, customer_id: int) -> List[Dict[str, str]]:
+        """
+        Lịch sử chat gần nhất (cũ -> mới)
+        
+        Đọc DB lỗi (mất kết nối, chưa có bảng) chỉ log và trả về [], không làm hỏng request chat
+        
+        Returns:
+            List[Dict]: [{'role', 'content'}], tối đa max_messages tin nhắn
+        """
+        key = (business_id, customer_id)
+        with self._lock:
+            cached = self._hot.get(key)
+            if cached is not None and time.time() < cached[1]:
+                self._hot.move_to_end(key)
+                record_cache('conversation', hit=True)
+                return list(cached[0])
+        
+        record_cache('conversation', hit=False)
+        try:
+            with span('db.conversation_history', business_id=business_id):
+                messages = self._load(business_id, customer_id)
+        except Exception as e:
+            logger.error(f"[Conversation] Lỗi khi đọc lịch sử business_id={business_id}, customer_id={customer_id}: {str(e)}")
+            return []
+        with self._lock:
+            self._put_hot(key, deque(messages, maxlen=self.max_messages))
+        return messages
+    
+    def append(
+        self,
+        business_id: int,
+        customer_id: int,
+        messages: List[Dict[str, str]],
+        history: Optional[List[Dict[str, str]]] = None
+    ):
+        """
+        Ghi thêm tin nhắn vào cache RAM (request sau thấy ngay)
+        Gọi persist() để ghi DB (có thể chạy sau khi trả response)
+        
+        Args:
+            history: Lịch sử vừa đọc bằng get_history (nếu có), dùng khi cache RAM không còn key này;
+                không có thì đọc từ DB (đọc lỗi thì chỉ log và coi như lịch sử rỗng).
+                Cache luôn được ghi để request sau không đọc DB trước khi persist() xong
+        """
+        key = (business_id, customer_id)
+        new_messages = [{'role': m['role'], 'content': m['content']} for m in messages]
+        with self._lock:
+            cached = self._hot.get(key)
+            if cached is not None:
+                cached[0].extend(new_messages)
+                self._hot.move_to_end(key)
+                return
+        
+        if history is None:
+            try:
+                with span('db.conversation_history', business_id=business_id):
+                    history = self._load(business_id, customer_id)
+            except Exception as e:
+                logger.error(f"[Conversation] Lỗi khi đọc lịch sử business_id={business_id}, customer_id={customer_id}: {str(e)}")
+                history = []
+        with self._lock:
+            cached = self._hot.get(key)
+            if cached is not None:
+                # Request khác đã ghi cache trong lúc đọc DB
+                cached[0].extend(new_messages)
+                self._hot.move_to_end(key)
+            else:
+                self._put_hot(key, deque(list(history) + new_messages, maxlen=self.max_messages))
+    
+    def persist(self, business_id: int, customer_id: int, messages: List[Dict[str, str]]):
+        """INSERT tin nhắn vào DB; lỗi chỉ log (cache RAM vẫn giữ tin nhắn đến khi hết hạn)"""
+        db = SessionLocal()
+        try:
+            db.add_all([
+                ConversationMessage(
+                    business_id=business_id,
+                    customer_id=customer_id,
+                    role=m['role'],
+                    content=m['content']
+                )
+                for m in messages
+            ])
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"[Conversation] Lỗi khi lưu tin nhắn business_id={business_id}, customer_id={customer_id}: {str(e)}")
+        finally:
+            db.close()
+        self._maybe_prune()
+    
+    def clear(self, business_id: int, customer_id: int):
+        """Xóa lịch sử của một khách hàng (DB + cache)"""
+        with self._lock:
+            self._hot.pop((business_id, customer_id), None)
+        db = SessionLocal()
+        try:
+            db.execute(delete(ConversationMessage).where(
+                ConversationMessage.business_id == business_id,
+                ConversationMessage.customer_id == customer_id
+            ))
+            db.commit()
+        finally:
+            db.close()
+    
+    def prune(self) -> int:
+        """Xóa tin nhắn cũ hơn retention_days; trả về số dòng đã xóa"""
+        if self.retention_days <= 0:
+            return 0
+        db = SessionLocal()
+        try:
+            cutoff = get_db_now(db) - timedelta(days=self.retention_days)
+            result = db.execute(delete(ConversationMessage).where(ConversationMessage.created_at < cutoff))
+            db.commit()
+            if result.rowcount:
+                logger.info(f"[Conversation] Đã xóa {result.rowcount} tin nhắn cũ hơn {self.retention_days} ngày")
+            return result.rowcount or 0
+        finally:
+            db.close()
+    
+    def _maybe_prune(self):
+        now = time.time()
+        if self.retention_days <= 0 or now - self._last_prune < _PRUNE_INTERVAL_SECONDS:
+            return
+        if not self._prune_lock.acquire(blocking=False):
+            return
+        self._last_prune = now
+        
+        def run():
+            try:
+                self.prune()
+            except Exception as e:
+                logger.error(f"[Conversation] Lỗi khi xóa tin nhắn cũ: {str(e)}")
+            finally:
+                self._prune_lock.release()
+        
+        threading.Thread(target=run, name='conversation-prune', daemon=True).start()
+    
+    def _load(self, business_id: int, customer_id: int) -> List[Dict[str, str]]:
+        db = SessionLocal()
+        try:
+            rows = db.execute(
+                select(ConversationMessage.role, ConversationMessage.content)
+                .where(
+                    ConversationMessage.business_id == business_id,
+                    ConversationMessage.customer_id == customer_id
+                )
+                .order_by(ConversationMessage.id.desc())
+                .limit(self.max_messages)
+            ).all()
+        finally:
+            db.close()
+        return [{'role': row.role, 'content': row.content} for row in reversed(rows)]
+    
+    def _put_hot(self, key: Tuple[int, int], messages: deque):
+        self._hot[key] = (messages, time.time() + self._hot_ttl)
+        self._hot.move_to_end(key)
+        while len(self._hot) > self._hot_customers:
+            self._hot.popitem(last=False)
+
+
+# Singleton instance
+_conversation_store_instance: Optional[ConversationStore] = None
+
+
+def get_conversation_store() -> ConversationStore:
+    """Lấy singleton ConversationStore"""
+    global _conversation_store_instance
+    if _conversation_store_instance is None:
+        _conversation_store_instance = ConversationStore()
+    return _conversation_store_instance
@@ -4,15 +4,24 @@ Service để tạo embeddings từ text và image sử dụng Google Vertex AI
 from typing import List, Optional
 import logging
 import os
-import time
 import base64
-import requests
+import numpy as np
 import google.cloud.aiplatform as aiplatform
 from google.protobuf import struct_pb2
 from config import Config
+from utils.image_helper import download_and_prepare_image
+from utils.http_client import get_http_session, get_image_cache
+from utils.tracing import span
+from utils.metrics import observe_call
+from utils.single_flight import SingleFlight
+from utils.deadline import stage_timeout
+from utils.circuit_breaker import get_circuit_breaker
 
 logger = logging.getLogger(__name__)
 
+# Các request tạo embedding cùng text đang chạy đồng thời dùng chung một lời gọi Vertex AI
+_inflight = SingleFlight('embedding')
+
 
 class EmbeddingService:
     """Service để tạo embeddings từ text và image sử dụng Google Vertex AI"""
@@ -64,36 +73,56 @@ class EmbeddingService:
         # Endpoint cho multimodal embedding model
         self.endpoint = f"projects/{self.project_id}/locations/{self.location}/publishers/google/models/multimodalembedding@001"
     
-    def create_embedding(self, text: str) -> List[float]:
+    def _to_vector(self, values) -> np.ndarray:
+        """
+        Chuyển embedding trong response protobuf sang np.ndarray float32 liền mạch
+        
+        np.fromiter đọc thẳng từ iterator của protobuf, không tạo list float trung gian
+        """
+        return np.fromiter(values, dtype=np.float32, count=len(values))
+    
+    @observe_call('create_embedding')
+    def create_embedding(self, text: str, dimension: Optional[int] = None) -> np.ndarray:
         """
         Tạo embedding vector từ text sử dụng Google Vertex AI
         
         Args:
             text: Text cần tạo embedding
+            dimension: Số chiều yêu cầu Vertex AI trả về (128/256/512/1408), mặc định self.dimension
         
         Returns:
-            List[float]: Vector embedding
+            np.ndarray: Vector embedding float32 (1-D)
         """
         try:
+            dimension = dimension or self.dimension
+            
             # Tạo instance với text
             instance = struct_pb2.Struct()
             instance.update({"text": text})
             
             # Set dimension
             parameters = struct_pb2.Struct()
-            parameters.update({"dimension": self.dimension})
+            parameters.update({"dimension": dimension})
             
             # Đo thời gian tạo embedding
-            start_time = time.perf_counter()
-            res = self.client.predict(
-                endpoint=self.endpoint,
-                instances=[instance],
-                parameters=parameters
-            )
-            elapsed_time = time.perf_counter() - start_time
+            timeout = stage_timeout(Config.STAGE_TIMEOUT_EMBEDDING_SECONDS, 'embedding')
+            with span('vertex.create_embedding', text_chars=len(text)) as embed_span:
+                # Circuit breaker 'vertex': Vertex AI đang lỗi thì raise CircuitOpenError ngay, không chờ timeout
+                res = _inflight.do(
+                    ('text', self.endpoint, dimension, text),
+                    lambda: get_circuit_breaker('vertex').call(
+                        lambda: self.client.predict(
+                            endpoint=self.endpoint,
+                            instances=[instance],
+                            parameters=parameters,
+                            timeout=timeout
+                        )
+                    )
+                )
+            elapsed_time = embed_span.duration
             
             # Lấy text embedding
-            embedding = list(res.predictions[0]['textEmbedding'])
+            embedding = self._to_vector(res.predictions[0]['textEmbedding'])
             
             logger.info(
                 f"[Embedding] Tạo text embedding - dimension: {len(embedding)} - "
@@ -105,7 +134,7 @@ class EmbeddingService:
             logger.error(f"Lỗi khi tạo text embedding: {str(e)}")
             raise
     
-    def create_embeddings_batch(self, texts: List[str]) -> List[List[float]]:
+    def create_embeddings_batch(self, texts: List[str]) -> np.ndarray:
         """
         Tạo embeddings cho nhiều texts cùng lúc
         
@@ -113,84 +142,138 @@ class EmbeddingService:
             texts: List các texts cần tạo embedding
         
         Returns:
-            List[List[float]]: List các vectors
+            np.ndarray: Ma trận float32 (len(texts) x dimension), mỗi dòng một vector
         """
         try:
-            # Vertex AI không hỗ trợ batch trực tiếp, gọi từng cái
-            embeddings = []
-            for text in texts:
-                embedding = self.create_embedding(text)
-                embeddings.append(embedding)
+            # Vertex AI không hỗ trợ batch trực tiếp, gọi từng cái và ghi thẳng vào ma trận
+            embeddings = np.empty((len(texts), self.dimension), dtype=np.float32)
+            for row, text in enumerate(texts):
+                embeddings[row] = self.create_embedding(text)
             
             return embeddings
         except Exception as e:
             logger.error(f"Lỗi khi tạo embeddings batch: {str(e)}")
             raise
     
-    def create_image_embedding(self, image_url: str) -> Optional[List[float]]:
+    def index_dimension(self) -> Optional[int]:
+        """
+        Số chiều vector lưu trong Pinecone index nếu nhỏ hơn embedding đầy đủ, ngược lại None
+        
+        multimodalembedding@001 không phải model Matryoshka: cắt prefix vector 1408 chiều không cho
+        vector 256 chiều hợp lệ, nên vector index phải được Vertex AI tạo trực tiếp với dimension nhỏ
+        """
+        if Config.VECTOR_INDEX_DIMENSION and Config.VECTOR_INDEX_DIMENSION < self.dimension:
+            return Config.VECTOR_INDEX_DIMENSION
+        return None
+    
+    def create_text_vectors(self, text: str) -> dict:
+        """
+        Tạo vector đầy đủ và (nếu index giảm chiều) vector index do Vertex AI trả về cho text
+        
+        Returns:
+            dict: {'vector': np.ndarray đầy đủ, 'index_vector': np.ndarray giảm chiều hoặc None}
+        """
+        index_dimension = self.index_dimension()
+        return {
+            'vector': self.create_embedding(text),
+            'index_vector': self.create_embedding(text, dimension=index_dimension) if index_dimension else None
+        }
+    
+    def _prepare_image(self, image_url: str) -> bytes:
+        """Download ảnh và chuẩn bị bytes JPEG để gửi Vertex AI"""
+        # Download ảnh dạng stream qua session dùng chung (keep-alive, conditional request),
+        # từ chối ảnh vượt giới hạn / bị cắt cụt, thu nhỏ và nén JPEG để giảm payload upload
+        with span('image.download'):
+            return download_and_prepare_image(
+                image_url,
+                max_bytes=Config.MAX_IMAGE_DOWNLOAD_BYTES,
+                max_side=Config.EMBEDDING_IMAGE_MAX_SIDE,
+                jpeg_quality=Config.EMBEDDING_IMAGE_JPEG_QUALITY,
+                timeout=stage_timeout(Config.STAGE_TIMEOUT_IMAGE_DOWNLOAD_SECONDS, 'image_download'),
+                session=get_http_session(),
+                cache=get_image_cache()
+            )
+    
+    def _predict_image(self, image_url: str, image_bytes: bytes, dimension: int) -> np.ndarray:
+        """Gọi Vertex AI tạo image embedding với số chiều cho trước"""
+        image_base64 = base64.b64encode(image_bytes).decode("utf-8")
+        
+        # Tạo instance với image
+        instance = struct_pb2.Struct()
+        instance.update({"image": {"bytesBase64Encoded": image_base64}})
+        
+        # Set dimension
+        parameters = struct_pb2.Struct()
+        parameters.update({"dimension": dimension})
+        
+        # Đo thời gian tạo embedding
+        timeout = stage_timeout(Config.STAGE_TIMEOUT_EMBEDDING_SECONDS, 'image_embedding')
+        with span('vertex.create_image_embedding', image_bytes=len(image_bytes)) as embed_span:
+            res = get_circuit_breaker('vertex').call(
+                lambda: self.client.predict(
+                    endpoint=self.endpoint,
+                    instances=[instance],
+                    parameters=parameters,
+                    timeout=timeout
+                )
+            )
+        elapsed_time = embed_span.duration
+        
+        # Lấy image embedding
+        embedding = self._to_vector(res.predictions[0]['imageEmbedding'])
+        
+        logger.info(
+            f"[Embedding] Tạo image embedding cho {image_url} - dimension: {len(embedding)} - "
+            f"Thời gian xử lý: {elapsed_time:.3f}s"
+        )
+        return embedding
+    
+    @observe_call('create_image_embedding')
+    def create_image_embedding(self, image_url: str, dimension: Optional[int] = None) -> Optional[np.ndarray]:
         """
         Tạo embedding vector từ ảnh (URL) sử dụng Google Vertex AI
         
         Args:
             image_url: URL của ảnh cần tạo embedding
+            dimension: Số chiều yêu cầu Vertex AI trả về (128/256/512/1408), mặc định self.dimension
         
         Returns:
-            List[float]: Vector embedding hoặc None nếu không thể tạo
+            np.ndarray: Vector embedding float32 hoặc None nếu không thể tạo
         """
         try:
             if not image_url:
                 return None
             
-            # Download ảnh với giới hạn dung lượng để giảm băng thông (tải về)
-            max_bytes = getattr(Config, 'MAX_IMAGE_DOWNLOAD_BYTES', 2_097_152)
-            response = requests.get(image_url, timeout=10, stream=True)
-            response.raise_for_status()
-            chunks = []
-            total = 0
-            for chunk in response.iter_content(chunk_size=65536):
-                if chunk:
-                    chunks.append(chunk)
-                    total += len(chunk)
-                    if total > max_bytes:
-                        logger.warning(f"Ảnh vượt giới hạn {max_bytes} bytes, dừng tải: {image_url}")
-                        break
-            image_bytes = b"".join(chunks)
-            if not image_bytes:
-                logger.warning(f"Không có dữ liệu ảnh: {image_url}")
+            return self._predict_image(image_url, self._prepare_image(image_url), dimension or self.dimension)
+        
+        except Exception as e:
+            logger.error(f"Lỗi khi tạo image embedding từ {image_url}: {str(e)}")
+            return None
+    
+    @observe_call('create_image_embedding')
+    def create_image_vectors(self, image_url: str) -> Optional[dict]:
+        """
+        Tạo vector đầy đủ và (nếu index giảm chiều) vector index cho ảnh, chỉ download ảnh một lần
+        
+        Returns:
+            dict: {'vector', 'index_vector'} như create_text_vectors, hoặc None nếu không thể tạo
+        """
+        try:
+            if not image_url:
                 return None
-            image_base64 = base64.b64encode(image_bytes).decode("utf-8")
-            
-            # Tạo instance với image
-            instance = struct_pb2.Struct()
-            instance.update({"image": {"bytesBase64Encoded": image_base64}})
-            
-            # Set dimension
-            parameters = struct_pb2.Struct()
-            parameters.update({"dimension": self.dimension})
-            
-            # Đo thời gian tạo embedding
-            start_time = time.perf_counter()
-            res = self.client.predict(
-                endpoint=self.endpoint,
-                instances=[instance],
-                parameters=parameters
-            )
-            elapsed_time = time.perf_counter() - start_time
-            
-            # Lấy image embedding
-            embedding = list(res.predictions[0]['imageEmbedding'])
             
-            logger.info(
-                f"[Embedding] Tạo image embedding cho {image_url} - dimension: {len(embedding)} - "
-                f"Thời gian xử lý: {elapsed_time:.3f}s"
-            )
-            return embedding
+            image_bytes = self._prepare_image(image_url)
+            index_dimension = self.index_dimension()
+            return {
+                'vector': self._predict_image(image_url, image_bytes, self.dimension),
+                'index_vector': self._predict_image(image_url, image_bytes, index_dimension) if index_dimension else None
+            }
                 
         except Exception as e:
             logger.error(f"Lỗi khi tạo image embedding từ {image_url}: {str(e)}")
             return None
     
-    def create_image_embeddings_batch(self, image_urls: List[str]) -> List[Optional[List[float]]]:
+    def create_image_embeddings_batch(self, image_urls: List[str]) -> List[Optional[np.ndarray]]:
         """
         Tạo embeddings cho nhiều ảnh cùng lúc
         
@@ -198,7 +281,7 @@ class EmbeddingService:
             image_urls: List các URLs của ảnh
         
         Returns:
-            List[Optional[List[float]]]: List các vectors (có thể None nếu không tạo được)
+            List[Optional[np.ndarray]]: List các vectors float32 (có thể None nếu không tạo được)
         """
         embeddings = []
         for image_url in image_urls:
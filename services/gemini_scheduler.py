@@ -0,0 +1,216 @@
+"""
+Điều phối lời gọi ra Gemini theo quota (client-side)
+
+- Token bucket theo request/phút (GEMINI_RPM) và token/phút (GEMINI_TPM, ước lượng từ prompt
+  + GEMINI_OUTPUT_TOKENS_ESTIMATE); 0 = không giới hạn
+- Hàng đợi có ưu tiên: chat của khách (INTERACTIVE) đi trước tác vụ phụ như tóm tắt lịch sử (BACKGROUND),
+  cùng mức ưu tiên thì vào trước ra trước; tối đa GEMINI_MAX_QUEUE lời gọi chờ, mỗi lời gọi chờ tới deadline
+- Lỗi 429 / 503: thử lại với backoff ngẫu nhiên (full jitter); 429 tạm dừng cả hàng đợi trong khoảng
+  backoff để các request khác không tiếp tục dội vào quota
+"""
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from typing import Any, Callable, List, Optional, Tuple
+
+from config import Config
+from utils.metrics import LLM_QUEUE_WAIT_SECONDS, record_llm_throttle
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+_PRIORITY_LABELS = {PRIORITY_INTERACTIVE: 'interactive', PRIORITY_BACKGROUND: 'background'}
+
+# HTTP status được thử lại (google.api_core: ResourceExhausted = 429, ServiceUnavailable = 503)
+_RETRYABLE_CODES = (429, 503)
+
+
+class GeminiThrottledError(Exception):
+    """Không lấy được lượt gọi Gemini (hàng đợi đầy hoặc hết thời gian chờ)"""
+    pass
+
+
+def _error_code(error: Exception) -> Optional[int]:
+    code = getattr(error, 'code', None)
+    try:
+        return int(code) if code is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Bucket nạp đều `rate_per_minute` đơn vị mỗi phút, chứa tối đa một phút quota"""
+    
+    def __init__(self, rate_per_minute: float):
+        self.capacity = float(rate_per_minute)
+        self.rate = rate_per_minute / 60.0
+        self.level = self.capacity
+        self._updated = time.monotonic()
+    
+    @property
+    def unlimited(self) -> bool:
+        return self.capacity <= 0
+    
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+    
+    def wait_time(self, amount: float, now: float) -> float:
+        """Số giây cần chờ để có đủ `amount` (0 nếu đủ ngay)"""
+        if self.unlimited:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+    
+    def consume(self, amount: float, now: float):
+        """Trừ `amount` (có thể âm để hoàn lại; level âm = nợ, các lời gọi sau chờ lâu hơn)"""
+        if self.unlimited:
+            return
+        self._refill(now)
+        self.level = min(self.capacity, self.level - min(amount, self.capacity))
+
+
+class GeminiScheduler:
+    """Giới hạn tốc độ + hàng đợi ưu tiên + retry cho các lời gọi Gemini"""
+    
+    def __init__(
+        self,
+        rpm: Optional[int] = None,
+        tpm: Optional[int] = None,
+        max_queue: Optional[int] = None,
+        queue_timeout: Optional[float] = None,
+        max_retries: Optional[int] = None,
+        retry_base_seconds: Optional[float] = None,
+        retry_max_seconds: Optional[float] = None
+    ):
+        self.requests = TokenBucket(Config.GEMINI_RPM if rpm is None else rpm)
+        self.tokens = TokenBucket(Config.GEMINI_TPM if tpm is None else tpm)
+        self.max_queue = Config.GEMINI_MAX_QUEUE if max_queue is None else max_queue
+        self.queue_timeout = Config.GEMINI_QUEUE_TIMEOUT_SECONDS if queue_timeout is None else queue_timeout
+        self.max_retries = Config.GEMINI_MAX_RETRIES if max_retries is None else max_retries
+        self.retry_base = Config.GEMINI_RETRY_BASE_SECONDS if retry_base_seconds is None else retry_base_seconds
+        self.retry_max = Config.GEMINI_RETRY_MAX_SECONDS if retry_max_seconds is None else retry_max_seconds
+        self._waiting: List[Tuple[int, int]] = []  # heap (priority, seq)
+        self._seq = itertools.count()
+        self._paused_until = 0.0
+        self._cond = threading.Condition()
+    
+    def call(
+        self,
+        fn: Callable[[], Any],
+        tokens: int,
+        priority: int = PRIORITY_INTERACTIVE,
+        deadline: Optional[float] = None
+    ) -> Any:
+        """
+        Chờ tới lượt theo quota rồi gọi `fn()`, thử lại khi Gemini trả 429 / 503
+        
+        Args:
+            fn: Lời gọi Gemini
+            tokens: Số token ước lượng của lời gọi (prompt + output)
+            priority: PRIORITY_INTERACTIVE hoặc PRIORITY_BACKGROUND
+            deadline: Thời điểm (time.monotonic) phải có kết quả; None = now + GEMINI_QUEUE_TIMEOUT_SECONDS
+        
+        Raises:
+            GeminiThrottledError: Hàng đợi đầy / quá deadline khi chờ lượt
+        """
+        if deadline is None:
+            deadline = time.monotonic() + self.queue_timeout
+        attempt = 0
+        while True:
+            self.acquire(tokens, priority, deadline)
+            try:
+                return fn()
+            except Exception as e:
+                code = _error_code(e)
+                if code not in _RETRYABLE_CODES or attempt >= self.max_retries:
+                    raise
+                delay = random.uniform(0, min(self.retry_max, self.retry_base * (2 ** attempt)))
+                if time.monotonic() + delay >= deadline:
+                    raise
+                attempt += 1
+                record_llm_throttle(f'retry_{code}')
+                logger.warning(f"[Gemini] Lỗi {code}, thử lại lần {attempt} sau {delay:.2f}s: {str(e)}")
+                if code == 429:
+                    self.pause(delay)
+                time.sleep(delay)
+    
+    def acquire(self, tokens: int, priority: int = PRIORITY_INTERACTIVE, deadline: Optional[float] = None):
+        """
+        Chờ tới lượt (đứng đầu hàng đợi và đủ quota) rồi trừ quota
+        
+        Raises:
+            GeminiThrottledError: Hàng đợi đầy hoặc quá deadline
+        """
+        if deadline is None:
+            deadline = time.monotonic() + self.queue_timeout
+        start = time.monotonic()
+        with self._cond:
+            if len(self._waiting) >= self.max_queue:
+                record_llm_throttle('queue_full')
+                raise GeminiThrottledError(f"Hàng đợi Gemini đã có {len(self._waiting)} lời gọi")
+            entry = (priority, next(self._seq))
+            heapq.heappush(self._waiting, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = None
+                    if self._waiting[0] == entry:
+                        wait = max(
+                            self._paused_until - now,
+                            self.requests.wait_time(1, now),
+                            self.tokens.wait_time(tokens, now)
+                        )
+                        if wait <= 0:
+                            self.requests.consume(1, now)
+                            self.tokens.consume(tokens, now)
+                            heapq.heappop(self._waiting)
+                            self._cond.notify_all()
+                            break
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        record_llm_throttle('timeout')
+                        raise GeminiThrottledError(f"Quá thời gian chờ lượt gọi Gemini ({now - start:.1f}s)")
+                    self._cond.wait(remaining if wait is None else min(wait, remaining))
+            except BaseException:
+                if entry in self._waiting:
+                    self._waiting.remove(entry)
+                    heapq.heapify(self._waiting)
+                    self._cond.notify_all()
+                raise
+        LLM_QUEUE_WAIT_SECONDS.labels(priority=_PRIORITY_LABELS.get(priority, 'other')).observe(time.monotonic() - start)
+    
+    def pause(self, seconds: float):
+        """Tạm dừng cấp lượt trong `seconds` giây (khi Gemini báo hết quota)"""
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+    
+    def adjust_tokens(self, delta: int):
+        """Điều chỉnh TPM theo số token thực tế sau khi có response (delta = thực tế - ước lượng)"""
+        if not delta:
+            return
+        with self._cond:
+            self.tokens.consume(delta, time.monotonic())
+            if delta < 0:
+                self._cond.notify_all()
+
+
+# Lazy singleton: dùng chung quota cho mọi GeminiService trong process
+_gemini_scheduler_instance: Optional[GeminiScheduler] = None
+_init_lock = threading.Lock()
+
+
+def get_gemini_scheduler() -> GeminiScheduler:
+    """Lấy singleton GeminiScheduler"""
+    global _gemini_scheduler_instance
+    if _gemini_scheduler_instance is None:
+        with _init_lock:
+            if _gemini_scheduler_instance is None:
+                _gemini_scheduler_instance = GeminiScheduler()
+    return _gemini_scheduler_instance
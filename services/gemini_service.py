@@ -2,18 +2,52 @@
 Service để gọi Gemini LLM API
 """
 import os
+import json
 import time
 import logging
-from typing import Optional, List, Dict
+import threading
+from typing import Optional, List, Dict, Tuple
 import google.generativeai as genai
 from config import Config
+from utils.tracing import span
+from utils.metrics import observe_call, record_cache
+from utils.memo_cache import MemoCache
+from utils.single_flight import SingleFlight
+from utils.tokens import estimate_tokens
+from utils.deadline import DeadlineExceeded, run_with_timeout, stage_timeout
+from utils.circuit_breaker import CircuitOpenError, get_circuit_breaker
+from services.context_cache_service import get_context_cache_service
+from services.gemini_scheduler import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE,
+    GeminiThrottledError,
+    get_gemini_scheduler
+)
+from services.history_manager import format_message, get_history_manager
 
 logger = logging.getLogger(__name__)
 
+# Các lời gọi temperature 0 cùng model + prompt + config đang chạy đồng thời dùng chung một request tới Gemini
+_inflight = SingleFlight('gemini')
+
 
 class GeminiService:
     """Service để tương tác với Gemini LLM"""
     
+    # Câu trả lời thay thế khi Gemini lỗi / trả lời không phải tiếng Việt (không được cache)
+    WAIT_REPLY = (
+        "Dạ bạn chờ shop một chút nhé, "
+        "mình sẽ hỗ trợ bạn ngay ạ 😊"
+    )
+    ERROR_REPLY = (
+        "Xin lỗi, hệ thống đang gặp sự cố. "
+        "Bạn vui lòng liên hệ số 0985006914 để được hỗ trợ nhanh hơn nhé ạ."
+    )
+    # Câu trả lời của generate_chat_response khi lỗi
+    CHAT_ERROR_REPLY = "Xin lỗi, tôi gặp sự cố kỹ thuật. Vui lòng thử lại sau."
+    # Các câu trả lời thay thế: không phải câu trả lời thật, không lưu vào lịch sử / cache
+    FALLBACK_REPLIES = (WAIT_REPLY, ERROR_REPLY, CHAT_ERROR_REPLY)
+    
     def __init__(self):
         """Khởi tạo Gemini client"""
         # Lấy API key từ config
@@ -24,6 +58,7 @@ class GeminiService:
         genai.configure(api_key=api_key)
         # Có thể đổi model: 'gemini-pro', 'gemini-1.5-pro', 'gemini-1.5-flash'
         model_name = os.getenv('GEMINI_MODEL', 'gemini-2.5-flash')
+        self.model_name = model_name
         self.model = genai.GenerativeModel(model_name)
         logger.info(f"Đã khởi tạo Gemini client với model: {model_name}")
     
@@ -109,6 +144,7 @@ class GeminiService:
     #             'related_intents': []
     #         }
 
+    @observe_call('classify_intent')
     def classify_intent(
             self,
             message: str,
@@ -116,15 +152,20 @@ class GeminiService:
             available_intents: List[Dict]
     ) -> Dict:
         try:
-            intent_list = "\n".join(
-                intent["type"] for intent in available_intents
-            )
+            with span('prompt.build', kind='classify_intent'):
+                intent_list = "\n".join(
+                    intent["type"] for intent in available_intents
+                )
 
-            recent_conversations = conversations[-2:] if conversations else []
-            conversation_text = "\n".join(
-                f"{msg.get('role', 'user')}: {msg.get('content', '')}"
-                for msg in recent_conversations
-            )
+                # Chỉ cần vài tin nhắn gần nhất để phân loại, không tóm tắt phần cũ
+                history = get_history_manager().compact(
+                    conversations or [],
+                    Config.HISTORY_TOKEN_BUDGET_INTENT,
+                    summarize=False
+                )
+                conversation_text = "\n".join(
+                    format_message(msg) for msg in history['recent']
+                )
 
             prompt = f"""
                     You are an intent classifier.
@@ -144,20 +185,23 @@ class GeminiService:
                     No markdown. No explanation.
                     """
 
-            start_time = time.perf_counter()
-
-            response = self.model.generate_content(
-                prompt,
-                generation_config={
-                    "temperature": 0
-                }
-            )
-
-            elapsed = time.perf_counter() - start_time
-            text = response.text.strip()
+            generation_config = {
+                "temperature": 0
+            }
+            memo_key, text = self._memo_lookup('classify_intent', prompt, generation_config)
+            with span('gemini.classify_intent', prompt_chars=len(prompt), memo_hit=text is not None) as llm_span:
+                if text is None:
+                    text = self._generate_text(
+                        'classify_intent',
+                        prompt,
+                        generation_config,
+                        stage_budget=Config.STAGE_TIMEOUT_INTENT_SECONDS
+                    )
 
-            import json
+            elapsed = llm_span.duration
             result = json.loads(text)
+            # Chỉ memo kết quả parse được
+            self._memo_store(memo_key, text)
 
             logger.info(
                 f"[LLM][Intent] {result.get('intent')} | "
@@ -231,20 +275,31 @@ class GeminiService:
     #         logger.error(f"Lỗi khi tạo phản hồi: {str(e)}")
     #         return "Xin lỗi, tôi gặp sự cố kỹ thuật. Vui lòng thử lại sau."
 
+    @observe_call('generate_response')
     def generate_response(
             self,
             message: str,
             conversations: List[Dict],
             context: str,
-            intent: str
+            intent: str,
+            history_key: Optional[tuple] = None
     ) -> str:
         try:
-            # ===== 1. Chỉ lấy 2–3 turn gần nhất =====
-            recent_conversations = conversations[-3:] if conversations else []
-            conversation_history = "\n".join(
-                f"{msg.get('role', 'user')}: {msg.get('content', '')}"
-                for msg in recent_conversations
-            )
+            with span('prompt.build', kind='generate_response'):
+                # ===== 1. Các turn gần nhất theo ngân sách token, phần cũ hơn được tóm tắt =====
+                history = get_history_manager().compact(
+                    conversations or [],
+                    Config.HISTORY_TOKEN_BUDGET_RESPONSE,
+                    key=history_key,
+                    summarizer=self._history_summarizer()
+                )
+                conversation_history = "\n".join(
+                    format_message(msg) for msg in history['recent']
+                )
+                if history['summary']:
+                    conversation_history = (
+                        f"(Tóm tắt trước đó)\n{history['summary']}\n(Gần nhất)\n{conversation_history}"
+                    )
 
             # ===== 2. Prompt NGẮN + ÉP TIẾNG VIỆT =====
             prompt = f"""
@@ -273,17 +328,17 @@ class GeminiService:
             - Lịch sự
             """
 
-            start_time = time.perf_counter()
-
-            response = self.model.generate_content(
-                prompt,
-                generation_config={
-                    "temperature": 0
-                }
-            )
+            generation_config = {
+                "temperature": 0
+            }
+            memo_key, reply = self._memo_lookup('generate_response', prompt, generation_config)
+            with span(
+                'gemini.generate_response', intent=intent, prompt_chars=len(prompt), memo_hit=reply is not None
+            ) as llm_span:
+                if reply is None:
+                    reply = self._generate_text('generate_response', prompt, generation_config)
 
-            elapsed_time = time.perf_counter() - start_time
-            reply = response.text.strip()
+            elapsed_time = llm_span.duration
 
             logger.info(
                 f"[LLM] Generate response | intent={intent} | time={elapsed_time:.3f}s"
@@ -292,88 +347,354 @@ class GeminiService:
             # ===== 3. Guard: đảm bảo tiếng Việt =====
             vietnamese_chars = "ăâđêôơưáàảãạéèẻẽẹíìỉĩịóòỏõọúùủũụýỳỷỹỵ"
             if not any(c in reply.lower() for c in vietnamese_chars):
-                reply = (
-                    "Dạ bạn chờ shop một chút nhé, "
-                    "mình sẽ hỗ trợ bạn ngay ạ 😊"
-                )
+                return self.WAIT_REPLY
 
+            self._memo_store(memo_key, reply)
             return reply
 
         except Exception as e:
             logger.error(f"Lỗi khi tạo phản hồi: {str(e)}")
-            return (
-                "Xin lỗi, hệ thống đang gặp sự cố. "
-                "Bạn vui lòng liên hệ số 0985006914 để được hỗ trợ nhanh hơn nhé ạ."
-            )
+            return self.ERROR_REPLY
 
-    def generate_chat_response(
+    def _memo_lookup(self, call_site: str, prompt: str, generation_config: Dict) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Tra memo cho lời gọi temperature 0 (model + call site + prompt + generation config)
+        
+        Returns:
+            Tuple: (memo_key, text); text khác None là hit, memo_key None = không cần lưu
+        """
+        memo = get_gemini_memo()
+        if memo is None or generation_config.get("temperature") != 0:
+            return None, None
+        key = memo.make_key(self.model_name, call_site, prompt, json.dumps(generation_config, sort_keys=True))
+        found, text = memo.get(key)
+        record_cache(f'gemini_memo.{call_site}', hit=found)
+        if found:
+            return None, text
+        return key, None
+    
+    def _generate_text(
         self,
+        call_site: str,
+        prompt: str,
+        generation_config: Dict,
+        stage_budget: Optional[float] = None
+    ) -> str:
+        """
+        Gọi Gemini; lời gọi temperature 0 giống hệt nhau đang chạy đồng thời dùng chung một request
+        (lời gọi có sampling thì mỗi caller một request, không dùng chung một mẫu)
+        """
+        def call() -> str:
+            return self._scheduled_call(
+                self.model,
+                prompt,
+                generation_config,
+                stage=call_site,
+                stage_budget=stage_budget
+            ).text.strip()
+        
+        if generation_config.get("temperature") != 0:
+            return call()
+        key = MemoCache.make_key(self.model_name, call_site, prompt, json.dumps(generation_config, sort_keys=True))
+        return _inflight.do(key, call)
+    
+    def _scheduled_call(
+        self,
+        model,
+        prompt: str,
+        generation_config: Dict,
+        priority: int = PRIORITY_INTERACTIVE,
+        prompt_tokens: Optional[int] = None,
+        stage: str = 'llm',
+        stage_budget: Optional[float] = None
+    ):
+        """
+        Gọi model.generate_content qua GeminiScheduler (quota RPM / TPM, ưu tiên, thử lại khi 429 / 503)
+        
+        Args:
+            model: GenerativeModel (self.model hoặc model dùng cached content)
+            prompt: Nội dung gửi đi
+            generation_config: Generation config
+            priority: PRIORITY_INTERACTIVE (chat) hoặc PRIORITY_BACKGROUND (tác vụ phụ có fallback)
+            prompt_tokens: Số token của prompt nếu khác `prompt` (ví dụ tính cả phần cached content)
+            stage: Tên bước (label metric khi quá hạn)
+            stage_budget: Ngân sách thời gian của bước; None = STAGE_TIMEOUT_LLM_SECONDS
+        
+        Raises:
+            DeadlineExceeded: Vượt ngân sách của bước / deadline của request
+            CircuitOpenError: Gemini đang bị ngắt do lỗi liên tục
+        """
+        scheduler = get_gemini_scheduler()
+        estimated = (
+            (estimate_tokens(prompt) if prompt_tokens is None else prompt_tokens)
+            + Config.GEMINI_OUTPUT_TOKENS_ESTIMATE
+        )
+        queue_timeout = (
+            Config.GEMINI_BACKGROUND_TIMEOUT_SECONDS if priority == PRIORITY_BACKGROUND
+            else Config.GEMINI_QUEUE_TIMEOUT_SECONDS
+        )
+        # Chờ lượt + thử lại + lời gọi đều nằm trong ngân sách của bước (đã kẹp theo deadline của request)
+        now = time.monotonic()
+        stage_deadline = now + stage_timeout(
+            Config.STAGE_TIMEOUT_LLM_SECONDS if stage_budget is None else stage_budget,
+            stage
+        )
+        # Circuit breaker 'gemini' bọc cả lượt chờ + thử lại: Gemini đang lỗi thì raise CircuitOpenError
+        # ngay, không xếp hàng (hết quota phía mình - GeminiThrottledError - không tính là lỗi của Gemini)
+        response = get_circuit_breaker('gemini', ignore=(GeminiThrottledError,)).call(
+            lambda: scheduler.call(
+                # google-generativeai 0.3.x không nhận timeout: bỏ chờ lời gọi khi quá hạn
+                lambda: run_with_timeout(
+                    lambda: model.generate_content(
+                        prompt,
+                        generation_config=generation_config
+                    ),
+                    max(0.0, stage_deadline - time.monotonic()),
+                    stage
+                ),
+                tokens=estimated,
+                priority=priority,
+                deadline=min(now + queue_timeout, stage_deadline)
+            )
+        )
+        # Trả lại / tính thêm phần chênh lệch khi response có số token thực tế
+        usage = getattr(response, 'usage_metadata', None)
+        total_tokens = getattr(usage, 'total_token_count', None) if usage is not None else None
+        if isinstance(total_tokens, int) and total_tokens > 0:
+            scheduler.adjust_tokens(total_tokens - estimated)
+        return response
+    
+    @staticmethod
+    def _memo_store(memo_key: Optional[str], text: str):
+        """Lưu kết quả hợp lệ vào memo (không lưu câu trả lời lỗi / thay thế)"""
+        memo = get_gemini_memo()
+        if memo_key is not None and memo is not None:
+            memo.put(memo_key, text)
+    
+    @staticmethod
+    def build_chat_prefix(instruction: str = "", product_context: str = "") -> str:
+        """
+        Phần prompt tĩnh của generate_chat_response: giống nhau cho mọi cuộc trò chuyện của một business
+        (dùng làm cached content phía Gemini)
+        
+        Args:
+            instruction: Instruction/prompt tùy chỉnh cho chatbot
+            product_context: Context về sản phẩm
+        
+        Returns:
+            str: Prefix ("" nếu không có instruction lẫn context)
+        """
+        prompt_parts = []
+        
+        if instruction:
+            prompt_parts.append(f"INSTRUCTION (Hướng dẫn cho chatbot):\n{instruction}\n")
+        
+        if product_context:
+            prompt_parts.append(f"CONTEXT SẢN PHẨM:\n{product_context}\n")
+        
+        return "\n".join(prompt_parts)
+    
+    @staticmethod
+    def build_chat_suffix(message: str, conversations: List[Dict], summary: str = "") -> str:
+        """
+        Phần prompt thay đổi theo từng tin nhắn: tóm tắt hội thoại cũ, lịch sử chat + tin nhắn hiện tại
+        
+        Args:
+            message: Tin nhắn hiện tại của người dùng
+            conversations: Các tin nhắn gần nhất đã chọn theo ngân sách token (giữ nguyên văn)
+            summary: Tóm tắt các tin nhắn cũ hơn ("" nếu không có)
+            
+        Returns:
+            str: Suffix
+        """
+        # Xây dựng lịch sử chat
+        conversation_history = ""
+        if conversations:
+            conversation_history = "\n".join([format_message(msg) for msg in conversations])
+        else:
+            conversation_history = "Đây là tin nhắn đầu tiên trong cuộc trò chuyện."
+        
+        prompt_parts = []
+        if summary:
+            prompt_parts.append(f"TÓM TẮT HỘI THOẠI TRƯỚC ĐÓ:\n{summary}\n")
+        prompt_parts.append(f"LỊCH SỬ TRÒ CHUYỆN (các tin nhắn gần nhất):\n{conversation_history}\n")
+        prompt_parts.append(f"TIN NHẮN HIỆN TẠI CỦA NGƯỜI DÙNG: {message}\n")
+        prompt_parts.append(
+            "Hãy trả lời một cách tự nhiên, thân thiện và hữu ích dựa trên instruction, context sản phẩm và lịch sử trò chuyện."
+        )
+        return "\n".join(prompt_parts)
+    
+    @staticmethod
+    def build_chat_prompt(
         message: str,
         conversations: List[Dict],
         instruction: str = "",
         product_context: str = ""
     ) -> str:
         """
-        Tạo phản hồi chat với instruction tùy chỉnh, product context và lịch sử chat
+        Xây dựng prompt đầy đủ cho generate_chat_response (không gọi LLM, dùng được trong benchmark)
         
         Args:
             message: Tin nhắn hiện tại của người dùng
-            conversations: Danh sách các tin nhắn trước đó (tối đa 20 tin nhắn gần nhất)
+            conversations: Toàn bộ lịch sử chat (được cắt theo HISTORY_TOKEN_BUDGET_CHAT, phần cũ tóm tắt bằng rule)
             instruction: Instruction/prompt tùy chỉnh cho chatbot
             product_context: Context về sản phẩm
             
         Returns:
-            str: Phản hồi từ bot
+            str: Prompt hoàn chỉnh (= prefix + suffix)
         """
-        try:
-            # Lấy 20 tin nhắn gần nhất
-            recent_conversations = conversations[-20:] if len(conversations) > 20 else conversations
-            
-            # Xây dựng lịch sử chat
-            conversation_history = ""
-            if recent_conversations:
-                conversation_history = "\n".join([
-                    f"{msg.get('role', 'user')}: {msg.get('content', '')}"
-                    for msg in recent_conversations
-                ])
-            else:
-                conversation_history = "Đây là tin nhắn đầu tiên trong cuộc trò chuyện."
-            
-            # Xây dựng prompt
-            prompt_parts = []
-            
-            if instruction:
-                prompt_parts.append(f"INSTRUCTION (Hướng dẫn cho chatbot):\n{instruction}\n")
-            
-            if product_context:
-                prompt_parts.append(f"CONTEXT SẢN PHẨM:\n{product_context}\n")
-            
-            prompt_parts.append(f"LỊCH SỬ TRÒ CHUYỆN (20 tin nhắn gần nhất):\n{conversation_history}\n")
-            prompt_parts.append(f"TIN NHẮN HIỆN TẠI CỦA NGƯỜI DÙNG: {message}\n")
-            prompt_parts.append("Hãy trả lời một cách tự nhiên, thân thiện và hữu ích dựa trên instruction, context sản phẩm và lịch sử trò chuyện.")
-            
-            prompt = "\n".join(prompt_parts)
+        history = get_history_manager().compact(conversations, Config.HISTORY_TOKEN_BUDGET_CHAT)
+        prefix = GeminiService.build_chat_prefix(instruction, product_context)
+        suffix = GeminiService.build_chat_suffix(message, history['recent'], history['summary'])
+        return f"{prefix}\n{suffix}" if prefix else suffix
+    
+    def _history_summarizer(self):
+        """Summarizer cho HistoryManager: Gemini khi HISTORY_SUMMARY_MODE=llm, None = tóm tắt bằng rule"""
+        return self.summarize_history if Config.HISTORY_SUMMARY_MODE == 'llm' else None
+    
+    @observe_call('summarize_history')
+    def summarize_history(self, previous_summary: str, messages: List[Dict]) -> str:
+        """
+        Gộp các tin nhắn vừa rơi khỏi ngân sách vào bản tóm tắt cuộn
+        
+        Args:
+            previous_summary: Tóm tắt trước đó ("" nếu chưa có)
+            messages: Tin nhắn cần gộp (cũ -> mới)
             
-            # Đo thời gian gọi LLM
-            start_time = time.perf_counter()
-            response = self.model.generate_content(
+        Returns:
+            str: Tóm tắt mới (lỗi sẽ được HistoryManager chuyển sang tóm tắt bằng rule)
+        """
+        conversation_text = "\n".join(format_message(msg) for msg in messages)
+        prompt = (
+            "Cập nhật bản tóm tắt cuộc trò chuyện bán hàng dưới đây bằng tiếng Việt, dạng gạch đầu dòng, "
+            f"tối đa {Config.HISTORY_SUMMARY_MAX_TOKENS * 3} ký tự. "
+            "BẮT BUỘC giữ nguyên: sản phẩm / mã sản phẩm, size, màu, số lượng, giá, tên, địa chỉ, số điện thoại, "
+            "yêu cầu đặt hàng và các câu hỏi khách chưa được trả lời.\n\n"
+            f"TÓM TẮT HIỆN TẠI:\n{previous_summary or '(chưa có)'}\n\n"
+            f"TIN NHẮN MỚI:\n{conversation_text}\n\n"
+            "Chỉ trả về bản tóm tắt mới."
+        )
+        with span('gemini.summarize_history', prompt_chars=len(prompt)):
+            # Ưu tiên thấp: hết lượt thì HistoryManager chuyển sang tóm tắt bằng rule
+            response = self._scheduled_call(
+                self.model,
                 prompt,
-                generation_config={
-                    "temperature": 0.7
-                }
+                {
+                    "temperature": 0
+                },
+                priority=PRIORITY_BACKGROUND,
+                stage='summarize_history'
             )
-            elapsed_time = time.perf_counter() - start_time
-            
-            reply = response.text.strip()
+        return response.text.strip()
+    
+    @observe_call('generate_chat_response')
+    def generate_chat_response(
+        self,
+        message: str,
+        conversations: List[Dict],
+        instruction: str = "",
+        product_context: str = "",
+        context_key: Optional[int] = None,
+        history_key: Optional[tuple] = None
+    ) -> str:
+        """
+        Tạo phản hồi chat với instruction tùy chỉnh, product context và lịch sử chat
+        
+        Args:
+            message: Tin nhắn hiện tại của người dùng
+            conversations: Danh sách các tin nhắn trước đó (cắt theo HISTORY_TOKEN_BUDGET_CHAT, phần cũ được tóm tắt)
+            instruction: Instruction/prompt tùy chỉnh cho chatbot
+            product_context: Context về sản phẩm
+            context_key: Khóa cached content (business_id); None = luôn gửi prompt đầy đủ
+            history_key: Khóa tóm tắt cuộn (business_id, customer_id); None = tóm tắt không cache
             
-            logger.info(
-                f"[LLM] Generate chat response - Thời gian xử lý: {elapsed_time:.3f}s"
-            )
+        Returns:
+            str: Phản hồi từ bot
+        """
+        try:
+            with span('prompt.build', kind='chat_response'):
+                history = get_history_manager().compact(
+                    conversations,
+                    Config.HISTORY_TOKEN_BUDGET_CHAT,
+                    key=history_key,
+                    summarizer=self._history_summarizer()
+                )
+                prefix = self.build_chat_prefix(instruction, product_context)
+                suffix = self.build_chat_suffix(message, history['recent'], history['summary'])
             
-            return reply
+            # Sampling (temperature 0.7): không gộp lời gọi đồng thời, mỗi khách nhận câu trả lời riêng
+            return self._call_chat_model(prefix, suffix, context_key)
             
         except Exception as e:
             logger.error(f"Lỗi khi tạo phản hồi chat: {str(e)}")
-            return "Xin lỗi, tôi gặp sự cố kỹ thuật. Vui lòng thử lại sau."
+            return self.CHAT_ERROR_REPLY
+    
+    def _call_chat_model(self, prefix: str, suffix: str, context_key: Optional[int]) -> str:
+        """Gọi Gemini cho chat: dùng cached content (prefix) nếu có, lỗi thì gửi prompt đầy đủ"""
+        # Instruction + context sản phẩm nằm trong cached content phía Gemini nếu có
+        context_cache = get_context_cache_service()
+        cached_model = context_cache.get_model(self.model_name, context_key, prefix) if prefix else None
+        
+        response = None
+        elapsed_time = 0.0
+        if cached_model is not None:
+            try:
+                with span('gemini.generate_chat_response', prompt_chars=len(suffix), cached_context=True) as llm_span:
+                    response = self._scheduled_call(
+                        cached_model,
+                        suffix,
+                        {
+                            "temperature": 0.7
+                        },
+                        prompt_tokens=estimate_tokens(prefix) + estimate_tokens(suffix)
+                    )
+                elapsed_time = llm_span.duration
+            except (GeminiThrottledError, DeadlineExceeded, CircuitOpenError):
+                # Hết lượt theo quota / hết thời gian / Gemini đang bị ngắt: gửi prompt đầy đủ cũng không được
+                raise
+            except Exception as e:
+                # Cached content có thể đã bị xóa / hết hạn phía Gemini: bỏ và gửi prompt đầy đủ
+                logger.warning(f"[LLM] Gọi với cached context lỗi, gửi prompt đầy đủ: {str(e)}")
+                context_cache.invalidate(context_key)
+        
+        if response is None:
+            prompt = f"{prefix}\n{suffix}" if prefix else suffix
+            # Đo thời gian gọi LLM
+            with span('gemini.generate_chat_response', prompt_chars=len(prompt)) as llm_span:
+                response = self._scheduled_call(
+                    self.model,
+                    prompt,
+                    {
+                        "temperature": 0.7
+                    }
+                )
+            elapsed_time = llm_span.duration
+        
+        reply = response.text.strip()
+        
+        logger.info(
+            f"[LLM] Generate chat response - Thời gian xử lý: {elapsed_time:.3f}s"
+        )
+        return reply
 
 
+# Lazy singleton: memo dùng chung cho mọi GeminiService trong process
+_gemini_memo_instance: Optional[MemoCache] = None
+_memo_init_lock = threading.Lock()
+
+
+def get_gemini_memo() -> Optional[MemoCache]:
+    """Lấy memo kết quả Gemini, None nếu tắt (GEMINI_MEMO_ENABLED=false)"""
+    global _gemini_memo_instance
+    if not Config.GEMINI_MEMO_ENABLED:
+        return None
+    if _gemini_memo_instance is None:
+        with _memo_init_lock:
+            if _gemini_memo_instance is None:
+                _gemini_memo_instance = MemoCache(
+                    max_entries=Config.GEMINI_MEMO_MAX_ENTRIES,
+                    ttl_seconds=Config.GEMINI_MEMO_TTL_SECONDS,
+                    disk_dir=Config.GEMINI_MEMO_DIR,
+                    disk_max_entries=Config.GEMINI_MEMO_DISK_MAX_ENTRIES
+                )
+    return _gemini_memo_instance
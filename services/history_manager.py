@@ -0,0 +1,237 @@
+"""
+Giới hạn lịch sử chat đưa vào prompt theo ngân sách token
+
+- Giữ nguyên văn các tin nhắn mới nhất cho tới khi hết ngân sách (luôn giữ ít nhất HISTORY_MIN_RECENT_MESSAGES)
+- Các tin nhắn cũ hơn được gộp vào bản tóm tắt cuộn (rolling summary) theo (business_id, customer_id):
+  lần sau chỉ tóm tắt phần tin nhắn mới rơi khỏi ngân sách, nên thông tin đặt hàng (mã sản phẩm, size,
+  số lượng, địa chỉ, số điện thoại) vẫn còn dù client chỉ gửi vài tin nhắn gần nhất
+- Mặc định tóm tắt bằng rule (trích các dòng có thông tin đặt hàng, không gọi LLM);
+  HISTORY_SUMMARY_MODE=llm dùng summarizer do GeminiService truyền vào
+"""
+import hashlib
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+from config import Config
+from utils.metrics import record_cache
+from utils.tokens import estimate_tokens
+from utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Số tin nhắn cuối của phần đã tóm tắt dùng làm dấu để tìm phần mới ở request sau
+_TAIL_MESSAGES = 3
+
+# Dòng có thông tin cần giữ khi tóm tắt: số điện thoại, mã sản phẩm, size, số lượng, giá, địa chỉ, đặt hàng
+_FACT_PATTERNS = [
+    re.compile(r'(?:\+?84|0)\d{9,10}\b'),
+    re.compile(r'\bSP\d+\b', re.IGNORECASE),
+    re.compile(r'\b(?:mã|id)\s*(?:sản phẩm|sp)?\s*[:#]?\s*\w*\d', re.IGNORECASE),
+    re.compile(r'\bsize\s*\w+', re.IGNORECASE),
+    re.compile(r'\b\d+\s*(?:cái|chiếc|đôi|bộ|sản phẩm|sp|món)\b', re.IGNORECASE),
+    re.compile(r'\b\d+(?:[.,]\d+)?\s*(?:k|đ|vnđ|vnd|tr|triệu|nghìn|ngàn)\b', re.IGNORECASE),
+    re.compile(r'\b(?:địa chỉ|giao (?:tới|đến|về)|ship (?:tới|đến|về)|quận|huyện|phường|xã|đường|tỉnh|tp\.?)\b', re.IGNORECASE),
+    re.compile(r'\b(?:đặt hàng|đặt mua|chốt đơn|lấy \d+|tên (?:mình|em|tôi|người nhận))\b', re.IGNORECASE),
+]
+
+
+def format_message(message: Dict) -> str:
+    """Một dòng lịch sử trong prompt"""
+    return f"{message.get('role', 'user')}: {message.get('content', '')}"
+
+
+def _fingerprint(messages: List[Dict]) -> str:
+    digest = hashlib.sha1()
+    for message in messages:
+        digest.update(format_message(message).encode('utf-8'))
+        digest.update(b'\x00')
+    return digest.hexdigest()
+
+
+def extractive_summary(previous_summary: str, messages: List[Dict], max_tokens: int) -> str:
+    """
+    Tóm tắt bằng rule: giữ các dòng chứa thông tin đặt hàng theo đúng thứ tự, bỏ trùng lặp
+    
+    Args:
+        previous_summary: Bản tóm tắt trước đó (mỗi dòng một ý)
+        messages: Tin nhắn mới cần gộp vào
+        max_tokens: Giới hạn độ dài; vượt quá thì bỏ các ý cũ nhất
+    """
+    facts = [line for line in previous_summary.splitlines() if line.strip()] if previous_summary else []
+    seen = set(facts)
+    for message in messages:
+        content = (message.get('content') or '').strip()
+        if not content or not any(pattern.search(content) for pattern in _FACT_PATTERNS):
+            continue
+        line = f"- {message.get('role', 'user')}: {content}"
+        if line not in seen:
+            seen.add(line)
+            facts.append(line)
+    
+    # Ưu tiên ý mới nhất (thông tin đặt hàng sau cùng thường là thông tin đúng)
+    kept: List[str] = []
+    total = 0
+    for line in reversed(facts):
+        tokens = estimate_tokens(line) + 1
+        if kept and total + tokens > max_tokens:
+            break
+        kept.append(line)
+        total += tokens
+    return "\n".join(reversed(kept))
+
+
+class HistoryManager:
+    """Chọn tin nhắn gần nhất theo ngân sách token + tóm tắt cuộn phần cũ theo từng khách hàng"""
+    
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        ttl_seconds: Optional[int] = None,
+        summary_max_tokens: Optional[int] = None,
+        min_recent_messages: Optional[int] = None
+    ):
+        self._max_entries = Config.HISTORY_SUMMARY_CACHE_SIZE if max_entries is None else max_entries
+        self._ttl = Config.HISTORY_SUMMARY_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self.summary_max_tokens = Config.HISTORY_SUMMARY_MAX_TOKENS if summary_max_tokens is None else summary_max_tokens
+        self.min_recent_messages = (
+            Config.HISTORY_MIN_RECENT_MESSAGES if min_recent_messages is None else min_recent_messages
+        )
+        # key -> {'summary', 'tail_fp', 'tail_len', 'expire_at'}
+        self._summaries: OrderedDict[Any, Dict[str, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def select_recent(self, conversations: List[Dict], budget_tokens: int) -> int:
+        """
+        Vị trí bắt đầu của phần tin nhắn giữ nguyên văn
+        
+        Returns:
+            int: conversations[start:] vừa ngân sách (ít nhất min_recent_messages tin nhắn)
+        """
+        start = len(conversations)
+        used = 0
+        while start > 0:
+            tokens = estimate_tokens(format_message(conversations[start - 1])) + 1
+            if used + tokens > budget_tokens and len(conversations) - start >= self.min_recent_messages:
+                break
+            used += tokens
+            start -= 1
+        return start
+    
+    def compact(
+        self,
+        conversations: List[Dict],
+        budget_tokens: int,
+        key: Any = None,
+        summarize: bool = True,
+        summarizer: Optional[Callable[[str, List[Dict]], str]] = None
+    ) -> Dict[str, Any]:
+        """
+        Rút gọn lịch sử chat cho prompt
+        
+        Args:
+            conversations: Lịch sử chat (cũ -> mới)
+            budget_tokens: Ngân sách token cho phần tin nhắn giữ nguyên văn
+            key: Khóa tóm tắt cuộn, thường là (business_id, customer_id); None = tóm tắt không cache
+            summarize: False = chỉ cắt theo ngân sách, bỏ phần cũ (ví dụ prompt phân loại intent)
+            summarizer: Hàm (previous_summary, messages) -> summary; None = tóm tắt bằng rule
+        
+        Returns:
+            Dict: {'recent': List[Dict], 'summary': str, 'dropped': int}
+        """
+        with span('history.compact', messages=len(conversations)) as compact_span:
+            start = self.select_recent(conversations, budget_tokens)
+            recent = conversations[start:]
+            older = conversations[:start]
+            summary = ""
+            if older and summarize:
+                summary = self._rolling_summary(key, older, summarizer)
+            compact_span.set_attribute('recent', len(recent))
+            return {'recent': recent, 'summary': summary, 'dropped': len(older)}
+    
+    def invalidate(self, key: Any = None):
+        """Xóa tóm tắt của key (None: tất cả)"""
+        with self._lock:
+            if key is None:
+                self._summaries.clear()
+            else:
+                self._summaries.pop(key, None)
+    
+    def _rolling_summary(
+        self,
+        key: Any,
+        older: List[Dict],
+        summarizer: Optional[Callable[[str, List[Dict]], str]]
+    ) -> str:
+        state = self._get_state(key) if key is not None else None
+        previous_summary = ""
+        delta = older
+        if state is not None:
+            previous_summary = state['summary']
+            position = self._find_tail(older, state['tail_fp'], state['tail_len'])
+            # Không thấy phần đã tóm tắt: client đã trượt cửa sổ qua nó, toàn bộ phần cũ là tin nhắn mới
+            delta = older[position + 1:] if position is not None else older
+        
+        record_cache('history_summary', hit=not delta)
+        if not delta:
+            return previous_summary
+        
+        try:
+            if summarizer is not None:
+                summary = summarizer(previous_summary, delta)
+            else:
+                summary = extractive_summary(previous_summary, delta, self.summary_max_tokens)
+        except Exception as e:
+            logger.warning(f"[History] Tóm tắt lỗi, dùng tóm tắt bằng rule: {str(e)}")
+            summary = extractive_summary(previous_summary, delta, self.summary_max_tokens)
+        
+        if key is not None:
+            tail = older[-_TAIL_MESSAGES:]
+            self._set_state(key, {
+                'summary': summary,
+                'tail_fp': _fingerprint(tail),
+                'tail_len': len(tail),
+                'expire_at': time.time() + self._ttl
+            })
+        return summary
+    
+    @staticmethod
+    def _find_tail(messages: List[Dict], tail_fp: str, tail_len: int) -> Optional[int]:
+        """Vị trí tin nhắn cuối cùng đã được tóm tắt trong `messages` (tìm từ cuối lên)"""
+        for end in range(len(messages), tail_len - 1, -1):
+            if _fingerprint(messages[end - tail_len:end]) == tail_fp:
+                return end - 1
+        return None
+    
+    def _get_state(self, key: Any) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            state = self._summaries.get(key)
+            if state is None:
+                return None
+            if time.time() >= state['expire_at']:
+                self._summaries.pop(key, None)
+                return None
+            self._summaries.move_to_end(key)
+            return state
+    
+    def _set_state(self, key: Any, state: Dict[str, Any]):
+        with self._lock:
+            self._summaries[key] = state
+            self._summaries.move_to_end(key)
+            while len(self._summaries) > self._max_entries:
+                self._summaries.popitem(last=False)
+
+
+# Singleton instance
+_history_manager_instance: Optional[HistoryManager] = None
+
+
+def get_history_manager() -> HistoryManager:
+    """Lấy singleton HistoryManager"""
+    global _history_manager_instance
+    if _history_manager_instance is None:
+        _history_manager_instance = HistoryManager()
+    return _history_manager_instance
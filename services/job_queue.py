@@ -0,0 +1,194 @@
+"""
+Job queue chạy nền trong process (không cần Redis/Celery)
+Dùng cho các tác vụ dài như batch-upsert, reindex: API trả job_id ngay, client hỏi tiến độ qua /jobs/{id}
+"""
+import threading
+import time
+import uuid
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueueFullError(Exception):
+    """Hàng đợi đã đầy, không nhận thêm job"""
+    pass
+
+
+class Job:
+    """Trạng thái và tiến độ của một job"""
+    
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    
+    # Giới hạn số lỗi chi tiết giữ lại mỗi job (tránh job lớn chiếm nhiều RAM)
+    MAX_ERRORS = 1000
+    
+    def __init__(self, job_type: str, total: Optional[int] = None):
+        """
+        Args:
+            job_type: Loại job (ví dụ 'batch_upsert', 'reindex')
+            total: Tổng số item cần xử lý (None nếu chưa biết trước)
+        """
+        self.id = uuid.uuid4().hex
+        self.job_type = job_type
+        self.status = Job.PENDING
+        self.total = total
+        self.success_count = 0
+        self.error_count = 0
+        self.errors: List[Dict[str, Any]] = []
+        self.result: Optional[Dict[str, Any]] = None
+        self.message: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._lock = threading.Lock()
+    
+    @property
+    def processed(self) -> int:
+        return self.success_count + self.error_count
+    
+    def set_total(self, total: int):
+        """Cập nhật tổng số item (khi job tự đếm sau khi bắt đầu)"""
+        with self._lock:
+            self.total = total
+    
+    def record_success(self, count: int = 1):
+        """Ghi nhận `count` item xử lý thành công"""
+        with self._lock:
+            self.success_count += count
+    
+    def record_error(self, item_id: Any, error: str):
+        """Ghi nhận một item lỗi"""
+        with self._lock:
+            self.error_count += 1
+            if len(self.errors) < Job.MAX_ERRORS:
+                self.errors.append({'product_id': item_id, 'error': error})
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Chuyển trạng thái job thành dictionary (progress, throughput, errors)"""
+        with self._lock:
+            end = self.finished_at or time.time()
+            elapsed = end - self.started_at if self.started_at else 0.0
+            processed = self.processed
+            return {
+                'job_id': self.id,
+                'job_type': self.job_type,
+                'status': self.status,
+                'total': self.total,
+                'processed': processed,
+                'success_count': self.success_count,
+                'error_count': self.error_count,
+                'progress': round(processed / self.total, 4) if self.total else None,
+                'elapsed_seconds': round(elapsed, 3),
+                'throughput_per_second': round(processed / elapsed, 3) if elapsed > 0 else None,
+                'message': self.message,
+                'result': self.result,
+                'errors': list(self.errors)
+            }
+
+
+class JobQueue:
+    """
+    Hàng đợi job in-process với worker pool giới hạn số job chạy đồng thời
+    Job chỉ lưu trong RAM: restart process thì mất trạng thái các job
+    """
+    
+    def __init__(self, max_workers: int = 2, max_pending: int = 100, max_retained: int = 200):
+        """
+        Args:
+            max_workers: Số job chạy đồng thời tối đa
+            max_pending: Số job chờ + đang chạy tối đa, vượt quá sẽ từ chối
+            max_retained: Số job (kể cả đã xong) giữ lại để tra cứu
+        """
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job-worker')
+        self._jobs: 'OrderedDict[str, Job]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._max_pending = max_pending
+        self._max_retained = max_retained
+    
+    def submit(self, job_type: str, task: Callable[[Job], Optional[Dict[str, Any]]], total: Optional[int] = None) -> Job:
+        """
+        Đưa task vào hàng đợi
+        
+        Args:
+            job_type: Loại job
+            task: Hàm nhận Job, tự cập nhật tiến độ; giá trị trả về lưu vào job.result
+            total: Tổng số item (optional)
+        
+        Returns:
+            Job: Job vừa tạo (status pending)
+        
+        Raises:
+            JobQueueFullError: Nếu số job chưa xong đã đạt giới hạn
+        """
+        job = Job(job_type, total=total)
+        with self._lock:
+            active = sum(1 for j in self._jobs.values() if j.status in (Job.PENDING, Job.RUNNING))
+            if active >= self._max_pending:
+                raise JobQueueFullError(f"Hàng đợi đã có {active} job chưa xong, vui lòng thử lại sau")
+            self._jobs[job.id] = job
+            self._evict_finished()
+        
+        self._executor.submit(self._run, job, task)
+        logger.info(f"[Job] Đã tạo job {job.id} ({job_type}, total={total})")
+        return job
+    
+    def get(self, job_id: str) -> Optional[Job]:
+        """Lấy job theo ID"""
+        with self._lock:
+            return self._jobs.get(job_id)
+    
+    def _run(self, job: Job, task: Callable[[Job], Optional[Dict[str, Any]]]):
+        job.status = Job.RUNNING
+        job.started_at = time.time()
+        try:
+            job.result = task(job)
+            job.status = Job.SUCCEEDED
+        except Exception as e:
+            logger.error(f"[Job] Job {job.id} ({job.job_type}) lỗi: {str(e)}")
+            job.message = str(e)
+            job.status = Job.FAILED
+        finally:
+            job.finished_at = time.time()
+            info = job.to_dict()
+            logger.info(
+                f"[Job] Job {job.id} ({job.job_type}) {job.status} - "
+                f"{info['processed']}/{info['total']} item, {info['error_count']} lỗi - "
+                f"Thời gian: {info['elapsed_seconds']:.3f}s"
+            )
+    
+    def _evict_finished(self):
+        """Xóa các job đã xong cũ nhất khi vượt max_retained (gọi khi đang giữ lock)"""
+        if len(self._jobs) <= self._max_retained:
+            return
+        for job_id in list(self._jobs.keys()):
+            if len(self._jobs) <= self._max_retained:
+                break
+            if self._jobs[job_id].status in (Job.SUCCEEDED, Job.FAILED):
+                del self._jobs[job_id]
+
+
+# Lazy singleton: dùng chung 1 job queue cho cả app
+_job_queue_instance: Optional[JobQueue] = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """Lấy instance JobQueue (lazy init, singleton)."""
+    global _job_queue_instance
+    if _job_queue_instance is None:
+        with _job_queue_lock:
+            if _job_queue_instance is None:
+                _job_queue_instance = JobQueue(
+                    max_workers=Config.VECTOR_JOB_WORKERS,
+                    max_pending=Config.VECTOR_JOB_MAX_PENDING
+                )
+    return _job_queue_instance
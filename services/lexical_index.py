@@ -0,0 +1,273 @@
+"""
+Index từ khóa (BM25) theo business cho hybrid search
+
+- Tách từ tiếng Việt đơn giản theo \\w+; mỗi từ được index cả dạng có dấu và dạng bỏ dấu
+  (khách gõ "ao thun" vẫn khớp "Áo thun", gõ "áo" thì chỉ khớp đúng "áo")
+- Mã sản phẩm, size, tên thương hiệu (ví dụ "SP001", "XL", "Nike") khớp chính xác,
+  bổ sung cho vector search vốn yếu với các từ này
+- Văn bản index lấy từ create_text_for_embedding giống text dùng để tạo embedding
+"""
+import json
+import logging
+import math
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from config import Config
+from models.product import Product
+from utils.product_helper import create_text_for_embedding
+from utils.search_filter_parser import matches_filter
+from utils.tracing import span
+from utils.metrics import record_cache
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+
+def fold_diacritics(text: str) -> str:
+    """Bỏ dấu tiếng Việt ('Áo thun đỏ' -> 'Ao thun do')"""
+    decomposed = unicodedata.normalize('NFD', text)
+    stripped = ''.join(ch for ch in decomposed if unicodedata.category(ch) != 'Mn')
+    return stripped.replace('đ', 'd').replace('Đ', 'D')
+
+
+def tokenize(text: str) -> List[str]:
+    """Tách từ (chữ thường, chuẩn hóa NFC)"""
+    if not text:
+        return []
+    return _TOKEN_PATTERN.findall(unicodedata.normalize('NFC', text).lower())
+
+
+class BM25Index:
+    """
+    Inverted index BM25 trong RAM với 2 trường: từ có dấu (exact) và từ bỏ dấu (folded)
+    
+    Từ trong query có dấu được tra ở trường exact, từ không dấu được tra ở trường folded
+    """
+    
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_ids: List[int] = []
+        self.docs: List[Dict[str, Any]] = []
+        # term -> list (doc_index, term_frequency)
+        self._postings: Dict[str, Dict[str, List[Tuple[int, int]]]] = {'exact': {}, 'folded': {}}
+        self._doc_lengths: List[int] = []
+        self._avg_length = 0.0
+        self.categories: List[str] = []
+    
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+    
+    def add(self, doc_id: int, text: str, payload: Optional[Dict[str, Any]] = None):
+        """
+        Thêm một document (gọi finalize() sau khi thêm xong)
+        
+        Args:
+            doc_id: ID sản phẩm
+            text: Văn bản cần index
+            payload: Dữ liệu trả kèm kết quả (name, price, status, ...)
+        """
+        doc_index = len(self.doc_ids)
+        tokens = tokenize(text)
+        self.doc_ids.append(doc_id)
+        self.docs.append(payload or {})
+        self._doc_lengths.append(len(tokens))
+        
+        exact_counts = Counter(tokens)
+        folded_counts = Counter(fold_diacritics(token) for token in tokens)
+        for term, tf in exact_counts.items():
+            self._postings['exact'].setdefault(term, []).append((doc_index, tf))
+        for term, tf in folded_counts.items():
+            self._postings['folded'].setdefault(term, []).append((doc_index, tf))
+    
+    def finalize(self, category_field: Optional[str] = None):
+        """
+        Tính độ dài trung bình document (gọi sau khi add xong)
+        
+        Args:
+            category_field: Trường payload chứa danh mục, để lấy danh sách danh mục (optional)
+        """
+        self._avg_length = (sum(self._doc_lengths) / len(self._doc_lengths)) if self._doc_lengths else 0.0
+        if category_field:
+            self.categories = sorted({
+                str(doc[category_field]) for doc in self.docs if doc.get(category_field)
+            })
+    
+    def search(
+        self,
+        query: str,
+        top_k: int = 10,
+        metadata_filter: Optional[Dict[str, Any]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Tìm document theo BM25
+        
+        Args:
+            query: Câu tìm kiếm
+            top_k: Số kết quả tối đa
+            metadata_filter: Filter trên payload, cùng format filter Pinecone (ví dụ {'status': '1', 'price': {'$lte': 300000}})
+        
+        Returns:
+            List[Dict]: [{'product_id', 'score', 'metadata'}] sắp xếp theo score giảm dần
+        """
+        if not self.doc_ids:
+            return []
+        
+        n_docs = len(self.doc_ids)
+        scores: Dict[int, float] = {}
+        for token in set(tokenize(query)):
+            folded = fold_diacritics(token)
+            field, term = ('folded', folded) if folded == token else ('exact', token)
+            postings = self._postings[field].get(term)
+            if not postings:
+                continue
+            
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_index, tf in postings:
+                length_norm = 1 - self.b + self.b * self._doc_lengths[doc_index] / (self._avg_length or 1)
+                scores[doc_index] = scores.get(doc_index, 0.0) + idf * tf * (self.k1 + 1) / (tf + self.k1 * length_norm)
+        
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        results = []
+        for doc_index, score in ranked:
+            payload = self.docs[doc_index]
+            if metadata_filter and not matches_filter(payload, metadata_filter):
+                continue
+            results.append({'product_id': self.doc_ids[doc_index], 'score': score, 'metadata': payload})
+            if len(results) >= top_k:
+                break
+        return results
+
+
+class LexicalIndexService:
+    """
+    Giữ BM25Index theo business_id trong RAM, build từ bảng Product khi cần
+    Index hết hạn sau LEXICAL_INDEX_TTL_SECONDS hoặc khi invalidate (sau khi sync sản phẩm)
+    """
+    
+    def __init__(self, ttl_seconds: Optional[int] = None):
+        self._ttl = Config.LEXICAL_INDEX_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self._indexes: Dict[int, Tuple[BM25Index, float]] = {}  # business_id -> (index, expiry_at)
+        self._lock = threading.Lock()
+        self._build_locks: Dict[int, threading.Lock] = {}
+    
+    def get_index(self, db: Session, business_id: int) -> BM25Index:
+        """Lấy index của business (build từ DB nếu chưa có hoặc đã hết hạn)"""
+        cached = self._indexes.get(business_id)
+        if cached is not None and time.time() < cached[1]:
+            record_cache('lexical_index', hit=True)
+            return cached[0]
+        
+        record_cache('lexical_index', hit=False)
+        with self._lock:
+            build_lock = self._build_locks.setdefault(business_id, threading.Lock())
+        # Chỉ một request build index cho mỗi business, các request khác chờ và dùng lại
+        with build_lock:
+            cached = self._indexes.get(business_id)
+            if cached is not None and time.time() < cached[1]:
+                return cached[0]
+            with span('lexical.build_index', business_id=business_id):
+                index = self._build_index(db, business_id)
+            self._indexes[business_id] = (index, time.time() + self._ttl)
+            return index
+    
+    def search(
+        self,
+        db: Session,
+        business_id: int,
+        query: str,
+        top_k: int = 10,
+        metadata_filter: Optional[Dict[str, Any]] = None
+    ) -> List[Dict[str, Any]]:
+        """Tìm sản phẩm theo từ khóa trong business"""
+        return self.get_index(db, business_id).search(query, top_k=top_k, metadata_filter=metadata_filter)
+    
+    def get_categories(self, db: Session, business_id: int) -> List[str]:
+        """Các giá trị danh mục (trường SEARCH_CATEGORY_FIELD trong metadata sản phẩm) của business"""
+        return self.get_index(db, business_id).categories
+    
+    def invalidate(self, business_id: Optional[int] = None):
+        """Xóa index đã cache (business_id=None: xóa tất cả)"""
+        if business_id is None:
+            self._indexes.clear()
+        else:
+            self._indexes.pop(business_id, None)
+    
+    def _build_index(self, db: Session, business_id: int) -> BM25Index:
+        start_time = time.perf_counter()
+        index = BM25Index()
+        category_field = Config.SEARCH_CATEGORY_FIELD
+        rows = db.execute(
+            select(
+                Product.id, Product.name, Product.description, Product.meta_data,
+                Product.price, Product.status, Product.quantity_avail
+            ).where(Product.business_id == business_id)
+        )
+        for row in rows:
+            metadata = None
+            if row.meta_data:
+                try:
+                    metadata = json.loads(row.meta_data)
+                except ValueError:
+                    metadata = None
+            if not isinstance(metadata, dict):
+                metadata = None
+            
+            text = create_text_for_embedding(name=row.name, description=row.description, metadata=metadata)
+            payload = {
+                'product_id': row.id,
+                'name': row.name,
+                'price': float(row.price) if row.price is not None else 0,
+                'status': row.status,
+                'quantity_avail': row.quantity_avail
+            }
+            if category_field and metadata and metadata.get(category_field):
+                payload[category_field] = metadata[category_field]
+            index.add(row.id, text, payload=payload)
+        index.finalize(category_field=category_field)
+        
+        logger.info(
+            f"[Lexical] Build index business_id={business_id} - {len(index)} sản phẩm - "
+            f"Thời gian xử lý: {time.perf_counter() - start_time:.3f}s"
+        )
+        return index
+
+
+def reciprocal_rank_fusion(rankings: List[List[Any]], k: int = 60) -> List[Tuple[Any, float]]:
+    """
+    Gộp nhiều danh sách xếp hạng bằng Reciprocal Rank Fusion: score = sum 1 / (k + rank)
+    Không phụ thuộc thang điểm của từng nguồn (cosine vs BM25)
+    
+    Args:
+        rankings: Mỗi phần tử là list key đã sắp xếp theo độ liên quan giảm dần
+        k: Hằng số làm mượt (60 theo paper gốc)
+    
+    Returns:
+        List[(key, score)] sắp xếp theo score giảm dần
+    """
+    scores: Dict[Any, float] = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, 1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+# Lazy singleton
+_lexical_index_service_instance: Optional[LexicalIndexService] = None
+
+
+def get_lexical_index_service() -> LexicalIndexService:
+    """Lấy instance LexicalIndexService (lazy init, singleton)."""
+    global _lexical_index_service_instance
+    if _lexical_index_service_instance is None:
+        _lexical_index_service_instance = LexicalIndexService()
+    return _lexical_index_service_instance
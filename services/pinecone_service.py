@@ -1,14 +1,34 @@
 """
 Service để tương tác với Pinecone Vector Database
 """
-import time
+import hashlib
+import json
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from pinecone import Pinecone, ServerlessSpec
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 import logging
 from config import Config
+from utils.tracing import span
+from utils.metrics import observe_call
+from utils.single_flight import SingleFlight
+from utils.deadline import stage_timeout
+from utils.circuit_breaker import get_circuit_breaker
+from utils.vector_quantization import (
+    l2_normalize,
+    encode_vector,
+    rerank_matches,
+    strip_encoded_vector
+)
 
 logger = logging.getLogger(__name__)
 
+# Các query giống hệt nhau (vector, namespace, top_k, filter) đang chạy đồng thời dùng chung một request
+_inflight = SingleFlight('pinecone')
+
+# Pinecone không có update metadata theo batch: các request update chạy song song trên pool dùng chung
+_update_executor = ThreadPoolExecutor(max_workers=Config.PINECONE_UPDATE_WORKERS, thread_name_prefix='pinecone-update')
+
 
 class PineconeService:
     """Service quản lý kết nối và thao tác với Pinecone"""
@@ -20,6 +40,10 @@ class PineconeService:
         
         self.pc = Pinecone(api_key=Config.PINECONE_API_KEY)
         self.index_name = Config.PINECONE_INDEX_NAME
+        # Index có thể lưu vector giảm chiều (do Vertex AI tạo trực tiếp) thay vì vector đầy đủ
+        self.index_dimension = Config.VECTOR_INDEX_DIMENSION
+        self.rerank_precision = Config.VECTOR_RERANK_PRECISION
+        self.rerank_oversample = max(1, Config.VECTOR_RERANK_OVERSAMPLE)
         self._ensure_index_exists()
     
     def _ensure_index_exists(self):
@@ -52,16 +76,18 @@ class PineconeService:
         vector_id: str,
         vector: List[float],
         metadata: Dict[str, Any],
-        namespace: str
+        namespace: str,
+        index_vector: Optional[List[float]] = None
     ) -> bool:
         """
         Lưu hoặc cập nhật vector vào Pinecone
         
         Args:
             vector_id: ID duy nhất của vector (thường là product_id)
-            vector: List các giá trị float của vector embedding
+            vector: Vector embedding (np.ndarray float32 hoặc list float)
             metadata: Metadata kèm theo vector
             namespace: Namespace trong Pinecone
+            index_vector: Vector giảm chiều do Vertex AI tạo, bắt buộc khi index giảm chiều
         
         Returns:
             bool: True nếu thành công
@@ -70,13 +96,14 @@ class PineconeService:
             index = self.get_index()
             
             # Chuẩn bị metadata - Pinecone chỉ hỗ trợ một số kiểu dữ liệu
+            values, metadata = self._prepare_values(vector, metadata, index_vector)
             pinecone_metadata = self._prepare_metadata(metadata)
             
             # Upsert vector
             index.upsert(
                 vectors=[{
                     'id': str(vector_id),
-                    'values': vector,
+                    'values': values,
                     'metadata': pinecone_metadata
                 }],
                 namespace=namespace
@@ -88,21 +115,24 @@ class PineconeService:
             logger.error(f"Lỗi khi upsert vector: {str(e)}")
             raise
     
+    @observe_call('search_vectors')
     def search_vectors(
         self,
         query_vector: List[float],
         namespace: str,
         top_k: int = 10,
-        filter: Optional[Dict[str, Any]] = None
+        filter: Optional[Dict[str, Any]] = None,
+        index_vector: Optional[List[float]] = None
     ) -> List[Dict[str, Any]]:
         """
         Tìm kiếm vectors tương tự
         
         Args:
-            query_vector: Vector query để tìm kiếm
+            query_vector: Vector query để tìm kiếm (np.ndarray float32 hoặc list float)
             namespace: Namespace trong Pinecone
             top_k: Số lượng kết quả trả về
             filter: Filter metadata (ví dụ: {'status': '1'})
+            index_vector: Vector query giảm chiều do Vertex AI tạo, bắt buộc khi index giảm chiều
         
         Returns:
             List các kết quả với id, score, và metadata
@@ -113,26 +143,55 @@ class PineconeService:
             # Chuẩn bị filter nếu có
             pinecone_filter = self._prepare_filter(filter) if filter else None
             
-            # Đo thời gian truy vấn vector database
-            start_time = time.perf_counter()
-            results = index.query(
-                vector=query_vector,
-                top_k=top_k,
-                namespace=namespace,
-                include_metadata=True,
-                filter=pinecone_filter
+            # Index giảm chiều: query bằng vector giảm chiều, lấy thêm ứng viên để re-rank bằng vector đầy đủ
+            query_vector = np.asarray(query_vector, dtype=np.float32)
+            rerank = query_vector.shape[-1] > self.index_dimension
+            reduced_vector = self._index_vector(query_vector, index_vector) if rerank else query_vector
+            index_query_vector = reduced_vector.tolist()
+            query_top_k = top_k * self.rerank_oversample if rerank else top_k
+            inflight_key = (
+                self.index_name,
+                namespace,
+                query_top_k,
+                hashlib.sha1(reduced_vector.tobytes()).hexdigest(),
+                json.dumps(pinecone_filter, sort_keys=True, default=str)
             )
-            elapsed_time = time.perf_counter() - start_time
             
-            # Format kết quả
+            timeout = stage_timeout(Config.STAGE_TIMEOUT_VECTOR_SEARCH_SECONDS, 'vector_search')
+            
+            # Đo thời gian truy vấn vector database
+            # (circuit breaker 'pinecone': Pinecone đang lỗi thì raise CircuitOpenError ngay)
+            with span('pinecone.query', namespace=namespace, top_k=query_top_k) as query_span:
+                results = _inflight.do(
+                    inflight_key,
+                    lambda: get_circuit_breaker('pinecone').call(
+                        lambda: index.query(
+                            vector=index_query_vector,
+                            top_k=query_top_k,
+                            namespace=namespace,
+                            include_metadata=True,
+                            filter=pinecone_filter,
+                            _request_timeout=timeout
+                        )
+                    )
+                )
+            elapsed_time = query_span.duration
+            
+            # Format kết quả (copy metadata: response có thể được dùng chung với request đồng thời khác)
             formatted_results = []
             for match in results.matches:
                 formatted_results.append({
                     'id': match.id,
                     'score': match.score,
-                    'metadata': match.metadata or {}
+                    'metadata': dict(match.metadata or {})
                 })
             
+            if rerank:
+                formatted_results = rerank_matches(query_vector, formatted_results, top_k)
+            else:
+                for result in formatted_results:
+                    result['metadata'] = strip_encoded_vector(result['metadata'])
+            
             logger.info(
                 f"[Vector DB] Tìm kiếm trong namespace '{namespace}' - "
                 f"Tìm thấy {len(formatted_results)} kết quả - "
@@ -187,6 +246,71 @@ class PineconeService:
             logger.error(f"Lỗi khi xóa vectors: {str(e)}")
             raise
     
+    def update_vectors_metadata(
+        self,
+        vector_ids: List[str],
+        metadata: Dict[str, Any],
+        namespace: str
+    ) -> bool:
+        """
+        Cập nhật (merge) metadata của các vectors, giữ nguyên values
+        Dùng khi chỉ giá / tồn kho / status thay đổi, không cần tạo lại embedding
+        
+        Args:
+            vector_ids: List các ID của vectors
+            metadata: Metadata cần ghi đè (các key khác giữ nguyên)
+            namespace: Namespace trong Pinecone
+        
+        Returns:
+            bool: True nếu thành công
+        """
+        errors = self.update_vectors_metadata_batch([(vector_ids, metadata)], namespace=namespace)
+        if errors:
+            raise errors[0]
+        return True
+    
+    def update_vectors_metadata_batch(
+        self,
+        updates: List[Tuple[List[str], Dict[str, Any]]],
+        namespace: str
+    ) -> Dict[int, Exception]:
+        """
+        Cập nhật metadata của nhiều nhóm vectors (mỗi nhóm thường là một sản phẩm),
+        các request update chạy song song (PINECONE_UPDATE_WORKERS)
+        
+        Args:
+            updates: List (vector IDs, metadata cần ghi đè)
+            namespace: Namespace trong Pinecone
+        
+        Returns:
+            Dict[int, Exception]: Vị trí nhóm trong `updates` -> lỗi (rỗng nếu tất cả thành công)
+        """
+        index = self.get_index()
+        futures = []
+        for position, (vector_ids, metadata) in enumerate(updates):
+            pinecone_metadata = self._prepare_metadata(metadata)
+            for vector_id in vector_ids:
+                futures.append((position, _update_executor.submit(
+                    index.update, id=str(vector_id), set_metadata=pinecone_metadata, namespace=namespace
+                )))
+        
+        errors: Dict[int, Exception] = {}
+        for position, future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                errors.setdefault(position, e)
+        
+        updated = len(futures) - sum(1 for position, _ in futures if position in errors)
+        if errors:
+            logger.error(
+                f"Lỗi khi cập nhật metadata {len(errors)}/{len(updates)} nhóm vectors trong namespace {namespace}: "
+                f"{str(next(iter(errors.values())))}"
+            )
+        logger.info(f"Đã cập nhật metadata {updated} vectors trong namespace {namespace}")
+        return errors
+    
+    @observe_call('upsert_vectors_batch')
     def upsert_vectors_batch(
         self,
         vectors: List[Dict[str, Any]],
@@ -196,7 +320,8 @@ class PineconeService:
         Lưu hoặc cập nhật nhiều vectors vào Pinecone cùng lúc
         
         Args:
-            vectors: List các dict với keys: 'id', 'values', 'metadata'
+            vectors: List các dict với keys: 'id', 'values', 'metadata' ('values' là np.ndarray hoặc list),
+                'index_values' (vector giảm chiều do Vertex AI tạo, bắt buộc khi index giảm chiều)
             namespace: Namespace trong Pinecone
         
         Returns:
@@ -208,18 +333,33 @@ class PineconeService:
             
             index = self.get_index()
             
+            # Gom values thành ma trận 2-D float32; index giảm chiều thì lưu vector giảm chiều kèm theo
+            matrix = np.vstack([np.asarray(vec['values'], dtype=np.float32) for vec in vectors])
+            reduced = matrix.shape[1] > self.index_dimension
+            if reduced:
+                index_rows = [
+                    self._index_vector(full_vector, vec.get('index_values')).tolist()
+                    for vec, full_vector in zip(vectors, matrix)
+                ]
+            else:
+                index_rows = matrix.tolist()
+            
             # Chuẩn bị vectors cho Pinecone
             pinecone_vectors = []
-            for vec in vectors:
-                pinecone_metadata = self._prepare_metadata(vec.get('metadata', {}))
+            for vec, full_vector, values in zip(vectors, matrix, index_rows):
+                metadata = vec.get('metadata', {})
+                if reduced:
+                    metadata = {**metadata, **encode_vector(full_vector, self.rerank_precision)}
+                pinecone_metadata = self._prepare_metadata(metadata)
                 pinecone_vectors.append({
                     'id': str(vec['id']),
-                    'values': vec['values'],
+                    'values': values,
                     'metadata': pinecone_metadata
                 })
             
             # Upsert batch
-            index.upsert(vectors=pinecone_vectors, namespace=namespace)
+            with span('pinecone.upsert', namespace=namespace, vectors=len(pinecone_vectors)):
+                index.upsert(vectors=pinecone_vectors, namespace=namespace)
             logger.info(f"Đã upsert {len(pinecone_vectors)} vectors vào namespace {namespace}")
             return True
         except Exception as e:
@@ -245,6 +385,42 @@ class PineconeService:
             logger.error(f"Lỗi khi xóa tất cả vectors: {str(e)}")
             raise
     
+    def _prepare_values(
+        self,
+        values: Any,
+        metadata: Dict[str, Any],
+        index_values: Any = None
+    ) -> Tuple[List[float], Dict[str, Any]]:
+        """
+        Chuẩn bị values theo dimension của index, chuyển sang list float cho Pinecone client
+        Nếu index giảm chiều: lưu vector giảm chiều, vector đầy đủ được nén vào metadata để re-rank
+        """
+        vector = np.asarray(values, dtype=np.float32)
+        if vector.shape[-1] <= self.index_dimension:
+            return vector.tolist(), metadata
+        
+        reduced = self._index_vector(vector, index_values).tolist()
+        return reduced, {**metadata, **encode_vector(vector, self.rerank_precision)}
+    
+    def _index_vector(self, full_vector: np.ndarray, index_values: Any) -> np.ndarray:
+        """
+        Vector lưu / query trong index giảm chiều, đã chuẩn hóa
+        
+        multimodalembedding@001 không phải model Matryoshka: prefix của vector đầy đủ không phải
+        embedding hợp lệ, nên vector giảm chiều phải do Vertex AI tạo với dimension = VECTOR_INDEX_DIMENSION
+        """
+        if index_values is None:
+            raise ValueError(
+                f"Index lưu vector {self.index_dimension} chiều nhưng không có vector giảm chiều từ Vertex AI "
+                f"(vector đầy đủ {full_vector.shape[-1]} chiều không được cắt prefix)"
+            )
+        index_vector = l2_normalize(index_values)
+        if index_vector.shape[-1] != self.index_dimension:
+            raise ValueError(
+                f"Vector giảm chiều có {index_vector.shape[-1]} chiều, index cần {self.index_dimension} chiều"
+            )
+        return index_vector
+    
     def _prepare_metadata(self, metadata: Dict[str, Any]) -> Dict[str, Any]:
         """
         Chuẩn bị metadata cho Pinecone
@@ -0,0 +1,261 @@
+"""
+Service tạo vectors (text + image) cho sản phẩm và upsert vào Pinecone
+Dùng chung cho API upsert, batch-upsert và các job chạy nền
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+import hashlib
+import json
+import logging
+
+from config import Config
+from services.embedding_service import get_embedding_service
+from services.pinecone_service import get_pinecone_service
+from utils.product_helper import (
+    create_text_for_embedding,
+    prepare_metadata_for_pinecone,
+    extract_image_urls
+)
+from utils.tracing import wrap_context
+
+logger = logging.getLogger(__name__)
+
+# Sản phẩm trong một batch upsert được tạo vectors song song (mỗi sản phẩm chờ Vertex AI cho text + từng ảnh)
+_embed_executor = ThreadPoolExecutor(max_workers=Config.VECTOR_UPSERT_EMBED_WORKERS, thread_name_prefix='upsert-embed')
+
+# Các trường quyết định nội dung vector (text + ảnh); đổi trường khác (giá, tồn kho, status) chỉ cần cập nhật metadata
+CONTENT_FIELDS = ('text_for_embedding', 'main_image_url', 'detail_image_url', 'metadata')
+
+
+def build_product_vectors(
+    product_id: int,
+    business_id: int,
+    name: str,
+    price: float,
+    status: str,
+    quantity_avail: int,
+    description: Optional[str] = None,
+    main_image_url: Optional[str] = None,
+    detail_image_url: Optional[str] = None,
+    metadata: Optional[Dict[str, Any]] = None,
+    text_for_embedding: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """
+    Tạo text vector và image vectors (main + detail) cho một sản phẩm
+    
+    Args:
+        product_id: ID sản phẩm
+        business_id: ID business
+        name: Tên sản phẩm
+        price: Giá
+        status: Trạng thái
+        quantity_avail: Số lượng có sẵn
+        description: Mô tả
+        main_image_url: URL ảnh chính
+        detail_image_url: URL ảnh chi tiết (ngăn cách bởi dấu phẩy)
+        metadata: Metadata bổ sung
+        text_for_embedding: Text đã dựng sẵn; None thì dựng từ name/description/metadata
+    
+    Returns:
+        List[Dict]: Vectors với keys 'id', 'values', 'index_values', 'metadata' (text vector đứng đầu)
+    """
+    if text_for_embedding is None:
+        text_for_embedding = create_text_for_embedding(
+            name=name,
+            description=description,
+            metadata=metadata
+        )
+    
+    # Tạo text embedding vector (kèm vector giảm chiều nếu index giảm chiều)
+    text_vectors = get_embedding_service().create_text_vectors(text_for_embedding)
+    
+    # Chuẩn bị metadata để lưu vào Pinecone
+    pinecone_metadata = prepare_metadata_for_pinecone(
+        product_id=product_id,
+        business_id=business_id,
+        name=name,
+        price=price,
+        status=status,
+        quantity_avail=quantity_avail,
+        description=description,
+        metadata=metadata
+    )
+    
+    # Thêm image URLs vào metadata
+    if main_image_url:
+        pinecone_metadata['main_image_url'] = main_image_url
+    if detail_image_url:
+        pinecone_metadata['detail_image_url'] = detail_image_url
+    
+    vectors = [{
+        'id': f"{product_id}_text",
+        'values': text_vectors['vector'],
+        'index_values': text_vectors['index_vector'],
+        'metadata': {**pinecone_metadata, 'vector_type': 'text'}
+    }]
+    
+    # Tạo image embeddings cho tất cả các ảnh (main + detail)
+    all_image_urls = extract_image_urls(main_image_url, detail_image_url)
+    for index, image_url in enumerate(all_image_urls):
+        try:
+            image_vectors = get_embedding_service().create_image_vectors(image_url)
+            if image_vectors is not None:
+                # Đặt tên vector: image_main cho ảnh đầu tiên nếu là main, hoặc image_0, image_1, etc.
+                if index == 0 and main_image_url and image_url == main_image_url.strip():
+                    image_vector_id = f"{product_id}_image_main"
+                else:
+                    image_vector_id = f"{product_id}_image_{index}"
+                
+                vectors.append({
+                    'id': image_vector_id,
+                    'values': image_vectors['vector'],
+                    'index_values': image_vectors['index_vector'],
+                    'metadata': {**pinecone_metadata, 'vector_type': 'image', 'image_index': index}
+                })
+        except Exception as img_error:
+            # Log lỗi nhưng không fail toàn bộ sản phẩm nếu image embedding thất bại
+            logger.warning(f"Không thể tạo image embedding cho ảnh {index} của product {product_id}: {str(img_error)}")
+    
+    return vectors
+
+
+def upsert_product_requests(
+    products: List[Any],
+    namespace: str,
+    job: Optional[Any] = None
+) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """
+    Tạo vectors và upsert vào Pinecone cho list ProductVectorRequest, theo từng batch
+    
+    Mỗi batch (VECTOR_UPSERT_BATCH_SIZE sản phẩm) được tạo vectors song song rồi upsert ngay,
+    không giữ vectors của toàn bộ catalog trong bộ nhớ. Sản phẩm chỉ được ghi "success"
+    sau khi vectors của nó đã upsert thành công vào Pinecone.
+    
+    Args:
+        products: List ProductVectorRequest
+        namespace: Namespace mặc định (dùng khi request không có namespace)
+        job: Job để cập nhật tiến độ (optional)
+    
+    Returns:
+        Tuple: (results, errors) - results là list dict trạng thái từng sản phẩm, errors là list thông báo lỗi
+    """
+    results = []
+    errors = []
+    batch_size = max(1, Config.VECTOR_UPSERT_BATCH_SIZE)
+    
+    for start in range(0, len(products), batch_size):
+        vectors_by_namespace = {}
+        products_by_namespace = {}
+        
+        futures = []
+        for product_request in products[start:start + batch_size]:
+            futures.append((product_request, _embed_executor.submit(
+                wrap_context(build_product_vectors),
+                product_id=product_request.product_id,
+                business_id=product_request.business_id,
+                name=product_request.name,
+                price=product_request.price,
+                status=product_request.status,
+                quantity_avail=product_request.quantity_avail,
+                description=product_request.description,
+                main_image_url=product_request.main_image_url,
+                detail_image_url=product_request.detail_image_url,
+                metadata=product_request.metadata
+            )))
+        
+        for product_request, future in futures:
+            try:
+                vectors = future.result()
+                
+                # Sử dụng namespace từ request hoặc từ parameter
+                target_namespace = product_request.namespace if product_request.namespace else namespace
+                vectors_by_namespace.setdefault(target_namespace, []).extend(vectors)
+                products_by_namespace.setdefault(target_namespace, []).append(product_request.product_id)
+            except Exception as e:
+                errors.append(f"Lỗi với sản phẩm {product_request.product_id}: {str(e)}")
+                if job is not None:
+                    job.record_error(product_request.product_id, str(e))
+        
+        # Upsert từng namespace của batch, chỉ ghi kết quả khi upsert thành công
+        for ns, vectors in vectors_by_namespace.items():
+            try:
+                get_pinecone_service().upsert_vectors_batch(
+                    vectors=vectors,
+                    namespace=ns
+                )
+            except Exception as e:
+                logger.error(f"Lỗi khi upsert vectors vào namespace {ns}: {str(e)}")
+                errors.append(f"Lỗi khi upsert vào namespace {ns}: {str(e)}")
+                if job is not None:
+                    for product_id in products_by_namespace[ns]:
+                        job.record_error(product_id, f"Lỗi khi upsert vào namespace {ns}: {str(e)}")
+                continue
+            
+            results.extend(
+                {"product_id": product_id, "namespace": ns, "status": "success"}
+                for product_id in products_by_namespace[ns]
+            )
+            if job is not None:
+                job.record_success(len(products_by_namespace[ns]))
+    
+    return results, errors
+
+
+def product_to_vector_input(product: Any) -> Dict[str, Any]:
+    """
+    Lấy các trường cần cho indexing từ Product model ra dict thuần (tham số của build_product_vectors)
+    Dict thuần để worker thread không chạm vào ORM object / session đang stream
+    
+    Args:
+        product: Product model
+    
+    Returns:
+        Dict: product_id, business_id, name, ..., metadata (dict), text_for_embedding
+    """
+    metadata = None
+    if product.meta_data:
+        try:
+            metadata = json.loads(product.meta_data)
+        except ValueError:
+            logger.warning(f"Product {product.id} có metadata không phải JSON, bỏ qua metadata")
+    if not isinstance(metadata, dict):
+        metadata = None
+    
+    return {
+        'product_id': product.id,
+        'business_id': product.business_id,
+        'name': product.name,
+        'description': product.description,
+        'price': float(product.price) if product.price is not None else 0,
+        'status': product.status,
+        'quantity_avail': product.quantity_avail or 0,
+        'main_image_url': product.main_image_url,
+        'detail_image_url': product.detail_image_url,
+        'metadata': metadata,
+        # Cùng hàm dựng text với API upsert và BM25: cùng sản phẩm luôn cho cùng vector dù index qua đường nào
+        'text_for_embedding': create_text_for_embedding(
+            name=product.name,
+            description=product.description,
+            metadata=metadata
+        )
+    }
+
+
+def product_content_hash(product_input: Dict[str, Any]) -> str:
+    """
+    Hash nội dung dùng để tạo embedding (text, ảnh, metadata) của sản phẩm
+    Hash không đổi nghĩa là không cần tạo lại embedding
+    
+    Args:
+        product_input: Dict trả về từ product_to_vector_input
+    
+    Returns:
+        str: Hash hex (16 ký tự)
+    """
+    content = json.dumps(
+        [product_input.get(field) for field in CONTENT_FIELDS],
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str
+    )
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()[:16]
@@ -0,0 +1,563 @@
+"""
+Đồng bộ tăng dần (incremental sync) bảng Product -> Pinecone theo watermark updated_at
+
+- Mỗi business lưu watermark (updated_at, id) của sản phẩm cuối cùng đã đồng bộ
+- Mỗi lượt chỉ đọc sản phẩm có updated_at mới hơn watermark, nên chi phí tỉ lệ với số thay đổi
+- Sản phẩm mới / đổi nội dung (text, ảnh, metadata): tạo lại embedding
+- Chỉ đổi giá / tồn kho / status (ví dụ '2' hết hàng): chỉ cập nhật metadata, không gọi Vertex AI
+- Status '3' (ngừng kinh doanh): xóa vectors
+"""
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import select, func, or_, and_
+from sqlalchemy.orm import Session
+
+from config import Config
+from database import SessionLocal, get_db_now
+from models.product import Product
+from services.pinecone_service import get_pinecone_service
+from services.lexical_index import get_lexical_index_service
+from services.business_context_service import get_business_context_service
+from services.product_indexing_service import (
+    build_product_vectors,
+    product_to_vector_input,
+    product_content_hash
+)
+from utils.product_helper import extract_image_urls, get_product_vector_ids, prepare_metadata_for_pinecone
+
+logger = logging.getLogger(__name__)
+
+# Sản phẩm ngừng kinh doanh: xóa vectors khỏi index
+STATUS_NO_LONGER_SELL = '3'
+
+
+class SyncState:
+    """
+    Trạng thái sync của một business, lưu dạng JSON trong PRODUCT_SYNC_STATE_DIR
+    
+    - watermark: (updated_at, id) của sản phẩm cuối cùng đã đồng bộ
+    - products: product_id -> {'hash': hash nội dung, 'ids': vector IDs đã upsert, 'images': URL ảnh}
+      dùng để nhận biết thay đổi chỉ ở metadata và xóa vectors ảnh cũ khi đổi ảnh
+    - failed: product IDs đồng bộ lỗi (watermark đã đi qua), được thử lại ở lượt sau
+    
+    Sau mỗi batch chỉ ghi thêm một dòng vào file journal (watermark + sản phẩm vừa thay đổi);
+    toàn bộ state được ghi lại (và journal bị xóa) sau PRODUCT_SYNC_COMPACT_BATCHES batch
+    """
+    
+    def __init__(self, state_dir: str, business_id: int):
+        self.path = os.path.join(state_dir, f"business_{business_id}.json")
+        self.journal_path = f"{self.path}.journal"
+        self.business_id = business_id
+        self.updated_at: Optional[datetime] = None
+        self.last_id = 0
+        self.products: Dict[str, Dict[str, Any]] = {}
+        self.failed: List[int] = []
+        self.signature: Optional[tuple] = None
+        self._dirty: set = set()
+        self._journal_entries = 0
+        os.makedirs(state_dir, exist_ok=True)
+    
+    def load(self) -> 'SyncState':
+        """Đọc trạng thái từ file + journal (chưa có = chưa sync lần nào)"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._apply(json.load(f))
+        except (OSError, ValueError) as e:
+            if os.path.exists(self.path):
+                logger.warning(f"[Sync] State {self.path} không đọc được, sync lại từ đầu: {str(e)}")
+        try:
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Dòng cuối ghi dở (process dừng giữa chừng): batch đó sẽ được sync lại,
+                        # lần ghi sau ghi lại toàn bộ state thay vì nối tiếp vào dòng hỏng
+                        self._journal_entries = Config.PRODUCT_SYNC_COMPACT_BATCHES
+                        break
+                    self._apply(entry)
+                    self.products.update(entry.get('products_changed') or {})
+                    for key in entry.get('products_removed') or []:
+                        self.products.pop(key, None)
+                    self._journal_entries += 1
+        except OSError:
+            pass
+        self.signature = self._file_signature()
+        return self
+    
+    def _apply(self, data: Dict[str, Any]):
+        updated_at = data.get('updated_at')
+        self.updated_at = datetime.fromisoformat(updated_at) if updated_at else None
+        self.last_id = int(data.get('last_id', 0))
+        if 'products' in data:
+            self.products = data.get('products') or {}
+        self.failed = [int(product_id) for product_id in data.get('failed') or []]
+    
+    def set_product(self, key: str, product_state: Dict[str, Any]):
+        self.products[key] = product_state
+        self._dirty.add(key)
+    
+    def remove_product(self, key: str):
+        self.products.pop(key, None)
+        self._dirty.add(key)
+    
+    def _header(self) -> Dict[str, Any]:
+        return {
+            'business_id': self.business_id,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+            'last_id': self.last_id,
+            'failed': self.failed,
+            'synced_at': time.time()
+        }
+    
+    def save(self):
+        """Ghi toàn bộ trạng thái (ghi file tạm rồi replace) và xóa journal"""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({**self._header(), 'products': self.products}, f)
+        os.replace(tmp_path, self.path)
+        try:
+            os.remove(self.journal_path)
+        except OSError:
+            pass
+        self._dirty.clear()
+        self._journal_entries = 0
+        self.signature = self._file_signature()
+    
+    def commit(self):
+        """Ghi watermark + sản phẩm thay đổi từ lần ghi trước vào journal (ghi toàn bộ khi journal đủ dài)"""
+        if self._journal_entries + 1 >= Config.PRODUCT_SYNC_COMPACT_BATCHES:
+            self.save()
+            return
+        entry = {
+            **self._header(),
+            'products_changed': {key: self.products[key] for key in self._dirty if key in self.products},
+            'products_removed': [key for key in self._dirty if key not in self.products]
+        }
+        with open(self.journal_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry) + "\n")
+        self._dirty.clear()
+        self._journal_entries += 1
+        self.signature = self._file_signature()
+    
+    def _file_signature(self) -> tuple:
+        signature = []
+        for path in (self.path, self.journal_path):
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+    
+    def is_stale(self) -> bool:
+        """File trạng thái / journal đã bị process khác ghi (ví dụ CLI reindex) kể từ lần đọc/ghi cuối"""
+        return self._file_signature() != self.signature
+
+
+class ProductSyncService:
+    """Áp dụng thay đổi của bảng Product vào Pinecone theo watermark updated_at"""
+    
+    def __init__(
+        self,
+        batch_size: Optional[int] = None,
+        lag_seconds: Optional[int] = None,
+        state_dir: Optional[str] = None
+    ):
+        """
+        Args:
+            batch_size: Số sản phẩm thay đổi xử lý mỗi batch
+            lag_seconds: Chỉ đọc sản phẩm có updated_at cũ hơn (now - lag) để không bỏ sót
+                transaction commit muộn có cùng updated_at
+            state_dir: Thư mục lưu trạng thái sync
+        """
+        self.batch_size = max(1, batch_size or Config.PRODUCT_SYNC_BATCH_SIZE)
+        self.lag_seconds = Config.PRODUCT_SYNC_LAG_SECONDS if lag_seconds is None else lag_seconds
+        self.state_dir = state_dir or Config.PRODUCT_SYNC_STATE_DIR
+        # Worker nền và API sync không chạy chồng lên nhau
+        self._lock = threading.Lock()
+        # Giữ trạng thái trong RAM, chỉ đọc lại file khi process khác đã ghi
+        self._states: Dict[int, SyncState] = {}
+    
+    def _get_state(self, business_id: int) -> SyncState:
+        state = self._states.get(business_id)
+        if state is None or state.is_stale():
+            state = SyncState(self.state_dir, business_id).load()
+            self._states[business_id] = state
+        return state
+    
+    def mark_synced(self, business_id: int, as_of: datetime, failed_ids: Optional[List[int]] = None):
+        """
+        Đặt watermark của business về thời điểm `as_of` (gọi sau khi reindex toàn bộ xong,
+        để lượt sync sau chỉ xử lý thay đổi kể từ lúc bắt đầu reindex)
+        
+        Args:
+            failed_ids: Sản phẩm reindex lỗi, được thử lại ở lượt sync sau dù updated_at cũ hơn watermark
+        """
+        with self._lock:
+            state = self._get_state(business_id)
+            changed = False
+            if state.updated_at is None or as_of > state.updated_at:
+                state.updated_at = as_of
+                state.last_id = 0
+                changed = True
+            if failed_ids:
+                state.failed = sorted(set(state.failed) | set(failed_ids))
+                changed = True
+            if changed:
+                state.save()
+    
+    def record_products(
+        self,
+        business_id: int,
+        product_states: Dict[str, Dict[str, Any]],
+        removed_keys: Optional[List[str]] = None
+    ):
+        """
+        Ghi trạng thái sản phẩm vừa được index ngoài sync (reindex) để lượt sync sau nhận biết
+        thay đổi chỉ ở metadata và xóa vectors ảnh cũ khi đổi ảnh
+        
+        Args:
+            product_states: product_id (str) -> {'hash', 'ids', 'images'}
+            removed_keys: product_id (str) đã xóa vectors (ngừng kinh doanh)
+        """
+        removed_keys = removed_keys or []
+        if not product_states and not removed_keys:
+            return
+        with self._lock:
+            state = self._get_state(business_id)
+            for key, product_state in product_states.items():
+                state.set_product(key, product_state)
+            for key in removed_keys:
+                state.remove_product(key)
+            if state.failed:
+                done = set(product_states) | set(removed_keys)
+                state.failed = [product_id for product_id in state.failed if str(product_id) not in done]
+            state.commit()
+    
+    def get_changed_business_ids(self, db: Session) -> List[int]:
+        """Business có sản phẩm updated_at mới hơn watermark (một query GROUP BY cho tất cả business)"""
+        rows = db.execute(
+            select(Product.business_id, func.max(Product.updated_at)).group_by(Product.business_id)
+        ).all()
+        
+        changed = []
+        for business_id, max_updated_at in rows:
+            if isinstance(max_updated_at, str):
+                max_updated_at = datetime.fromisoformat(max_updated_at)
+            state = self._get_state(business_id)
+            # Sản phẩm cùng updated_at với watermark đã được đọc hết ở lượt trước (nhờ lag_seconds)
+            if (
+                state.updated_at is None
+                or state.failed
+                or (max_updated_at is not None and max_updated_at > state.updated_at)
+            ):
+                changed.append(business_id)
+        return changed
+    
+    def sync_all(self, business_ids: Optional[List[int]] = None, job: Optional[Any] = None) -> Dict[str, Any]:
+        """
+        Sync các business có thay đổi (hoặc danh sách business_ids chỉ định)
+        
+        Returns:
+            Dict: Thống kê từng business
+        """
+        with self._lock:
+            start_time = time.perf_counter()
+            db = SessionLocal()
+            try:
+                if business_ids is None:
+                    business_ids = self.get_changed_business_ids(db)
+            finally:
+                db.close()
+            
+            results = []
+            for business_id in business_ids:
+                # Một business lỗi không chặn sync các business sau
+                try:
+                    results.append(self._sync_business(business_id, job=job))
+                except Exception as e:
+                    logger.error(f"[Sync] Lỗi đồng bộ business {business_id}: {str(e)}")
+                    results.append({
+                        'business_id': business_id,
+                        'namespace': f"business_{business_id}",
+                        'changed': 0,
+                        'error': str(e)
+                    })
+            elapsed = time.perf_counter() - start_time
+            return {
+                'businesses': results,
+                'changed': sum(r['changed'] for r in results),
+                'elapsed_seconds': round(elapsed, 3)
+            }
+    
+    def sync_business(self, business_id: int, job: Optional[Any] = None) -> Dict[str, Any]:
+        """Sync một business"""
+        with self._lock:
+            return self._sync_business(business_id, job=job)
+    
+    def _sync_business(self, business_id: int, job: Optional[Any] = None) -> Dict[str, Any]:
+        namespace = f"business_{business_id}"
+        state = self._get_state(business_id)
+        stats = {'reembedded': 0, 'metadata_updated': 0, 'deleted': 0, 'error_count': 0}
+        start_time = time.perf_counter()
+        
+        db = SessionLocal()
+        try:
+            # Thử lại sản phẩm lỗi ở các lượt trước (watermark đã đi qua chúng); sản phẩm đã bị xóa khỏi DB thì bỏ
+            failed = set()
+            retry_ids = list(state.failed)
+            for start in range(0, len(retry_ids), self.batch_size):
+                products = db.execute(
+                    select(Product)
+                    .where(Product.business_id == business_id, Product.id.in_(retry_ids[start:start + self.batch_size]))
+                    .order_by(Product.id)
+                ).scalars().all()
+                if products:
+                    inputs = [product_to_vector_input(product) for product in products]
+                    failed.update(self._apply_batch(namespace, inputs, state, stats, job))
+                    get_business_context_service().invalidate_products(business_id, [product.id for product in products])
+            if retry_ids:
+                state.failed = sorted(failed)
+                state.commit()
+            
+            upper_bound = get_db_now(db) - timedelta(seconds=self.lag_seconds)
+            while True:
+                stmt = (
+                    select(Product)
+                    .where(Product.business_id == business_id, Product.updated_at <= upper_bound)
+                    .order_by(Product.updated_at, Product.id)
+                    .limit(self.batch_size)
+                )
+                if state.updated_at is not None:
+                    # Keyset theo (updated_at, id): nhiều sản phẩm cùng updated_at không bị bỏ sót
+                    stmt = stmt.where(or_(
+                        Product.updated_at > state.updated_at,
+                        and_(Product.updated_at == state.updated_at, Product.id > state.last_id)
+                    ))
+                
+                products = db.execute(stmt).scalars().all()
+                if not products:
+                    break
+                
+                inputs = [product_to_vector_input(product) for product in products]
+                batch_failed = self._apply_batch(namespace, inputs, state, stats, job)
+                # Fragment context của các sản phẩm này render lại ở request chat sau
+                get_business_context_service().invalidate_products(business_id, [product.id for product in products])
+                
+                # Batch đã áp dụng xong mới dời watermark; sản phẩm lỗi được giữ lại để thử lại ở lượt sau
+                failed.difference_update(product.id for product in products)
+                failed.update(batch_failed)
+                last = products[-1]
+                state.updated_at = last.updated_at
+                state.last_id = last.id
+                state.failed = sorted(failed)
+                state.commit()
+                db.expire_all()
+                
+                if len(products) < self.batch_size:
+                    break
+        finally:
+            db.close()
+        
+        elapsed = time.perf_counter() - start_time
+        changed = stats['reembedded'] + stats['metadata_updated'] + stats['deleted'] + stats['error_count']
+        if changed:
+            # Index BM25 của business build lại từ DB ở lần search sau
+            get_lexical_index_service().invalidate(business_id)
+            logger.info(
+                f"[Sync] Business {business_id}: {stats['reembedded']} tạo lại embedding, "
+                f"{stats['metadata_updated']} cập nhật metadata, {stats['deleted']} xóa, "
+                f"{stats['error_count']} lỗi - {elapsed:.2f}s"
+            )
+        return {'business_id': business_id, 'namespace': namespace, 'changed': changed, **stats}
+    
+    def _apply_batch(
+        self,
+        namespace: str,
+        inputs: List[Dict[str, Any]],
+        state: SyncState,
+        stats: Dict[str, int],
+        job: Optional[Any]
+    ) -> List[int]:
+        """
+        Áp dụng thay đổi của một batch sản phẩm vào Pinecone
+        
+        Lỗi upsert / delete không raise: sản phẩm liên quan được trả về trong danh sách lỗi
+        (giữ trạng thái cũ, thử lại ở lượt sau) để watermark vẫn đi tiếp
+        
+        Returns:
+            List[int]: Product IDs bị lỗi
+        """
+        pinecone_service = get_pinecone_service()
+        vectors = []
+        delete_ids: List[str] = []
+        new_states: Dict[str, Dict[str, Any]] = {}
+        # Vectors ảnh không còn dùng của sản phẩm tạo lại embedding, chỉ xóa khi upsert thành công
+        orphan_ids: Dict[str, List[str]] = {}
+        deleted_products: List[str] = []
+        failed_ids: List[int] = []
+        metadata_updates: List[Tuple[List[str], Dict[str, Any]]] = []
+        metadata_products: List[int] = []
+        
+        for product_input in inputs:
+            product_id = product_input['product_id']
+            key = str(product_id)
+            previous = state.products.get(key)
+            try:
+                if product_input['status'] == STATUS_NO_LONGER_SELL:
+                    ids = previous['ids'] if previous else get_product_vector_ids(
+                        product_id, product_input['main_image_url'], product_input['detail_image_url']
+                    )
+                    delete_ids.extend(ids)
+                    deleted_products.append(key)
+                    continue
+                
+                content_hash = product_content_hash(product_input)
+                if previous and previous.get('hash') == content_hash:
+                    # Nội dung không đổi: chỉ cập nhật giá / tồn kho / status trong metadata (gửi cả batch một lần)
+                    metadata_updates.append((previous['ids'], self._base_metadata(product_input)))
+                    metadata_products.append(product_id)
+                    continue
+                
+                product_vectors = build_product_vectors(**product_input)
+                new_ids = [vec['id'] for vec in product_vectors]
+                image_urls = extract_image_urls(product_input['main_image_url'], product_input['detail_image_url'])
+                # State cũ chưa lưu 'images' thì coi như ảnh không đổi
+                if previous and len(new_ids) < 1 + len(image_urls) and previous.get('images', image_urls) == image_urls:
+                    # Ảnh không đổi nhưng có ảnh không tạo được embedding (Vertex AI lỗi / circuit đang mở):
+                    # coi là lỗi, giữ vectors và trạng thái cũ thay vì xóa vectors ảnh đang dùng
+                    raise RuntimeError(f"Chỉ tạo được {len(new_ids)}/{1 + len(image_urls)} vectors")
+                vectors.extend(product_vectors)
+                if previous:
+                    # Ảnh bị bỏ / đổi thứ tự: xóa vectors ảnh không còn dùng
+                    orphan_ids[key] = [vid for vid in previous['ids'] if vid not in new_ids]
+                new_states[key] = {'hash': content_hash, 'ids': new_ids, 'images': image_urls}
+            except Exception as e:
+                stats['error_count'] += 1
+                failed_ids.append(product_id)
+                logger.error(f"[Sync] Lỗi đồng bộ product {product_id}: {str(e)}")
+                if job is not None:
+                    job.record_error(product_id, str(e))
+        
+        def fail_products(keys: List[str], error: Exception, action: str):
+            for key in keys:
+                stats['error_count'] += 1
+                failed_ids.append(int(key))
+                if job is not None:
+                    job.record_error(int(key), f"Lỗi khi {action}: {str(error)}")
+            logger.error(f"[Sync] Lỗi khi {action} ({len(keys)} sản phẩm) namespace {namespace}: {str(error)}")
+        
+        if metadata_updates:
+            update_errors = pinecone_service.update_vectors_metadata_batch(metadata_updates, namespace=namespace)
+            for position, product_id in enumerate(metadata_products):
+                error = update_errors.get(position)
+                if error is None:
+                    stats['metadata_updated'] += 1
+                    continue
+                stats['error_count'] += 1
+                failed_ids.append(product_id)
+                logger.error(f"[Sync] Lỗi cập nhật metadata product {product_id}: {str(error)}")
+                if job is not None:
+                    job.record_error(product_id, str(error))
+        if vectors:
+            try:
+                pinecone_service.upsert_vectors_batch(vectors=vectors, namespace=namespace)
+            except Exception as e:
+                # Ví dụ metadata vượt giới hạn Pinecone: vectors cũ giữ nguyên, cả batch thử lại ở lượt sau
+                fail_products(list(new_states), e, 'upsert vectors')
+                new_states = {}
+        
+        delete_keys = [key for key in new_states if orphan_ids.get(key)]
+        for key in delete_keys:
+            delete_ids.extend(orphan_ids[key])
+        if delete_ids:
+            try:
+                pinecone_service.delete_vectors(delete_ids, namespace=namespace)
+            except Exception as e:
+                # Giữ trạng thái cũ (vector IDs cũ) để lượt sau xóa lại được
+                fail_products(deleted_products + delete_keys, e, 'xóa vectors')
+                for key in delete_keys:
+                    new_states.pop(key, None)
+                deleted_products = []
+        
+        stats['reembedded'] += len(new_states)
+        stats['deleted'] += len(deleted_products)
+        for key, product_state in new_states.items():
+            state.set_product(key, product_state)
+        for key in deleted_products:
+            state.remove_product(key)
+        
+        if job is not None:
+            job.record_success(len(inputs) - len(failed_ids))
+        return failed_ids
+    
+    def _base_metadata(self, product_input: Dict[str, Any]) -> Dict[str, Any]:
+        """Metadata chung của các vectors sản phẩm (không gồm vector_type / image_index)"""
+        metadata = prepare_metadata_for_pinecone(
+            product_id=product_input['product_id'],
+            business_id=product_input['business_id'],
+            name=product_input['name'],
+            price=product_input['price'],
+            status=product_input['status'],
+            quantity_avail=product_input['quantity_avail'],
+            description=product_input['description'],
+            metadata=product_input['metadata']
+        )
+        if product_input['main_image_url']:
+            metadata['main_image_url'] = product_input['main_image_url']
+        if product_input['detail_image_url']:
+            metadata['detail_image_url'] = product_input['detail_image_url']
+        return metadata
+
+
+class ProductSyncWorker:
+    """Thread nền chạy sync_all mỗi PRODUCT_SYNC_INTERVAL_SECONDS giây"""
+    
+    def __init__(self, service: ProductSyncService, interval_seconds: int):
+        self.service = service
+        self.interval_seconds = interval_seconds
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+    
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='product-sync', daemon=True)
+        self._thread.start()
+        logger.info(f"[Sync] Worker bắt đầu, chu kỳ {self.interval_seconds}s")
+    
+    def stop(self, timeout: Optional[float] = None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+    
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.service.sync_all()
+            except Exception as e:
+                logger.error(f"[Sync] Lượt sync lỗi: {str(e)}")
+            self._stop.wait(self.interval_seconds)
+
+
+# Lazy singleton
+_product_sync_service_instance: Optional[ProductSyncService] = None
+_product_sync_lock = threading.Lock()
+
+
+def get_product_sync_service() -> ProductSyncService:
+    """Lấy instance ProductSyncService (lazy init, singleton)."""
+    global _product_sync_service_instance
+    if _product_sync_service_instance is None:
+        with _product_sync_lock:
+            if _product_sync_service_instance is None:
+                _product_sync_service_instance = ProductSyncService()
+    return _product_sync_service_instance
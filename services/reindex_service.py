@@ -0,0 +1,411 @@
+"""
+Reindex toàn bộ catalog từ bảng Product vào Pinecone
+
+- Đọc Product theo từng business bằng server-side cursor (yield_per), không load cả bảng vào RAM
+- Text embedding dựng bằng create_text_for_embedding (giống API upsert / sync / BM25)
+- Pipeline: tạo embedding batch sau trong khi batch trước đang upsert vào Pinecone
+- Checkpoint theo business (product_id cuối cùng đã upsert) để chạy tiếp khi bị gián đoạn
+- Sản phẩm lỗi được lưu trong checkpoint, thử lại một lần cuối lượt; còn lỗi thì giao cho incremental sync
+- Trạng thái từng sản phẩm (hash, vector IDs, ảnh) được ghi vào state của incremental sync sau mỗi batch upsert
+"""
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import select, func
+
+from config import Config
+from database import SessionLocal
+from models.product import Product
+from services.pinecone_service import get_pinecone_service
+from services.lexical_index import get_lexical_index_service
+from services.product_indexing_service import build_product_vectors, product_to_vector_input, product_content_hash
+from services.product_sync_service import get_db_now, get_product_sync_service
+from utils.product_helper import extract_image_urls, get_product_vector_ids
+
+logger = logging.getLogger(__name__)
+
+# Sản phẩm ngừng kinh doanh: không index, xóa vectors cũ nếu có
+STATUS_NO_LONGER_SELL = '3'
+
+
+class ReindexCheckpoint:
+    """
+    Checkpoint reindex của một business, lưu dạng JSON trong REINDEX_CHECKPOINT_DIR
+    
+    Product được đọc theo thứ tự id tăng dần, nên chỉ cần lưu id cuối cùng đã upsert xong
+    và danh sách product_id bị lỗi (đã nằm trước last_product_id nhưng chưa được index)
+    """
+    
+    def __init__(self, checkpoint_dir: str, business_id: int):
+        self.path = os.path.join(checkpoint_dir, f"business_{business_id}.json")
+        self.business_id = business_id
+        self.last_product_id = 0
+        self.processed = 0
+        self.error_count = 0
+        self.failed_ids: List[int] = []
+        self.completed = False
+        # Thời điểm (theo DB) bắt đầu lượt reindex, giữ nguyên khi chạy tiếp từ checkpoint
+        self.started_at: Optional[datetime] = None
+        os.makedirs(checkpoint_dir, exist_ok=True)
+    
+    def load(self) -> 'ReindexCheckpoint':
+        """Đọc checkpoint từ file (giữ giá trị mặc định nếu chưa có / file hỏng)"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.last_product_id = int(data.get('last_product_id', 0))
+            self.processed = int(data.get('processed', 0))
+            self.error_count = int(data.get('error_count', 0))
+            self.failed_ids = [int(product_id) for product_id in data.get('failed_ids') or []]
+            self.completed = bool(data.get('completed', False))
+            started_at = data.get('started_at')
+            self.started_at = datetime.fromisoformat(started_at) if started_at else None
+        except (OSError, ValueError) as e:
+            if os.path.exists(self.path):
+                logger.warning(f"[Reindex] Checkpoint {self.path} không đọc được, chạy lại từ đầu: {str(e)}")
+        return self
+    
+    def save(self):
+        """Ghi checkpoint (ghi file tạm rồi replace để không bị file ghi dở)"""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'business_id': self.business_id,
+                'last_product_id': self.last_product_id,
+                'processed': self.processed,
+                'error_count': self.error_count,
+                'failed_ids': self.failed_ids,
+                'completed': self.completed,
+                'started_at': self.started_at.isoformat() if self.started_at else None,
+                'updated_at': time.time()
+            }, f)
+        os.replace(tmp_path, self.path)
+    
+    def reset(self):
+        """Xóa checkpoint để reindex lại từ đầu"""
+        self.last_product_id = 0
+        self.processed = 0
+        self.error_count = 0
+        self.failed_ids = []
+        self.completed = False
+        self.started_at = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class ReindexService:
+    """Reindex sản phẩm của một hoặc nhiều business từ MySQL vào Pinecone"""
+    
+    def __init__(
+        self,
+        batch_size: Optional[int] = None,
+        embed_workers: Optional[int] = None,
+        checkpoint_dir: Optional[str] = None
+    ):
+        """
+        Args:
+            batch_size: Số sản phẩm mỗi batch (đọc DB, embedding, upsert)
+            embed_workers: Số thread tạo embedding song song trong một batch
+            checkpoint_dir: Thư mục lưu checkpoint
+        """
+        self.batch_size = max(1, batch_size or Config.REINDEX_BATCH_SIZE)
+        self.embed_workers = max(1, embed_workers or Config.REINDEX_EMBED_WORKERS)
+        self.checkpoint_dir = checkpoint_dir or Config.REINDEX_CHECKPOINT_DIR
+    
+    def get_business_ids(self) -> List[int]:
+        """Danh sách business_id có sản phẩm trong bảng Product"""
+        db = SessionLocal()
+        try:
+            rows = db.execute(select(Product.business_id).distinct().order_by(Product.business_id))
+            return [row[0] for row in rows]
+        finally:
+            db.close()
+    
+    def count_remaining(self, business_id: int, resume: bool = True) -> int:
+        """Số sản phẩm còn phải reindex của business (tính từ checkpoint nếu resume)"""
+        last_product_id = 0
+        if resume:
+            checkpoint = ReindexCheckpoint(self.checkpoint_dir, business_id).load()
+            if not checkpoint.completed:
+                last_product_id = checkpoint.last_product_id
+        
+        db = SessionLocal()
+        try:
+            return db.execute(
+                select(func.count(Product.id))
+                .where(Product.business_id == business_id, Product.id > last_product_id)
+            ).scalar_one()
+        finally:
+            db.close()
+    
+    def reindex_business(self, business_id: int, resume: bool = True, job: Optional[Any] = None) -> Dict[str, Any]:
+        """
+        Reindex toàn bộ sản phẩm của một business vào namespace business_{id}
+        
+        Args:
+            business_id: ID business
+            resume: True thì chạy tiếp từ checkpoint, False thì reindex lại từ đầu
+            job: Job để cập nhật tiến độ (optional)
+        
+        Returns:
+            Dict: Thống kê (indexed, deleted, error_count, recovered, elapsed_seconds, products_per_second, ...)
+        """
+        namespace = f"business_{business_id}"
+        checkpoint = ReindexCheckpoint(self.checkpoint_dir, business_id)
+        if resume:
+            checkpoint.load()
+            if checkpoint.completed:
+                # Lần trước đã xong: bắt đầu lượt mới thay vì bỏ qua
+                checkpoint.reset()
+        else:
+            checkpoint.reset()
+        
+        if checkpoint.last_product_id:
+            logger.info(
+                f"[Reindex] Business {business_id}: chạy tiếp từ product_id > {checkpoint.last_product_id} "
+                f"({checkpoint.processed} sản phẩm đã xong)"
+            )
+        
+        stats = {'indexed': 0, 'deleted': 0, 'error_count': 0, 'recovered': 0}
+        start_time = time.perf_counter()
+        
+        db = SessionLocal()
+        if checkpoint.started_at is None:
+            checkpoint.started_at = get_db_now(db)
+        embed_executor = ThreadPoolExecutor(max_workers=self.embed_workers, thread_name_prefix='reindex-embed')
+        upsert_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='reindex-upsert')
+        pending: Optional[Future] = None
+        try:
+            stmt = (
+                select(Product)
+                .where(Product.business_id == business_id, Product.id > checkpoint.last_product_id)
+                .order_by(Product.id)
+                .execution_options(yield_per=self.batch_size)
+            )
+            for partition in db.execute(stmt).scalars().partitions():
+                # Identity map của session giữ weakref nên ORM objects của batch cũ được giải phóng
+                rows = [product_to_vector_input(product) for product in partition]
+                
+                batch = self._embed_batch(embed_executor, rows, job)
+                
+                # Chờ batch trước upsert xong rồi mới ghi checkpoint và gửi batch này
+                if pending is not None:
+                    previous, pending = pending, None
+                    self._finish_batch(previous, checkpoint, stats, job, start_time)
+                pending = upsert_executor.submit(self._upsert_batch, namespace, batch)
+            
+            if pending is not None:
+                previous, pending = pending, None
+                self._finish_batch(previous, checkpoint, stats, job, start_time)
+            
+            if checkpoint.failed_ids:
+                self._retry_failed(db, embed_executor, namespace, checkpoint, stats)
+            
+            checkpoint.completed = True
+            checkpoint.save()
+            # Incremental sync chỉ cần xử lý thay đổi kể từ lúc bắt đầu reindex, cộng với sản phẩm vẫn còn lỗi
+            get_product_sync_service().mark_synced(business_id, checkpoint.started_at, failed_ids=checkpoint.failed_ids)
+            get_lexical_index_service().invalidate(business_id)
+        finally:
+            if pending is not None:
+                # Lỗi khi đọc DB / tạo embedding: đợi batch đang upsert xong để checkpoint đúng với dữ liệu đã ghi
+                try:
+                    self._finish_batch(pending, checkpoint, stats, job, start_time)
+                except Exception as e:
+                    logger.error(f"[Reindex] Business {business_id}: upsert batch đang chạy lỗi: {str(e)}")
+            embed_executor.shutdown(wait=True)
+            upsert_executor.shutdown(wait=True)
+            db.close()
+        
+        elapsed = time.perf_counter() - start_time
+        processed = stats['indexed'] + stats['deleted'] + stats['error_count']
+        result = {
+            'business_id': business_id,
+            'namespace': namespace,
+            **stats,
+            'elapsed_seconds': round(elapsed, 3),
+            'products_per_second': round(processed / elapsed, 2) if elapsed > 0 else None
+        }
+        logger.info(
+            f"[Reindex] Business {business_id} xong - {stats['indexed']} indexed, {stats['deleted']} xóa, "
+            f"{stats['error_count']} lỗi ({stats['recovered']} thử lại thành công) - {elapsed:.1f}s ({result['products_per_second']} sản phẩm/giây)"
+        )
+        return result
+    
+    def reindex_all(
+        self,
+        business_ids: Optional[List[int]] = None,
+        resume: bool = True,
+        job: Optional[Any] = None
+    ) -> Dict[str, Any]:
+        """
+        Reindex nhiều business (mặc định tất cả business có sản phẩm)
+        
+        Args:
+            business_ids: List business_id (None = tất cả)
+            resume: True thì chạy tiếp từ checkpoint của từng business
+            job: Job để cập nhật tiến độ (optional)
+        
+        Returns:
+            Dict: Thống kê từng business và tổng throughput
+        """
+        if business_ids is None:
+            business_ids = self.get_business_ids()
+        if job is not None:
+            job.set_total(sum(self.count_remaining(business_id, resume) for business_id in business_ids))
+        
+        start_time = time.perf_counter()
+        results = []
+        for business_id in business_ids:
+            results.append(self.reindex_business(business_id, resume=resume, job=job))
+        
+        elapsed = time.perf_counter() - start_time
+        processed = sum(r['indexed'] + r['deleted'] + r['error_count'] for r in results)
+        return {
+            'businesses': results,
+            'processed': processed,
+            'elapsed_seconds': round(elapsed, 3),
+            'products_per_second': round(processed / elapsed, 2) if elapsed > 0 else None
+        }
+    
+    def _embed_batch(self, executor: ThreadPoolExecutor, rows: List[Dict[str, Any]], job: Optional[Any]) -> Dict[str, Any]:
+        """
+        Tạo vectors cho một batch (song song theo sản phẩm)
+        
+        Returns:
+            Dict: vectors cần upsert, vector IDs cần xóa, số sản phẩm indexed / lỗi, product_id cuối batch
+                và trạng thái sản phẩm cần ghi vào state sync sau khi upsert
+        """
+        futures = []
+        delete_ids: List[str] = []
+        removed_keys: List[str] = []
+        for row in rows:
+            if row['status'] == STATUS_NO_LONGER_SELL:
+                delete_ids.extend(get_product_vector_ids(row['product_id'], row['main_image_url'], row['detail_image_url']))
+                removed_keys.append(str(row['product_id']))
+                continue
+            futures.append((row, executor.submit(build_product_vectors, **row)))
+        
+        vectors = []
+        indexed = 0
+        failed_ids: List[int] = []
+        product_states: Dict[str, Dict[str, Any]] = {}
+        for row, future in futures:
+            product_id = row['product_id']
+            try:
+                product_vectors = future.result()
+                vectors.extend(product_vectors)
+                ids = [vec['id'] for vec in product_vectors]
+                image_urls = extract_image_urls(row['main_image_url'], row['detail_image_url'])
+                if len(ids) < 1 + len(image_urls):
+                    # Có ảnh không tạo được embedding: vẫn upsert phần đã có, không ghi state để lượt sau tạo lại
+                    raise RuntimeError(f"Chỉ tạo được {len(ids)}/{1 + len(image_urls)} vectors")
+                product_states[str(product_id)] = {'hash': product_content_hash(row), 'ids': ids, 'images': image_urls}
+                indexed += 1
+            except Exception as e:
+                failed_ids.append(product_id)
+                logger.error(f"[Reindex] Lỗi tạo vectors cho product {product_id}: {str(e)}")
+                if job is not None:
+                    job.record_error(product_id, str(e))
+        
+        return {
+            'vectors': vectors,
+            'delete_ids': delete_ids,
+            'product_states': product_states,
+            'removed_keys': removed_keys,
+            'indexed': indexed,
+            'deleted': len(removed_keys),
+            'errors': len(failed_ids),
+            'failed_ids': failed_ids,
+            'last_product_id': rows[-1]['product_id']
+        }
+    
+    def _upsert_batch(self, namespace: str, batch: Dict[str, Any]) -> Dict[str, Any]:
+        """Upsert vectors và xóa vectors của sản phẩm ngừng kinh doanh (chạy trên upsert thread)"""
+        pinecone_service = get_pinecone_service()
+        if batch['vectors']:
+            pinecone_service.upsert_vectors_batch(vectors=batch['vectors'], namespace=namespace)
+        if batch['delete_ids']:
+            pinecone_service.delete_vectors(batch['delete_ids'], namespace=namespace)
+        return batch
+    
+    def _finish_batch(
+        self,
+        pending: Future,
+        checkpoint: ReindexCheckpoint,
+        stats: Dict[str, int],
+        job: Optional[Any],
+        start_time: float
+    ):
+        """Đợi batch upsert xong, ghi state sync của sản phẩm, cập nhật thống kê / checkpoint và log throughput"""
+        batch = pending.result()
+        self._record_products(checkpoint.business_id, batch)
+        stats['indexed'] += batch['indexed']
+        stats['deleted'] += batch['deleted']
+        stats['error_count'] += batch['errors']
+        
+        checkpoint.last_product_id = batch['last_product_id']
+        checkpoint.processed += batch['indexed'] + batch['deleted']
+        checkpoint.error_count += batch['errors']
+        checkpoint.failed_ids.extend(batch['failed_ids'])
+        checkpoint.save()
+        
+        if job is not None:
+            job.record_success(batch['indexed'] + batch['deleted'])
+        
+        elapsed = time.perf_counter() - start_time
+        processed = stats['indexed'] + stats['deleted'] + stats['error_count']
+        logger.info(
+            f"[Reindex] Business {checkpoint.business_id}: {processed} sản phẩm "
+            f"(tới product_id {checkpoint.last_product_id}) - "
+            f"{processed / elapsed if elapsed > 0 else 0:.1f} sản phẩm/giây"
+        )
+    
+    def _record_products(self, business_id: int, batch: Dict[str, Any]):
+        """Ghi hash / vector IDs / ảnh của sản phẩm vừa upsert vào state sync (sync sau xóa đúng vectors ảnh cũ)"""
+        get_product_sync_service().record_products(business_id, batch['product_states'], batch['removed_keys'])
+    
+    def _retry_failed(
+        self,
+        db: Any,
+        executor: ThreadPoolExecutor,
+        namespace: str,
+        checkpoint: ReindexCheckpoint,
+        stats: Dict[str, int]
+    ):
+        """
+        Thử lại một lần các sản phẩm lỗi trong lượt reindex (lỗi tạm thời của Vertex AI / Pinecone),
+        checkpoint.failed_ids chỉ còn sản phẩm vẫn lỗi
+        """
+        retry_ids = checkpoint.failed_ids
+        rows = [
+            product_to_vector_input(product)
+            for product in db.execute(
+                select(Product)
+                .where(Product.business_id == checkpoint.business_id, Product.id.in_(retry_ids))
+                .order_by(Product.id)
+            ).scalars()
+        ]
+        if not rows:
+            # Sản phẩm đã bị xóa khỏi DB
+            checkpoint.failed_ids = []
+            return
+        
+        batch = self._upsert_batch(namespace, self._embed_batch(executor, rows, job=None))
+        self._record_products(checkpoint.business_id, batch)
+        # Đã tính vào error_count khi lỗi lần đầu (có thể ở lượt bị gián đoạn trước), ghi riêng số thử lại thành công
+        recovered = batch['indexed'] + batch['deleted']
+        stats['recovered'] += recovered
+        checkpoint.processed += recovered
+        checkpoint.failed_ids = batch['failed_ids']
+        logger.info(
+            f"[Reindex] Business {checkpoint.business_id}: thử lại {len(rows)} sản phẩm lỗi, "
+            f"{recovered} thành công, {len(batch['failed_ids'])} vẫn lỗi"
+        )
@@ -0,0 +1,194 @@
+"""
+Cache câu trả lời cho các câu hỏi lặp lại (thông tin cửa hàng, chính sách giao hàng, chào hỏi)
+
+- Khóa theo (business_id, intent) + version của context (hash): context đổi (sửa thông tin cửa hàng,
+  catalog...) thì toàn bộ câu trả lời cũ của business / intent đó bị bỏ
+- Câu hỏi giống hệt (sau khi chuẩn hóa) trả về ngay, không cần embedding; câu hỏi khác cách diễn đạt
+  được so bằng cosine giữa embedding tin nhắn, dùng lại câu trả lời khi >= RESPONSE_CACHE_SIMILARITY
+- Chỉ bật cho các intent trong RESPONSE_CACHE_INTENTS (câu trả lời không phụ thuộc lịch sử chat)
+"""
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+from config import Config
+from services.embedding_service import get_embedding_service
+from services.lexical_index import tokenize
+from utils.metrics import record_cache
+from utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Số (business, intent) giữ trong cache (LRU)
+_MAX_BUCKETS = 5000
+
+
+def normalize_question(message: str) -> str:
+    """Chuẩn hóa câu hỏi để so khớp chính xác (chữ thường, bỏ dấu câu / khoảng trắng thừa)"""
+    return ' '.join(tokenize(message))
+
+
+class ResponseCache:
+    """Cache câu trả lời theo business / intent / version context và độ tương đồng câu hỏi"""
+    
+    def __init__(
+        self,
+        enabled: Optional[bool] = None,
+        intents=None,
+        similarity: Optional[float] = None,
+        max_entries: Optional[int] = None,
+        ttl_seconds: Optional[int] = None
+    ):
+        self.enabled = Config.RESPONSE_CACHE_ENABLED if enabled is None else enabled
+        self.intents = frozenset(Config.RESPONSE_CACHE_INTENTS if intents is None else intents)
+        self.similarity = Config.RESPONSE_CACHE_SIMILARITY if similarity is None else similarity
+        self.max_entries = Config.RESPONSE_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+        self.ttl_seconds = Config.RESPONSE_CACHE_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        # (business_id, intent) -> {'version', 'entries': OrderedDict[question -> entry], 'matrix', 'keys'}
+        self._buckets: OrderedDict[Tuple[Any, str], Dict[str, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def is_enabled_for(self, intent: str) -> bool:
+        return self.enabled and intent in self.intents
+    
+    def get_or_generate(
+        self,
+        business_id: Any,
+        intent: str,
+        context: str,
+        message: str,
+        generate: Callable[[], str],
+        cacheable: Callable[[str], bool] = lambda response: True
+    ) -> str:
+        """
+        Trả câu trả lời đã cache nếu có câu hỏi đủ giống, ngược lại gọi `generate()` và lưu lại
+        
+        Args:
+            business_id: ID business
+            intent: Intent đã phân loại (intent không bật cache thì gọi thẳng generate)
+            context: Context đưa vào prompt (dùng làm version)
+            message: Tin nhắn của khách
+            generate: Hàm tạo câu trả lời (gọi Gemini)
+            cacheable: False với câu trả lời không được lưu (ví dụ câu báo lỗi)
+        """
+        if not self.is_enabled_for(intent):
+            return generate()
+        
+        question = normalize_question(message)
+        if not question:
+            return generate()
+        key = (business_id, intent)
+        version = hashlib.sha1(context.encode('utf-8')).hexdigest()
+        
+        with span('response_cache.lookup', intent=intent) as lookup_span:
+            response = self._lookup_exact(key, version, question)
+            vector = None
+            if response is None:
+                vector = self._embed(message)
+                if vector is not None:
+                    response, score = self._lookup_similar(key, version, vector)
+                    lookup_span.set_attribute('similarity', round(score, 4))
+            lookup_span.set_attribute('hit', response is not None)
+        
+        record_cache('response', hit=response is not None)
+        if response is not None:
+            logger.info(f"[ResponseCache] Hit business_id={business_id}, intent={intent}")
+            return response
+        
+        response = generate()
+        if cacheable(response):
+            self._store(key, version, question, vector, response)
+        return response
+    
+    def invalidate(self, business_id: Any = None):
+        """Xóa câu trả lời đã cache của business (None: tất cả)"""
+        with self._lock:
+            if business_id is None:
+                self._buckets.clear()
+            else:
+                for key in [key for key in self._buckets if key[0] == business_id]:
+                    self._buckets.pop(key, None)
+    
+    def _get_bucket(self, key: Tuple[Any, str], version: str) -> Optional[Dict[str, Any]]:
+        bucket = self._buckets.get(key)
+        if bucket is None or bucket['version'] != version:
+            return None
+        return bucket
+    
+    def _lookup_exact(self, key: Tuple[Any, str], version: str, question: str) -> Optional[str]:
+        with self._lock:
+            bucket = self._get_bucket(key, version)
+            if bucket is None:
+                return None
+            entry = bucket['entries'].get(question)
+            if entry is None or time.time() >= entry['expire_at']:
+                return None
+            self._buckets.move_to_end(key)
+            return entry['response']
+    
+    def _lookup_similar(self, key: Tuple[Any, str], version: str, vector: np.ndarray) -> Tuple[Optional[str], float]:
+        with self._lock:
+            bucket = self._get_bucket(key, version)
+            if bucket is None:
+                return None, 0.0
+            if bucket['matrix'] is None:
+                entries = [(q, e) for q, e in bucket['entries'].items() if e['vector'] is not None]
+                bucket['keys'] = [q for q, _ in entries]
+                bucket['matrix'] = np.vstack([e['vector'] for _, e in entries]) if entries else np.empty((0, 0))
+            matrix, keys = bucket['matrix'], bucket['keys']
+            if not keys or matrix.shape[1] != vector.shape[0]:
+                return None, 0.0
+            scores = matrix @ vector
+            best = int(np.argmax(scores))
+            entry = bucket['entries'].get(keys[best])
+            score = float(scores[best])
+            if entry is None or score < self.similarity or time.time() >= entry['expire_at']:
+                return None, score
+            self._buckets.move_to_end(key)
+            return entry['response'], score
+    
+    def _store(self, key: Tuple[Any, str], version: str, question: str, vector: Optional[np.ndarray], response: str):
+        with self._lock:
+            bucket = self._get_bucket(key, version)
+            if bucket is None:
+                # Context mới: bỏ toàn bộ câu trả lời của version cũ
+                bucket = {'version': version, 'entries': OrderedDict(), 'matrix': None, 'keys': []}
+                self._buckets[key] = bucket
+            bucket['entries'][question] = {
+                'vector': vector,
+                'response': response,
+                'expire_at': time.time() + self.ttl_seconds
+            }
+            bucket['entries'].move_to_end(question)
+            while len(bucket['entries']) > self.max_entries:
+                bucket['entries'].popitem(last=False)
+            bucket['matrix'] = None
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > _MAX_BUCKETS:
+                self._buckets.popitem(last=False)
+    
+    def _embed(self, message: str) -> Optional[np.ndarray]:
+        try:
+            vector = np.asarray(get_embedding_service().create_embedding(message), dtype=np.float32)
+        except Exception as e:
+            logger.warning(f"[ResponseCache] Không tạo được embedding, bỏ qua so khớp gần đúng: {str(e)}")
+            return None
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+
+# Singleton instance
+_response_cache_instance: Optional[ResponseCache] = None
+
+
+def get_response_cache() -> ResponseCache:
+    """Lấy singleton ResponseCache"""
+    global _response_cache_instance
+    if _response_cache_instance is None:
+        _response_cache_instance = ResponseCache()
+    return _response_cache_instance
@@ -0,0 +1,204 @@
+"""
+Retrieval engine dùng chung cho tìm kiếm sản phẩm bằng vector
+
+Gom phần trước đây lặp lại ở ProductSearchTextContextBuilder, ProductSearchImageContextBuilder
+và API /search: query Pinecone (nhiều query chạy song song), tách product_id từ vector_id,
+gộp theo sản phẩm (giữ score cao nhất) và lấy top-K bằng heap, kèm đo thời gian từng bước.
+"""
+import heapq
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from services.pinecone_service import get_pinecone_service
+from utils.tracing import span, wrap_context
+
+logger = logging.getLogger(__name__)
+
+
+def parse_product_id(vector_id: str, metadata: Optional[Dict[str, Any]] = None) -> Optional[int]:
+    """
+    Lấy product_id từ vector_id ({product_id}_text, {product_id}_image_main, {product_id}_image_{i})
+    hoặc từ metadata nếu vector_id không đúng format
+    
+    Args:
+        vector_id: ID vector trong Pinecone
+        metadata: Metadata của vector (optional)
+    
+    Returns:
+        int: product_id, None nếu không xác định được
+    """
+    head = vector_id.partition('_')[0] if vector_id else ''
+    try:
+        return int(head)
+    except ValueError:
+        pass
+    if metadata and metadata.get('product_id') is not None:
+        try:
+            # Pinecone lưu số dạng float
+            return int(metadata['product_id'])
+        except (TypeError, ValueError):
+            return None
+    return None
+
+
+def dedup_top_k(matches: List[Dict[str, Any]], top_k: int) -> List[Dict[str, Any]]:
+    """
+    Gộp các vector match theo sản phẩm (giữ match có score cao nhất) và lấy top_k sản phẩm
+    
+    Một lượt qua danh sách để lấy match tốt nhất mỗi sản phẩm, sau đó heapq.nlargest
+    (O(n log k)) thay vì sort toàn bộ.
+    
+    Args:
+        matches: Kết quả search_vectors [{'id', 'score', 'metadata'}]
+        top_k: Số sản phẩm tối đa
+    
+    Returns:
+        List[Dict]: [{'product_id', 'vector_id', 'score', 'metadata'}] theo score giảm dần
+    """
+    best: Dict[int, Dict[str, Any]] = {}
+    for match in matches:
+        metadata = match.get('metadata') or {}
+        vector_id = match.get('id', '')
+        product_id = parse_product_id(vector_id, metadata)
+        if product_id is None:
+            logger.warning(f"[Retrieval] Không xác định được product_id từ vector_id '{vector_id}', bỏ qua")
+            continue
+        
+        score = match.get('score') or 0
+        current = best.get(product_id)
+        if current is None or score > current['score']:
+            best[product_id] = {
+                'product_id': product_id,
+                'vector_id': vector_id,
+                'score': score,
+                'metadata': metadata
+            }
+    
+    return heapq.nlargest(top_k, best.values(), key=lambda item: item['score'])
+
+
+class RetrievalService:
+    """Chạy một hoặc nhiều vector query và trả về danh sách sản phẩm đã gộp, xếp hạng"""
+    
+    def __init__(self, max_workers: int = 8):
+        """
+        Args:
+            max_workers: Số query Pinecone chạy song song tối đa
+        """
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='retrieval')
+        self._stats_lock = threading.Lock()
+        self._stats = {'requests': 0, 'queries': 0, 'candidates': 0, 'products': 0, 'errors': 0, 'seconds': 0.0}
+    
+    def retrieve(
+        self,
+        queries: List[Dict[str, Any]],
+        namespace: str,
+        top_k: int,
+        raise_errors: bool = True
+    ) -> List[Dict[str, Any]]:
+        """
+        Chạy các vector query (song song), gộp kết quả theo sản phẩm và lấy top_k
+        
+        Args:
+            queries: List query, mỗi query là dict {'vector', 'index_vector' (optional), 'top_k' (optional),
+                'filter' (optional), 'name' (optional)}
+            namespace: Namespace trong Pinecone
+            top_k: Số sản phẩm trả về
+            raise_errors: True thì raise khi một query lỗi; False thì bỏ qua query lỗi (log warning)
+        
+        Returns:
+            List[Dict]: [{'product_id', 'vector_id', 'score', 'metadata'}] theo score giảm dần
+        """
+        with span('retrieval.retrieve', namespace=namespace, queries=len(queries), top_k=top_k) as retrieve_span:
+            matches = self.search_many(queries, namespace, raise_errors=raise_errors)
+            search_elapsed = retrieve_span.duration
+            
+            products = dedup_top_k(matches, top_k)
+            retrieve_span.set_attribute('candidates', len(matches))
+            retrieve_span.set_attribute('products', len(products))
+        elapsed = retrieve_span.duration
+        
+        with self._stats_lock:
+            self._stats['requests'] += 1
+            self._stats['queries'] += len(queries)
+            self._stats['candidates'] += len(matches)
+            self._stats['products'] += len(products)
+            self._stats['seconds'] += elapsed
+        
+        logger.info(
+            f"[Retrieval] namespace '{namespace}' - {len(queries)} query, {len(matches)} ứng viên -> "
+            f"{len(products)} sản phẩm - search: {search_elapsed:.3f}s, "
+            f"dedup: {elapsed - search_elapsed:.4f}s"
+        )
+        return products
+    
+    def search_many(
+        self,
+        queries: List[Dict[str, Any]],
+        namespace: str,
+        raise_errors: bool = True
+    ) -> List[Dict[str, Any]]:
+        """
+        Chạy nhiều vector query song song, trả về tất cả match (chưa gộp)
+        
+        Args:
+            queries: Xem retrieve()
+            namespace: Namespace trong Pinecone
+            raise_errors: True thì raise khi một query lỗi
+        
+        Returns:
+            List[Dict]: Match của tất cả query
+        """
+        if not queries:
+            return []
+        if len(queries) == 1:
+            outcomes = [self._run_query(queries[0], namespace)]
+        else:
+            futures = [self._executor.submit(wrap_context(self._run_query), query, namespace) for query in queries]
+            outcomes = [future.result() for future in futures]
+        
+        matches = []
+        for query, (results, error) in zip(queries, outcomes):
+            if error is not None:
+                with self._stats_lock:
+                    self._stats['errors'] += 1
+                if raise_errors:
+                    raise error
+                logger.warning(f"[Retrieval] Query '{query.get('name', 'vector')}' lỗi: {str(error)}")
+                continue
+            matches.extend(results)
+        return matches
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Thống kê tích lũy (số request, query, ứng viên, lỗi, thời gian trung bình)"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['avg_seconds'] = stats['seconds'] / stats['requests'] if stats['requests'] else 0.0
+        return stats
+    
+    def _run_query(self, query: Dict[str, Any], namespace: str):
+        try:
+            results = get_pinecone_service().search_vectors(
+                query_vector=query['vector'],
+                namespace=namespace,
+                top_k=query.get('top_k', 10),
+                filter=query.get('filter'),
+                index_vector=query.get('index_vector')
+            )
+            return results, None
+        except Exception as e:
+            return None, e
+
+
+# Lazy singleton
+_retrieval_service_instance: Optional[RetrievalService] = None
+
+
+def get_retrieval_service() -> RetrievalService:
+    """Lấy instance RetrievalService (lazy init, singleton)."""
+    global _retrieval_service_instance
+    if _retrieval_service_instance is None:
+        _retrieval_service_instance = RetrievalService()
+    return _retrieval_service_instance
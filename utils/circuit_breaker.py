@@ -0,0 +1,212 @@
+"""
+Circuit breaker cho dịch vụ ngoài (Gemini, Vertex AI, Pinecone)
+
+- CLOSED: gọi bình thường, đếm thành công / lỗi trong cửa sổ CIRCUIT_WINDOW_SECONDS giây gần nhất
+- Tỉ lệ lỗi >= CIRCUIT_FAILURE_RATE (khi có ít nhất CIRCUIT_MIN_CALLS lời gọi) -> OPEN: từ chối ngay bằng
+  CircuitOpenError trong CIRCUIT_OPEN_SECONDS giây, caller chuyển sang fallback thay vì chờ timeout
+- Hết thời gian OPEN -> HALF_OPEN: cho một lời gọi thử; thành công thì CLOSED, lỗi thì OPEN lại
+- Lỗi phía client (HTTP 4xx trừ 408 / 429) không tính là lỗi của dịch vụ
+- Lỗi / timeout xảy ra khi deadline của request (utils/deadline.py) đã hết không được tính: timeout bị kẹp
+  theo thời gian còn lại của request chứ không phải dịch vụ chậm (request sát deadline dồn dập lúc tải cao
+  không được làm mở circuit khi dịch vụ vẫn bình thường)
+"""
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple, Type
+
+from config import Config
+from utils.deadline import remaining
+from utils.metrics import CIRCUIT_STATE, record_circuit_rejected
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+# Sai số khi so thời điểm lỗi với deadline của request (timeout bằng đúng thời gian còn lại)
+_DEADLINE_SLACK_SECONDS = 0.05
+
+
+class CircuitOpenError(Exception):
+    """Circuit đang mở: dịch vụ được coi là đang lỗi, không gọi"""
+    
+    def __init__(self, name: str):
+        super().__init__(f"Dịch vụ '{name}' đang tạm ngắt (circuit open)")
+        self.name = name
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    for attr in ('code', 'status'):
+        value = getattr(error, attr, None)
+        try:
+            if value is not None:
+                return int(value)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+class CircuitBreaker:
+    """Circuit breaker của một dịch vụ"""
+    
+    def __init__(
+        self,
+        name: str,
+        failure_rate: Optional[float] = None,
+        min_calls: Optional[int] = None,
+        window_seconds: Optional[float] = None,
+        open_seconds: Optional[float] = None,
+        ignore: Tuple[Type[BaseException], ...] = ()
+    ):
+        """
+        Args:
+            name: Tên dịch vụ (label metric)
+            failure_rate: Tỉ lệ lỗi để mở circuit (0..1)
+            min_calls: Số lời gọi tối thiểu trong cửa sổ trước khi xét tỉ lệ lỗi
+            window_seconds: Độ dài cửa sổ đếm lỗi
+            open_seconds: Thời gian mở trước khi cho lời gọi thử
+            ignore: Loại exception không tính là lỗi của dịch vụ (ví dụ hết quota phía client)
+        """
+        self.name = name
+        self.failure_rate = Config.CIRCUIT_FAILURE_RATE if failure_rate is None else failure_rate
+        self.min_calls = Config.CIRCUIT_MIN_CALLS if min_calls is None else min_calls
+        self.window_seconds = Config.CIRCUIT_WINDOW_SECONDS if window_seconds is None else window_seconds
+        self.open_seconds = Config.CIRCUIT_OPEN_SECONDS if open_seconds is None else open_seconds
+        self.ignore = ignore
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._outcomes: Deque[Tuple[float, bool]] = deque()  # (thời điểm, lỗi?)
+        self._failures = 0
+        self._lock = threading.Lock()
+        CIRCUIT_STATE.labels(dependency=name).set(_STATE_VALUES[CLOSED])
+    
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state(time.monotonic())
+    
+    def is_open(self) -> bool:
+        """True nếu lời gọi lúc này sẽ bị từ chối (để caller chọn fallback trước khi gọi)"""
+        if not Config.CIRCUIT_BREAKER_ENABLED:
+            return False
+        with self._lock:
+            state = self._current_state(time.monotonic())
+            return state == OPEN or (state == HALF_OPEN and self._probe_in_flight)
+    
+    def call(self, fn: Callable[[], Any]) -> Any:
+        """
+        Gọi `fn()` qua circuit breaker
+        
+        Raises:
+            CircuitOpenError: Circuit đang mở
+        """
+        if not Config.CIRCUIT_BREAKER_ENABLED:
+            return fn()
+        
+        probe = self._before_call()
+        try:
+            result = fn()
+        except Exception as e:
+            self._after_call(probe, failed=self._is_failure(e))
+            raise
+        except BaseException:
+            self._after_call(probe, failed=None)
+            raise
+        self._after_call(probe, failed=False)
+        return result
+    
+    def reset(self):
+        """Đóng circuit và xóa số liệu"""
+        with self._lock:
+            self._outcomes.clear()
+            self._failures = 0
+            self._probe_in_flight = False
+            self._set_state(CLOSED)
+    
+    def _is_failure(self, error: Exception) -> Optional[bool]:
+        """True = lỗi của dịch vụ, False = dịch vụ vẫn trả lời (lỗi phía client), None = không kết luận được"""
+        if isinstance(error, self.ignore):
+            return None
+        left = remaining()
+        if left is not None and left <= _DEADLINE_SLACK_SECONDS:
+            # Hết deadline của request: timeout do ngân sách của caller, không phải do dịch vụ
+            return None
+        code = _status_code(error)
+        return not (code is not None and 400 <= code < 500 and code not in (408, 429))
+    
+    def _current_state(self, now: float) -> str:
+        if self._state == OPEN and now - self._opened_at >= self.open_seconds:
+            self._set_state(HALF_OPEN)
+        return self._state
+    
+    def _set_state(self, state: str):
+        if state != self._state:
+            self._state = state
+            CIRCUIT_STATE.labels(dependency=self.name).set(_STATE_VALUES[state])
+    
+    def _before_call(self) -> bool:
+        """Returns: True nếu đây là lời gọi thử ở trạng thái HALF_OPEN"""
+        with self._lock:
+            state = self._current_state(time.monotonic())
+            if state == CLOSED:
+                return False
+            if state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+        record_circuit_rejected(self.name)
+        raise CircuitOpenError(self.name)
+    
+    def _after_call(self, probe: bool, failed: Optional[bool]):
+        """failed = None: không ghi nhận (lời gọi thử được trả lại, trạng thái giữ nguyên)"""
+        now = time.monotonic()
+        with self._lock:
+            if probe:
+                self._probe_in_flight = False
+                if failed is None:
+                    return
+                if failed:
+                    self._open(now)
+                else:
+                    self._outcomes.clear()
+                    self._failures = 0
+                    self._set_state(CLOSED)
+                return
+            if self._state != CLOSED or failed is None:
+                return
+            self._outcomes.append((now, failed))
+            self._failures += failed
+            while self._outcomes and now - self._outcomes[0][0] > self.window_seconds:
+                _, old_failed = self._outcomes.popleft()
+                self._failures -= old_failed
+            total = len(self._outcomes)
+            if failed and total >= self.min_calls and self._failures / total >= self.failure_rate:
+                self._open(now)
+    
+    def _open(self, now: float):
+        self._opened_at = now
+        self._set_state(OPEN)
+
+
+# Một circuit breaker cho mỗi dịch vụ, dùng chung trong process
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(name: str, ignore: Tuple[Type[BaseException], ...] = ()) -> CircuitBreaker:
+    """Lấy circuit breaker theo tên dịch vụ ('gemini', 'vertex', 'pinecone'); `ignore` chỉ dùng khi tạo mới"""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(name)
+            if breaker is None:
+                breaker = CircuitBreaker(name, ignore=ignore)
+                _breakers[name] = breaker
+    return breaker
+
+
+def get_circuit_states() -> List[Dict[str, Any]]:
+    """Trạng thái các circuit (cho health check)"""
+    return [{'dependency': name, 'state': breaker.state} for name, breaker in sorted(_breakers.items())]
@@ -0,0 +1,107 @@
+"""
+Giới hạn số request đồng thời tự điều chỉnh theo latency (kiểu gradient, tương tự Netflix concurrency-limits)
+
+- latency dài hạn (EMA chậm) ~ latency khi hệ thống chưa quá tải; latency của request vừa xong là mẫu ngắn hạn
+- gradient = tolerance * dài hạn / ngắn hạn (kẹp trong [0.5, 1]): latency tăng do xếp hàng -> limit giảm,
+  latency ổn định -> limit tăng thêm sqrt(limit) để dò sức chứa
+- Request lỗi (exception / HTTP 5xx) giảm limit theo cấp nhân (AIMD)
+- Vượt limit thì từ chối ngay (load shedding), không xếp hàng
+"""
+import math
+import threading
+from typing import Optional
+
+from config import Config
+from utils.metrics import CONCURRENCY_LIMIT, REQUESTS_IN_FLIGHT, record_shed
+
+# Hệ số giảm limit khi request lỗi
+_DROP_BACKOFF = 0.9
+# Số mẫu của EMA latency dài hạn
+_LONG_WINDOW = 600
+
+
+class AdaptiveConcurrencyLimiter:
+    """Số request đồng thời tối đa của một route, điều chỉnh sau mỗi request"""
+    
+    def __init__(
+        self,
+        name: str,
+        initial_limit: Optional[int] = None,
+        min_limit: Optional[int] = None,
+        max_limit: Optional[int] = None,
+        tolerance: Optional[float] = None,
+        smoothing: float = 0.2
+    ):
+        """
+        Args:
+            name: Tên route (label metric)
+            initial_limit: Limit ban đầu
+            min_limit / max_limit: Khoảng limit được phép
+            tolerance: Latency được phép tăng tới tolerance lần latency dài hạn trước khi giảm limit
+            smoothing: Tỉ lệ áp dụng limit mới mỗi lần cập nhật (0..1)
+        """
+        self.name = name
+        self.min_limit = Config.CONCURRENCY_LIMIT_MIN if min_limit is None else min_limit
+        self.max_limit = Config.CONCURRENCY_LIMIT_MAX if max_limit is None else max_limit
+        self.tolerance = Config.CONCURRENCY_LIMIT_TOLERANCE if tolerance is None else tolerance
+        self.smoothing = smoothing
+        initial = Config.CONCURRENCY_LIMIT_INITIAL if initial_limit is None else initial_limit
+        self._limit = float(min(self.max_limit, max(self.min_limit, initial)))
+        self._in_flight = 0
+        self._long_latency: Optional[float] = None
+        self._lock = threading.Lock()
+        CONCURRENCY_LIMIT.labels(route=name).set(self.limit)
+    
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+    
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+    
+    def try_acquire(self) -> bool:
+        """Nhận request nếu còn chỗ; False = cần từ chối"""
+        with self._lock:
+            if self._in_flight >= int(self._limit):
+                record_shed(self.name)
+                return False
+            self._in_flight += 1
+        REQUESTS_IN_FLIGHT.labels(route=self.name).inc()
+        return True
+    
+    def release(self, latency: float, dropped: bool = False):
+        """
+        Trả chỗ sau khi request xong và cập nhật limit
+        
+        Args:
+            latency: Thời gian xử lý request (giây)
+            dropped: True nếu request lỗi
+        """
+        with self._lock:
+            in_flight = self._in_flight
+            self._in_flight -= 1
+            self._update(latency, in_flight, dropped)
+            limit = self.limit
+        REQUESTS_IN_FLIGHT.labels(route=self.name).dec()
+        CONCURRENCY_LIMIT.labels(route=self.name).set(limit)
+    
+    def _update(self, latency: float, in_flight: int, dropped: bool):
+        if dropped:
+            new_limit = self._limit * _DROP_BACKOFF
+        else:
+            latency = max(latency, 1e-6)
+            if self._long_latency is None:
+                self._long_latency = latency
+            else:
+                self._long_latency += (latency - self._long_latency) / _LONG_WINDOW
+                # Latency dài hạn bị kéo lên trong thời gian quá tải: hạ dần khi latency đã giảm lại
+                if self._long_latency > 2 * latency:
+                    self._long_latency *= 0.95
+            # Ít request đang chạy: latency không phản ánh limit, giữ nguyên
+            if in_flight < self._limit / 2:
+                return
+            gradient = max(0.5, min(1.0, self.tolerance * self._long_latency / latency))
+            new_limit = self._limit * gradient + math.sqrt(self._limit)
+        new_limit = self._limit * (1 - self.smoothing) + new_limit * self.smoothing
+        self._limit = float(min(self.max_limit, max(self.min_limit, new_limit)))
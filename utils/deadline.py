@@ -0,0 +1,96 @@
+"""
+Deadline theo request, truyền xuống các bước (intent, embedding, vector search, LLM) qua contextvars
+
+- `with deadline_scope(Config.CHAT_DEADLINE_SECONDS)`: đặt deadline cho request (lồng nhau thì lấy deadline sớm hơn)
+- `stage_timeout(Config.STAGE_TIMEOUT_EMBEDDING_SECONDS, 'embedding')`: timeout của một bước
+  = min(ngân sách của bước, thời gian còn lại của request); hết thời gian thì raise DeadlineExceeded
+- `run_with_timeout(fn, timeout, stage)`: cho client không hỗ trợ timeout (google-generativeai 0.3.x),
+  chạy lời gọi trên thread pool và bỏ chờ khi quá hạn (lời gọi vẫn chạy nốt ở thread nền)
+- contextvars được copy sang thread pool qua utils.tracing.wrap_context nên deadline đi theo request
+"""
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional
+
+from config import Config
+from utils.metrics import record_deadline_exceeded
+from utils.tracing import wrap_context
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar('request_deadline', default=None)
+
+# Thread pool cho lời gọi không có timeout phía client (dùng chung cho mọi request)
+_timeout_executor = ThreadPoolExecutor(max_workers=Config.DEADLINE_EXECUTOR_WORKERS, thread_name_prefix='deadline')
+
+
+class DeadlineExceeded(Exception):
+    """Bước xử lý vượt quá ngân sách thời gian / deadline của request"""
+    
+    def __init__(self, stage: str, message: str = ""):
+        super().__init__(message or f"Bước '{stage}' vượt quá thời gian cho phép")
+        self.stage = stage
+
+
+@contextmanager
+def deadline_scope(seconds: Optional[float]) -> Iterator[Optional[float]]:
+    """
+    Đặt deadline (time.monotonic) cho phần code bên trong
+    
+    Args:
+        seconds: Thời gian tối đa; None / <= 0 = giữ deadline hiện tại (không giới hạn nếu chưa có)
+    """
+    current = _deadline.get()
+    deadline = current
+    if seconds is not None and seconds > 0:
+        deadline = time.monotonic() + seconds
+        if current is not None:
+            deadline = min(deadline, current)
+    token = _deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _deadline.reset(token)
+
+
+def get_deadline() -> Optional[float]:
+    """Deadline (time.monotonic) của request hiện tại, None nếu không có"""
+    return _deadline.get()
+
+
+def remaining() -> Optional[float]:
+    """Số giây còn lại tới deadline (có thể âm), None nếu không có deadline"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def stage_timeout(budget: float, stage: str) -> float:
+    """
+    Timeout cho một bước: min(budget, thời gian còn lại)
+    
+    Raises:
+        DeadlineExceeded: Request đã hết thời gian trước khi bắt đầu bước này
+    """
+    left = remaining()
+    if left is None:
+        return budget
+    if left <= 0:
+        record_deadline_exceeded(stage)
+        raise DeadlineExceeded(stage, f"Hết thời gian của request trước bước '{stage}'")
+    return min(budget, left)
+
+
+def run_with_timeout(fn: Callable[[], Any], timeout: float, stage: str) -> Any:
+    """
+    Chạy `fn()` và chờ tối đa `timeout` giây
+    
+    Raises:
+        DeadlineExceeded: Quá timeout (lời gọi không bị hủy, kết quả bị bỏ)
+    """
+    future = _timeout_executor.submit(wrap_context(fn))
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        future.cancel()
+        record_deadline_exceeded(stage)
+        raise DeadlineExceeded(stage, f"Bước '{stage}' quá {timeout:.1f}s")
@@ -0,0 +1,185 @@
+"""
+HTTP client dùng chung (connection pooling, keep-alive) và cache conditional request cho ảnh
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def _create_session() -> requests.Session:
+    """
+    Tạo requests.Session với connection pool giới hạn theo host
+    
+    - pool_connections: số host (ví dụ res.cloudinary.com) được giữ pool riêng
+    - pool_maxsize: số kết nối keep-alive tối đa mỗi host; pool_block=True để không mở vượt giới hạn
+    - Retry nhẹ cho lỗi 502/503/504 của CDN
+    """
+    retry = Retry(
+        total=2,
+        backoff_factor=0.3,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset(['GET', 'HEAD'])
+    )
+    adapter = HTTPAdapter(
+        pool_connections=Config.HTTP_POOL_CONNECTIONS,
+        pool_maxsize=Config.HTTP_POOL_MAXSIZE,
+        pool_block=True,
+        max_retries=retry
+    )
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class ConditionalCache:
+    """
+    Cache trên đĩa cho response GET kèm validator (ETag / Last-Modified)
+    
+    Mỗi entry gồm 2 file trong `cache_dir`: <key>.json (validators) và <key>.bin (nội dung đã xử lý).
+    Lần tải sau gửi If-None-Match / If-Modified-Since; nếu server trả 304 thì dùng lại nội dung cache.
+    """
+    
+    def __init__(self, cache_dir: str, max_entries: int = 20000):
+        """
+        Args:
+            cache_dir: Thư mục lưu cache
+            max_entries: Số entry tối đa, vượt quá sẽ xóa các entry cũ nhất
+        """
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._puts_since_prune = 0
+        os.makedirs(cache_dir, exist_ok=True)
+    
+    @staticmethod
+    def make_key(url: str, variant: str = '') -> str:
+        """Key cache theo URL và biến thể xử lý (ví dụ kích thước thu nhỏ)"""
+        return hashlib.sha256(f"{url}|{variant}".encode('utf-8')).hexdigest()
+    
+    def _paths(self, key: str) -> Tuple[str, str]:
+        base = os.path.join(self.cache_dir, key)
+        return f"{base}.json", f"{base}.bin"
+    
+    def get(self, key: str) -> Optional[Tuple[dict, bytes]]:
+        """Lấy (validators, data) hoặc None nếu chưa có"""
+        meta_path, data_path = self._paths(key)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                validators = json.load(f)
+            with open(data_path, 'rb') as f:
+                data = f.read()
+            return validators, data
+        except (OSError, ValueError):
+            return None
+    
+    def put(self, key: str, etag: Optional[str], last_modified: Optional[str], data: bytes):
+        """Lưu entry nếu response có validator (không có validator thì không thể revalidate)"""
+        if not etag and not last_modified:
+            return
+        
+        meta_path, data_path = self._paths(key)
+        try:
+            # Ghi ra file tạm rồi replace để worker khác không đọc phải file ghi dở
+            tmp_data = f"{data_path}.{threading.get_ident()}.tmp"
+            with open(tmp_data, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_data, data_path)
+            
+            tmp_meta = f"{meta_path}.{threading.get_ident()}.tmp"
+            with open(tmp_meta, 'w', encoding='utf-8') as f:
+                json.dump({'etag': etag, 'last_modified': last_modified}, f)
+            os.replace(tmp_meta, meta_path)
+        except OSError as e:
+            logger.warning(f"[HTTP Cache] Không thể ghi cache {key}: {str(e)}")
+            return
+        
+        with self._lock:
+            self._puts_since_prune += 1
+            should_prune = self._puts_since_prune >= 500
+            if should_prune:
+                self._puts_since_prune = 0
+        if should_prune:
+            self._prune()
+    
+    def touch(self, key: str):
+        """Đánh dấu entry vừa được dùng (phục vụ xóa entry cũ nhất)"""
+        meta_path, _ = self._paths(key)
+        try:
+            os.utime(meta_path, None)
+        except OSError:
+            pass
+    
+    @staticmethod
+    def conditional_headers(validators: dict) -> dict:
+        """Header conditional request từ validators đã lưu"""
+        headers = {}
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+        return headers
+    
+    def _prune(self):
+        """Xóa các entry ít dùng gần đây nhất khi vượt max_entries"""
+        try:
+            metas = [
+                entry for entry in os.scandir(self.cache_dir)
+                if entry.name.endswith('.json')
+            ]
+            excess = len(metas) - self.max_entries
+            if excess <= 0:
+                return
+            metas.sort(key=lambda entry: entry.stat().st_mtime)
+            for entry in metas[:excess]:
+                meta_path, data_path = self._paths(entry.name[:-len('.json')])
+                for path in (meta_path, data_path):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+            logger.info(f"[HTTP Cache] Đã xóa {excess} entry cũ trong {self.cache_dir}")
+        except OSError as e:
+            logger.warning(f"[HTTP Cache] Lỗi khi dọn cache: {str(e)}")
+
+
+# Lazy singleton: dùng chung session (pool kết nối) và cache cho toàn app
+_http_session: Optional[requests.Session] = None
+_image_cache: Optional[ConditionalCache] = None
+_init_lock = threading.Lock()
+
+
+def get_http_session() -> requests.Session:
+    """Lấy requests.Session dùng chung (lazy init, singleton)."""
+    global _http_session
+    if _http_session is None:
+        with _init_lock:
+            if _http_session is None:
+                _http_session = _create_session()
+    return _http_session
+
+
+def get_image_cache() -> Optional[ConditionalCache]:
+    """Lấy cache ảnh dùng chung, None nếu tắt (IMAGE_CACHE_DIR rỗng)."""
+    global _image_cache
+    if not Config.IMAGE_CACHE_DIR:
+        return None
+    if _image_cache is None:
+        with _init_lock:
+            if _image_cache is None:
+                _image_cache = ConditionalCache(
+                    Config.IMAGE_CACHE_DIR,
+                    max_entries=Config.IMAGE_CACHE_MAX_ENTRIES
+                )
+    return _image_cache
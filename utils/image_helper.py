@@ -0,0 +1,145 @@
+"""
+Helper tải và chuẩn bị ảnh để tạo embedding
+"""
+import io
+import logging
+from typing import Optional
+
+import requests
+from PIL import Image, ImageFile
+
+from utils.http_client import ConditionalCache
+from utils.metrics import record_cache
+
+logger = logging.getLogger(__name__)
+
+
+class ImageDownloadError(ValueError):
+    """Ảnh không hợp lệ: vượt giới hạn dung lượng, bị cắt cụt hoặc không decode được"""
+    pass
+
+
+def download_and_prepare_image(
+    image_url: str,
+    max_bytes: int,
+    max_side: int,
+    jpeg_quality: int = 85,
+    timeout: int = 10,
+    session: Optional[requests.Session] = None,
+    cache: Optional[ConditionalCache] = None
+) -> bytes:
+    """
+    Tải ảnh dạng stream, decode dần trong lúc tải, thu nhỏ và nén lại thành JPEG
+    
+    - Kiểm tra Content-Length trước khi tải, từ chối ảnh vượt `max_bytes` thay vì cắt cụt
+    - Decode bằng ImageFile.Parser ngay khi từng chunk về (không giữ toàn bộ bytes gốc)
+    - Ảnh bị cắt cụt (kết nối đứt giữa chừng) sẽ bị từ chối khi đóng parser
+    - Có cache: gửi If-None-Match / If-Modified-Since, server trả 304 thì dùng lại JPEG đã xử lý
+    
+    Args:
+        image_url: URL của ảnh
+        max_bytes: Dung lượng tối đa được phép tải
+        max_side: Cạnh dài tối đa sau khi thu nhỏ (độ phân giải model embedding dùng được)
+        jpeg_quality: Chất lượng JPEG khi nén lại
+        timeout: Timeout request (giây)
+        session: requests.Session dùng chung (keep-alive); None thì dùng requests.get
+        cache: Cache conditional request; None thì luôn tải lại
+    
+    Returns:
+        bytes: Ảnh JPEG đã thu nhỏ
+    
+    Raises:
+        ImageDownloadError: Nếu ảnh vượt giới hạn, bị cắt cụt hoặc không phải ảnh hợp lệ
+    """
+    cache_key = None
+    cached = None
+    headers = {}
+    if cache is not None:
+        cache_key = cache.make_key(image_url, f"{max_side}:{jpeg_quality}")
+        cached = cache.get(cache_key)
+        if cached is not None:
+            headers = cache.conditional_headers(cached[0])
+    
+    http = session if session is not None else requests
+    with http.get(image_url, timeout=timeout, stream=True, headers=headers) as response:
+        if response.status_code == 304 and cached is not None:
+            cache.touch(cache_key)
+            logger.debug(f"[Image] 304 Not Modified, dùng cache: {image_url}")
+            record_cache('image', hit=True)
+            return cached[1]
+        if cache is not None:
+            record_cache('image', hit=False)
+        response.raise_for_status()
+        
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        content_length = response.headers.get('Content-Length')
+        if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+            raise ImageDownloadError(
+                f"Ảnh có dung lượng {content_length} bytes vượt giới hạn {max_bytes} bytes"
+            )
+        
+        parser = ImageFile.Parser()
+        total = 0
+        for chunk in response.iter_content(chunk_size=65536):
+            if not chunk:
+                continue
+            total += len(chunk)
+            if total > max_bytes:
+                raise ImageDownloadError(f"Ảnh vượt giới hạn {max_bytes} bytes")
+            parser.feed(chunk)
+    
+    if total == 0:
+        raise ImageDownloadError("Không có dữ liệu ảnh")
+    
+    try:
+        image = parser.close()
+    except (OSError, SyntaxError) as e:
+        raise ImageDownloadError(f"Ảnh bị cắt cụt hoặc không hợp lệ: {str(e)}")
+    
+    encoded = encode_image_for_embedding(image, max_side, jpeg_quality, source_bytes=total)
+    if cache is not None:
+        cache.put(cache_key, etag, last_modified, encoded)
+    return encoded
+
+
+def encode_image_for_embedding(
+    image: Image.Image,
+    max_side: int,
+    jpeg_quality: int = 85,
+    source_bytes: int = 0
+) -> bytes:
+    """
+    Thu nhỏ ảnh về cạnh dài `max_side` (giữ tỉ lệ) và nén lại thành JPEG
+    
+    Args:
+        image: Ảnh đã decode
+        max_side: Cạnh dài tối đa
+        jpeg_quality: Chất lượng JPEG
+        source_bytes: Dung lượng ảnh gốc (chỉ để log)
+    
+    Returns:
+        bytes: Ảnh JPEG
+    """
+    original_size = image.size
+    if max(image.size) > max_side:
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+    
+    if image.mode != 'RGB':
+        # Ảnh có alpha: ghép lên nền trắng thay vì để nền đen khi bỏ kênh alpha
+        if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+            rgba = image.convert('RGBA')
+            background = Image.new('RGB', rgba.size, (255, 255, 255))
+            background.paste(rgba, mask=rgba.split()[-1])
+            image = background
+        else:
+            image = image.convert('RGB')
+    
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=jpeg_quality, optimize=True)
+    encoded = output.getvalue()
+    
+    logger.debug(
+        f"[Image] {original_size} ({source_bytes} bytes) -> {image.size} ({len(encoded)} bytes JPEG)"
+    )
+    return encoded
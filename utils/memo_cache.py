@@ -0,0 +1,145 @@
+"""
+Memo cache: hash(input) -> kết quả, có TTL và giới hạn số entry
+
+- Tầng RAM: LRU trong process
+- Tầng đĩa (tùy chọn): mỗi entry một file JSON trong `disk_dir`, ghi file tạm rồi replace nên nhiều
+  worker trên cùng máy dùng chung được; entry ít dùng nhất bị xóa khi vượt `disk_max_entries`
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Số lần put giữa hai lần dọn thư mục cache
+_PRUNE_EVERY_PUTS = 500
+
+
+class MemoCache:
+    """Cache kết quả theo key đã hash, giá trị phải serialize được bằng JSON nếu bật tầng đĩa"""
+    
+    def __init__(
+        self,
+        max_entries: int,
+        ttl_seconds: int,
+        disk_dir: Optional[str] = None,
+        disk_max_entries: int = 50000
+    ):
+        """
+        Args:
+            max_entries: Số entry tối đa trong RAM
+            ttl_seconds: Thời gian sống của entry
+            disk_dir: Thư mục lưu entry (None / rỗng = chỉ dùng RAM)
+            disk_max_entries: Số file tối đa trong disk_dir
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_dir = disk_dir or None
+        self.disk_max_entries = disk_max_entries
+        self._entries: OrderedDict[str, Tuple[Any, float]] = OrderedDict()  # key -> (value, expire_at)
+        self._lock = threading.Lock()
+        self._puts_since_prune = 0
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+    
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        """Key từ các thành phần đầu vào (model, call site, prompt, config...)"""
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(str(part).encode('utf-8'))
+            digest.update(b'\x00')
+        return digest.hexdigest()
+    
+    def get(self, key: str) -> Tuple[bool, Any]:
+        """
+        Returns:
+            Tuple[bool, Any]: (found, value)
+        """
+        now = time.time()
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                if now < cached[1]:
+                    self._entries.move_to_end(key)
+                    return True, cached[0]
+                self._entries.pop(key, None)
+        
+        if self.disk_dir:
+            entry = self._read_disk(key)
+            if entry is not None and now < entry['expire_at']:
+                with self._lock:
+                    self._set(key, entry['value'], entry['expire_at'])
+                return True, entry['value']
+        return False, None
+    
+    def put(self, key: str, value: Any):
+        expire_at = time.time() + self.ttl_seconds
+        with self._lock:
+            self._set(key, value, expire_at)
+        if self.disk_dir:
+            self._write_disk(key, value, expire_at)
+    
+    def clear(self):
+        """Xóa tầng RAM (tầng đĩa tự hết hạn theo TTL)"""
+        with self._lock:
+            self._entries.clear()
+    
+    def _set(self, key: str, value: Any, expire_at: float):
+        self._entries[key] = (value, expire_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+    
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.json")
+    
+    def _read_disk(self, key: str) -> Optional[dict]:
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    def _write_disk(self, key: str, value: Any, expire_at: float):
+        path = self._path(key)
+        try:
+            # Ghi ra file tạm rồi replace để worker khác không đọc phải file ghi dở
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'expire_at': expire_at, 'value': value}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"[Memo] Không thể ghi cache {key}: {str(e)}")
+            return
+        
+        with self._lock:
+            self._puts_since_prune += 1
+            should_prune = self._puts_since_prune >= _PRUNE_EVERY_PUTS
+            if should_prune:
+                self._puts_since_prune = 0
+        if should_prune:
+            self._prune_disk()
+    
+    def _prune_disk(self):
+        """Xóa file hết hạn và file cũ nhất khi vượt disk_max_entries"""
+        try:
+            now = time.time()
+            files = [entry for entry in os.scandir(self.disk_dir) if entry.name.endswith('.json')]
+            # mtime ~ thời điểm ghi, entry ghi trước TTL đã hết hạn
+            expired = [entry for entry in files if entry.stat().st_mtime + self.ttl_seconds < now]
+            alive = [entry for entry in files if entry.stat().st_mtime + self.ttl_seconds >= now]
+            alive.sort(key=lambda entry: entry.stat().st_mtime)
+            excess = max(0, len(alive) - self.disk_max_entries)
+            for entry in expired + alive[:excess]:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+        except OSError as e:
+            logger.warning(f"[Memo] Lỗi khi dọn cache {self.disk_dir}: {str(e)}")
@@ -0,0 +1,227 @@
+"""
+Prometheus metrics cho các lời gọi ra ngoài (Gemini, Vertex AI, Pinecone), cache và DB
+
+- Histogram `external_call_duration_seconds{operation, business, intent, outcome}` cho từng hàm
+  gọi dịch vụ ngoài (gắn bằng decorator `@observe_call('create_embedding')`)
+- Counter `cache_requests_total{cache, result}`: hit ratio = hit / (hit + miss)
+- Histogram `llm_queue_wait_seconds{priority}` và Counter `llm_throttle_events_total{event}` cho hàng đợi
+  quota Gemini (services/gemini_scheduler.py)
+- Gauge `concurrency_limit{route}`, `requests_in_flight{route}` và Counter `requests_shed_total{route}`
+  cho giới hạn đồng thời của route chat / search (utils/concurrency_limiter.py)
+- Counter `deadline_exceeded_total{stage}`: bước bị bỏ do hết ngân sách thời gian (utils/deadline.py)
+- Gauge `circuit_breaker_state{dependency}` và Counter `circuit_breaker_rejected_total{dependency}`
+  cho circuit breaker của Gemini / Vertex AI / Pinecone (utils/circuit_breaker.py)
+- Counter `db_queries_total{operation, business, intent}` và Histogram `db_query_duration_seconds{operation}`
+  qua event SQLAlchemy
+- Label business / intent lấy từ context của request (`set_request_labels`), giới hạn số giá trị
+  để không bùng nổ số time series: business ngoài METRICS_MAX_BUSINESS_LABELS giá trị đầu tiên
+  được gộp thành 'other', intent không thuộc danh sách đã biết cũng thành 'other'
+"""
+import contextvars
+import functools
+import threading
+import time
+from typing import Callable, Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from config import Config
+
+# Intent hợp lệ (khớp context builder trong ChatOrchestrator)
+KNOWN_INTENTS = frozenset({
+    'greetings', 'store_info', 'policy_shipping', 'product_search_text', 'product_search_image',
+    'product_usage', 'others', 'place_order', 'history_inquiry'
+})
+
+# Bucket (giây): LLM/embedding từ vài chục ms tới vài chục giây
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+DB_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+EXTERNAL_CALL_SECONDS = Histogram(
+    'external_call_duration_seconds',
+    'Thời gian gọi dịch vụ ngoài (Gemini, Vertex AI, Pinecone)',
+    ['operation', 'business', 'intent', 'outcome'],
+    buckets=LATENCY_BUCKETS
+)
+CACHE_REQUESTS = Counter(
+    'cache_requests_total',
+    'Số lần tra cache theo kết quả hit/miss',
+    ['cache', 'result']
+)
+DB_QUERIES = Counter(
+    'db_queries_total',
+    'Số câu lệnh SQL đã chạy',
+    ['operation', 'business', 'intent']
+)
+DB_QUERY_SECONDS = Histogram(
+    'db_query_duration_seconds',
+    'Thời gian chạy câu lệnh SQL',
+    ['operation'],
+    buckets=DB_LATENCY_BUCKETS
+)
+LLM_QUEUE_WAIT_SECONDS = Histogram(
+    'llm_queue_wait_seconds',
+    'Thời gian chờ lượt gọi Gemini theo quota (GeminiScheduler)',
+    ['priority'],
+    buckets=LATENCY_BUCKETS
+)
+LLM_THROTTLE_EVENTS = Counter(
+    'llm_throttle_events_total',
+    'Số lời gọi Gemini bị từ chối / hết hạn chờ / thử lại do quota',
+    ['event']
+)
+CONCURRENCY_LIMIT = Gauge(
+    'concurrency_limit',
+    'Số request đồng thời tối đa hiện tại của route (AdaptiveConcurrencyLimiter)',
+    ['route']
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    'requests_in_flight',
+    'Số request đang xử lý của route có giới hạn đồng thời',
+    ['route']
+)
+REQUESTS_SHED = Counter(
+    'requests_shed_total',
+    'Số request bị từ chối do vượt giới hạn đồng thời',
+    ['route']
+)
+DEADLINE_EXCEEDED = Counter(
+    'deadline_exceeded_total',
+    'Số lần một bước xử lý vượt ngân sách thời gian / deadline của request',
+    ['stage']
+)
+
+CIRCUIT_STATE = Gauge(
+    'circuit_breaker_state',
+    'Trạng thái circuit breaker của dịch vụ ngoài (0 = closed, 1 = half-open, 2 = open)',
+    ['dependency']
+)
+
+CIRCUIT_REJECTED = Counter(
+    'circuit_breaker_rejected_total',
+    'Số lời gọi bị từ chối ngay vì circuit đang mở',
+    ['dependency']
+)
+
+_business_label: contextvars.ContextVar[str] = contextvars.ContextVar('metrics_business', default='none')
+_intent_label: contextvars.ContextVar[str] = contextvars.ContextVar('metrics_intent', default='none')
+
+_seen_businesses = set()
+_seen_lock = threading.Lock()
+
+
+def business_label(business_id) -> str:
+    """Label business có giới hạn số giá trị"""
+    if business_id is None:
+        return 'none'
+    value = str(business_id)
+    if value in _seen_businesses:
+        return value
+    with _seen_lock:
+        if value in _seen_businesses:
+            return value
+        if len(_seen_businesses) < Config.METRICS_MAX_BUSINESS_LABELS:
+            _seen_businesses.add(value)
+            return value
+    return 'other'
+
+
+def intent_label(intent: Optional[str]) -> str:
+    """Label intent chỉ nhận các intent đã biết"""
+    if not intent:
+        return 'none'
+    return intent if intent in KNOWN_INTENTS else 'other'
+
+
+def set_request_labels(business_id=None, intent: Optional[str] = None):
+    """
+    Gắn business / intent cho các metric ghi nhận sau đó trong request hiện tại
+    (context được copy sang thread pool qua utils.tracing.wrap_context)
+    """
+    if business_id is not None:
+        _business_label.set(business_label(business_id))
+    if intent is not None:
+        _intent_label.set(intent_label(intent))
+
+
+def observe_call(operation: str) -> Callable:
+    """
+    Decorator đo thời gian một lời gọi dịch vụ ngoài
+    
+    Args:
+        operation: Tên thao tác, ví dụ 'create_embedding', 'search_vectors'
+    """
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start_time = time.perf_counter()
+            outcome = 'error'
+            try:
+                result = func(*args, **kwargs)
+                outcome = 'ok'
+                return result
+            finally:
+                EXTERNAL_CALL_SECONDS.labels(
+                    operation=operation,
+                    business=_business_label.get(),
+                    intent=_intent_label.get(),
+                    outcome=outcome
+                ).observe(time.perf_counter() - start_time)
+        return wrapper
+    return decorator
+
+
+def record_cache(cache: str, hit: bool):
+    """Ghi nhận một lần tra cache"""
+    CACHE_REQUESTS.labels(cache=cache, result='hit' if hit else 'miss').inc()
+
+
+def record_llm_throttle(event: str):
+    """Ghi nhận một sự kiện của GeminiScheduler ('queue_full', 'timeout', 'retry_429', 'retry_503')"""
+    LLM_THROTTLE_EVENTS.labels(event=event).inc()
+
+
+def record_shed(route: str):
+    """Ghi nhận một request bị từ chối do quá tải"""
+    REQUESTS_SHED.labels(route=route).inc()
+
+
+def record_deadline_exceeded(stage: str):
+    """Ghi nhận một bước bị quá hạn ('classify_intent', 'embedding', 'vector_search', 'llm'...)"""
+    DEADLINE_EXCEEDED.labels(stage=stage).inc()
+
+
+def record_circuit_rejected(dependency: str):
+    """Ghi nhận một lời gọi bị circuit breaker từ chối ('gemini', 'vertex', 'pinecone')"""
+    CIRCUIT_REJECTED.labels(dependency=dependency).inc()
+
+
+def _statement_operation(statement: str) -> str:
+    keyword = statement.lstrip().split(None, 1)[0].upper() if statement and statement.strip() else ''
+    return keyword.lower() if keyword in ('SELECT', 'INSERT', 'UPDATE', 'DELETE') else 'other'
+
+
+def instrument_engine(engine: Engine):
+    """Đếm số câu lệnh SQL và thời gian chạy của engine"""
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+    
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('metrics_query_start')
+        elapsed = time.perf_counter() - starts.pop() if starts else 0.0
+        operation = _statement_operation(statement)
+        DB_QUERIES.labels(
+            operation=operation,
+            business=_business_label.get(),
+            intent=_intent_label.get()
+        ).inc()
+        DB_QUERY_SECONDS.labels(operation=operation).observe(elapsed)
+
+
+def render_metrics():
+    """Nội dung cho endpoint /metrics: (body, content_type)"""
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -149,3 +149,29 @@ def get_primary_image_url(
     
     return None
 
+
+
+def get_product_vector_ids(
+    product_id: int,
+    main_image_url: Optional[str] = None,
+    detail_image_url: Optional[str] = None
+) -> List[str]:
+    """
+    Danh sách vector IDs của một sản phẩm trong Pinecone (text + các ảnh)
+    Đặt tên giống lúc upsert: {id}_text, {id}_image_main cho ảnh chính, {id}_image_{index} cho ảnh còn lại
+    
+    Args:
+        product_id: ID sản phẩm
+        main_image_url: URL ảnh chính
+        detail_image_url: URL ảnh chi tiết (ngăn cách bởi dấu phẩy)
+    
+    Returns:
+        List[str]: Vector IDs
+    """
+    vector_ids = [f"{product_id}_text"]
+    for index, image_url in enumerate(extract_image_urls(main_image_url, detail_image_url)):
+        if index == 0 and main_image_url and image_url == main_image_url.strip():
+            vector_ids.append(f"{product_id}_image_main")
+        else:
+            vector_ids.append(f"{product_id}_image_{index}")
+    return vector_ids
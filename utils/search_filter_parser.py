@@ -0,0 +1,255 @@
+"""
+Trích xuất điều kiện lọc (giá, còn hàng, danh mục) từ tin nhắn tìm sản phẩm bằng rule
+
+Ví dụ: "áo thun dưới 300k còn hàng" -> query "áo thun", giá <= 300000, quantity_avail > 0
+Điều kiện được đưa vào filter metadata của Pinecone (format giống _prepare_filter),
+nên vector search không trả về sản phẩm sai giá để LLM phải tự loại.
+"""
+import re
+from typing import Any, Dict, List, Optional
+
+# Số tiền: 300k, 300 k, 300 nghìn/ngàn, 1tr, 1.5tr, 1tr5, 1 triệu, 300.000đ, 300000 vnd
+_AMOUNT = (
+    r'(?P<{name}>\d+(?:[.,]\d+)*)\s*'
+    r'(?P<{name}_unit>k|nghìn|nghin|ngàn|ngan|tr(?:iệu|ieu)?(?:\s*\d+)?|m|đ|d|vnđ|vnd|đồng|dong)?\b'
+)
+
+_RANGE_PATTERN = re.compile(
+    r'(?<!\w)(?:từ|tu|khoảng|khoang|tầm|tam)?\s*' + _AMOUNT.format(name='low')
+    + r'\s*(?:-|–|đến|den|tới|toi)\s*' + _AMOUNT.format(name='high'),
+    re.IGNORECASE
+)
+_MAX_PATTERN = re.compile(
+    r'(?<!\w)(?:dưới|duoi|nhỏ hơn|nho hon|ít hơn|it hon|không quá|khong qua|tối đa|toi da|max|<=?|rẻ hơn|re hon)\s*'
+    + _AMOUNT.format(name='amount'),
+    re.IGNORECASE
+)
+_MIN_PATTERN = re.compile(
+    r'(?<!\w)(?:trên|tren|hơn|hon|lớn hơn|lon hon|từ|tu|tối thiểu|toi thieu|min|>=?)\s*'
+    + _AMOUNT.format(name='amount'),
+    re.IGNORECASE
+)
+_AROUND_PATTERN = re.compile(
+    r'(?<!\w)(?:khoảng|khoang|tầm|tam|cỡ|co|giá|gia)\s*' + _AMOUNT.format(name='amount'),
+    re.IGNORECASE
+)
+_IN_STOCK_PATTERN = re.compile(
+    r'\b(?:còn hàng|con hang|có sẵn|co san|sẵn hàng|san hang|có hàng|co hang)\b',
+    re.IGNORECASE
+)
+
+# Biên độ khi khách nói "khoảng 300k"
+AROUND_TOLERANCE = 0.2
+
+
+def parse_amount(number: str, unit: Optional[str]) -> Optional[float]:
+    """
+    Chuyển số tiền dạng chữ sang VNĐ
+    
+    Args:
+        number: Phần số ("300", "1.5", "300.000")
+        unit: Đơn vị ("k", "tr", "triệu", "tr5", "đ", None)
+    
+    Returns:
+        float: Số tiền VNĐ, None nếu không phải số tiền (ví dụ "size 42" không có đơn vị và quá nhỏ)
+    """
+    unit = (unit or '').lower().replace(' ', '')
+    # "300.000" / "300,000" là phân cách hàng nghìn; "1.5" / "1,5" là số thập phân
+    if re.fullmatch(r'\d{1,3}(?:[.,]\d{3})+', number):
+        value = float(re.sub(r'[.,]', '', number))
+    else:
+        value = float(number.replace(',', '.'))
+    
+    if unit in ('k', 'nghìn', 'nghin', 'ngàn', 'ngan'):
+        return value * 1_000
+    if unit.startswith('tr') or unit == 'm':
+        # "1tr5" = 1.5 triệu
+        extra = re.search(r'(\d+)$', unit)
+        if extra:
+            value = value + float(f"0.{extra.group(1)}")
+        return value * 1_000_000
+    if unit in ('đ', 'd', 'vnđ', 'vnd', 'đồng', 'dong'):
+        return value
+    # Không có đơn vị: chỉ coi là tiền nếu đủ lớn (tránh nhầm size / số lượng)
+    return value if value >= 1_000 else None
+
+
+def _match_amount(match: re.Match, name: str) -> Optional[float]:
+    return parse_amount(match.group(name), match.group(f"{name}_unit"))
+
+
+def parse_search_filters(message: str, categories: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Trích xuất điều kiện lọc từ tin nhắn
+    
+    Args:
+        message: Tin nhắn của khách
+        categories: Danh sách danh mục của business để nhận diện (optional)
+    
+    Returns:
+        Dict: {
+            'query': phần tin nhắn còn lại sau khi bỏ các cụm điều kiện (dùng để tạo embedding),
+            'price_min': float | None,
+            'price_max': float | None,
+            'in_stock': bool,
+            'categories': List[str]
+        }
+    """
+    text = message or ''
+    price_min = None
+    price_max = None
+    
+    match = _RANGE_PATTERN.search(text)
+    if match:
+        low = _match_amount(match, 'low')
+        high = _match_amount(match, 'high')
+        # "200-500k": đơn vị của số sau áp dụng cho số trước
+        if match.group('high_unit') and not match.group('low_unit'):
+            low = parse_amount(match.group('low'), match.group('high_unit'))
+        if low is not None and high is not None:
+            price_min, price_max = min(low, high), max(low, high)
+            text = text[:match.start()] + ' ' + text[match.end():]
+    
+    if price_max is None:
+        match = _MAX_PATTERN.search(text)
+        if match:
+            amount = _match_amount(match, 'amount')
+            if amount is not None:
+                price_max = amount
+                text = text[:match.start()] + ' ' + text[match.end():]
+    
+    if price_min is None:
+        match = _MIN_PATTERN.search(text)
+        if match:
+            amount = _match_amount(match, 'amount')
+            if amount is not None:
+                price_min = amount
+                text = text[:match.start()] + ' ' + text[match.end():]
+    
+    if price_min is None and price_max is None:
+        match = _AROUND_PATTERN.search(text)
+        if match:
+            amount = _match_amount(match, 'amount')
+            if amount is not None:
+                price_min = amount * (1 - AROUND_TOLERANCE)
+                price_max = amount * (1 + AROUND_TOLERANCE)
+                text = text[:match.start()] + ' ' + text[match.end():]
+    
+    in_stock = False
+    match = _IN_STOCK_PATTERN.search(text)
+    if match:
+        in_stock = True
+        text = text[:match.start()] + ' ' + text[match.end():]
+    
+    found_categories = []
+    if categories:
+        lowered = message.lower()
+        for category in categories:
+            if category and re.search(rf'\b{re.escape(category.lower())}\b', lowered):
+                found_categories.append(category)
+    
+    query = re.sub(r'\s+', ' ', text).strip(' ,.?!')
+    return {
+        'query': query or message,
+        'price_min': price_min,
+        'price_max': price_max,
+        'in_stock': in_stock,
+        'categories': found_categories
+    }
+
+
+def has_filters(parsed: Dict[str, Any]) -> bool:
+    """Tin nhắn có điều kiện lọc nào không"""
+    return (
+        parsed.get('price_min') is not None
+        or parsed.get('price_max') is not None
+        or bool(parsed.get('in_stock'))
+        or bool(parsed.get('categories'))
+    )
+
+
+def build_metadata_filter(
+    parsed: Dict[str, Any],
+    base_filter: Optional[Dict[str, Any]] = None,
+    category_field: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Chuyển điều kiện đã trích xuất thành filter metadata (format của PineconeService._prepare_filter)
+    
+    Args:
+        parsed: Kết quả parse_search_filters
+        base_filter: Filter sẵn có (ví dụ {'status': '1'})
+        category_field: Tên trường metadata chứa danh mục (None = không lọc theo danh mục)
+    
+    Returns:
+        Dict: Ví dụ {'status': '1', 'price': {'$lte': 300000.0}, 'quantity_avail': {'$gt': 0}}
+    """
+    metadata_filter = dict(base_filter or {})
+    
+    price = {}
+    if parsed.get('price_min') is not None:
+        price['$gte'] = float(parsed['price_min'])
+    if parsed.get('price_max') is not None:
+        price['$lte'] = float(parsed['price_max'])
+    if price:
+        metadata_filter['price'] = price
+    
+    if parsed.get('in_stock'):
+        metadata_filter['quantity_avail'] = {'$gt': 0}
+    
+    if category_field and parsed.get('categories'):
+        metadata_filter[category_field] = list(parsed['categories'])
+    
+    return metadata_filter
+
+
+def matches_filter(metadata: Dict[str, Any], metadata_filter: Dict[str, Any]) -> bool:
+    """
+    Kiểm tra metadata có thỏa filter không (dùng cho kết quả không đi qua Pinecone, ví dụ BM25)
+    Hỗ trợ cùng format với _prepare_filter: giá trị đơn ($eq), list ($in), dict toán tử $eq/$ne/$gt/$gte/$lt/$lte/$in/$nin
+    
+    Args:
+        metadata: Metadata sản phẩm
+        metadata_filter: Filter
+    
+    Returns:
+        bool: True nếu thỏa tất cả điều kiện
+    """
+    for key, condition in metadata_filter.items():
+        value = metadata.get(key)
+        if isinstance(condition, dict):
+            for op, expected in condition.items():
+                if not _compare(value, op, expected):
+                    return False
+        elif isinstance(condition, list):
+            if value not in condition:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+def _compare(value: Any, op: str, expected: Any) -> bool:
+    if op == '$eq':
+        return value == expected
+    if op == '$ne':
+        return value != expected
+    if op == '$in':
+        return value in expected
+    if op == '$nin':
+        return value not in expected
+    if value is None:
+        return False
+    try:
+        if op == '$gt':
+            return value > expected
+        if op == '$gte':
+            return value >= expected
+        if op == '$lt':
+            return value < expected
+        if op == '$lte':
+            return value <= expected
+    except TypeError:
+        return False
+    # Toán tử không hỗ trợ: không loại kết quả
+    return True
@@ -0,0 +1,87 @@
+"""
+Single-flight: các lời gọi giống hệt nhau chạy đồng thời chỉ gửi một request ra ngoài
+
+Thread đầu tiên với một key (leader) thực hiện lời gọi; các thread đến sau với cùng key trong lúc
+lời gọi còn đang chạy (follower) chờ và nhận chung kết quả (hoặc chung exception).
+Số lần dùng chung được ghi vào `cache_requests_total{cache="inflight.<name>"}` (hit = follower).
+
+Follower chỉ chờ trong deadline của chính request đó (utils/deadline.py), quá hạn thì raise DeadlineExceeded;
+leader bị DeadlineExceeded (ngân sách của leader) thì follower còn thời gian tự gọi lại thay vì nhận lỗi đó.
+Chỉ dùng cho lời gọi xác định (embedding, query, Gemini temperature 0): lời gọi có sampling không được gộp.
+"""
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from config import Config
+from utils.deadline import DeadlineExceeded, remaining
+from utils.metrics import record_cache, record_deadline_exceeded
+
+
+class _Call:
+    """Lời gọi đang chạy của một key"""
+    __slots__ = ('done', 'result', 'error')
+    
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Gộp các lời gọi đồng thời theo key"""
+    
+    def __init__(self, name: str):
+        """
+        Args:
+            name: Tên nhóm lời gọi (label metric), ví dụ 'gemini', 'embedding', 'pinecone'
+        """
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+    
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        Gọi `fn()` hoặc chờ lời gọi đang chạy với cùng key
+        
+        Kết quả được dùng chung giữa các thread: caller không được sửa trực tiếp object trả về
+        
+        Args:
+            key: Khóa xác định lời gọi giống nhau (phải chứa đủ mọi tham số ảnh hưởng kết quả)
+            fn: Hàm thực hiện lời gọi
+        """
+        if not Config.SINGLE_FLIGHT_ENABLED:
+            return fn()
+        
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+        
+        record_cache(f'inflight.{self.name}', hit=not leader)
+        if not leader:
+            left = remaining()
+            if not call.done.wait(None if left is None else max(0.0, left)):
+                record_deadline_exceeded(f'inflight.{self.name}')
+                raise DeadlineExceeded(f'inflight.{self.name}', f"Hết thời gian khi chờ lời gọi '{self.name}' đang chạy")
+            if isinstance(call.error, DeadlineExceeded):
+                left = remaining()
+                if left is None or left > 0:
+                    # Leader hết ngân sách của nó; request này còn thời gian thì tự gọi lại
+                    return self.do(key, fn)
+            if call.error is not None:
+                raise call.error
+            return call.result
+        
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            # Bỏ key trước khi báo xong: lời gọi đến sau đó sẽ gửi request mới
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
@@ -0,0 +1,18 @@
+"""
+Ước lượng số token của prompt (không gọi API count_tokens)
+"""
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Ước lượng số token của text (~4 ký tự / token, đủ chính xác để so với ngưỡng / ngân sách)
+    
+    Args:
+        text: Nội dung cần đếm
+    
+    Returns:
+        int: Số token ước lượng (0 nếu text rỗng)
+    """
+    if not text:
+        return 0
+    return (len(text) + 3) // 4
@@ -0,0 +1,292 @@
+"""
+Tracing nhẹ theo request (span lưu trong contextvars)
+
+- `with span('gemini.classify_intent', intent=...)`: đo một bước, tự gắn vào span cha đang chạy
+  (request HTTP do TracingMiddleware mở); không có span cha thì span đó là root của một trace mới
+- Khi root span kết thúc, cả trace được export theo format OTLP/JSON của OpenTelemetry:
+  ghi từng dòng vào file (TRACE_EXPORT_FILE) và/hoặc POST tới collector OTLP/HTTP
+  (TRACE_OTLP_ENDPOINT, ví dụ http://localhost:4318/v1/traces). Export chạy trên thread nền.
+- `server_timing(root)`: tổng thời gian theo tên span, dạng header Server-Timing
+- contextvars không tự truyền sang ThreadPoolExecutor: dùng `wrap_context(fn)` khi submit
+"""
+import contextvars
+import functools
+import json
+import logging
+import os
+import queue
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import requests
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+_current_span: contextvars.ContextVar[Optional['Span']] = contextvars.ContextVar('current_span', default=None)
+
+# Số span tối đa giữ trong một trace (tránh trace chạy lâu như reindex giữ quá nhiều span trong RAM)
+MAX_SPANS_PER_TRACE = 1000
+
+
+class _Trace:
+    """Các span đã kết thúc của một trace"""
+    
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self.spans: List['Span'] = []
+        self.dropped = 0
+        self._lock = threading.Lock()
+    
+    def add(self, finished: 'Span'):
+        with self._lock:
+            if len(self.spans) < MAX_SPANS_PER_TRACE:
+                self.spans.append(finished)
+            else:
+                self.dropped += 1
+
+
+class Span:
+    """Một bước được đo thời gian (tương ứng span của OpenTelemetry)"""
+    
+    def __init__(self, name: str, parent: Optional['Span'] = None, attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.parent = parent
+        self.trace = parent.trace if parent is not None else _Trace(secrets.token_hex(16))
+        self.span_id = secrets.token_hex(8)
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.error: Optional[str] = None
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self._start_perf = time.perf_counter()
+        self._end_perf: Optional[float] = None
+    
+    @property
+    def trace_id(self) -> str:
+        return self.trace.trace_id
+    
+    @property
+    def is_root(self) -> bool:
+        return self.parent is None
+    
+    @property
+    def duration(self) -> float:
+        """Thời gian (giây); span đang chạy thì tính tới hiện tại"""
+        end = self._end_perf if self._end_perf is not None else time.perf_counter()
+        return end - self._start_perf
+    
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+    
+    def record_error(self, error: BaseException):
+        self.error = f"{type(error).__name__}: {error}"
+    
+    def end(self):
+        if self._end_perf is not None:
+            return
+        self._end_perf = time.perf_counter()
+        self.end_ns = self.start_ns + int(self.duration * 1e9)
+        self.trace.add(self)
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Span]:
+    """
+    Mở span con của span hiện tại (hoặc root span mới)
+    
+    Exception trong block được ghi vào span rồi raise lại.
+    
+    Args:
+        name: Tên bước, ví dụ 'pinecone.query', 'gemini.generate_chat_response'
+        **attributes: Thuộc tính gắn vào span (business_id, intent, top_k...)
+    """
+    parent = _current_span.get()
+    current = Span(name, parent=parent, attributes=attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.record_error(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end()
+        if current.is_root:
+            get_trace_exporter().export(current.trace)
+
+
+def traced(name: Optional[str] = None) -> Callable:
+    """Decorator bọc cả hàm trong một span (mặc định tên là <module>.<tên hàm>)"""
+    def decorator(func: Callable) -> Callable:
+        span_name = name or f"{func.__module__}.{func.__qualname__}"
+        
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def get_current_span() -> Optional[Span]:
+    """Span đang chạy trong context hiện tại"""
+    return _current_span.get()
+
+
+def wrap_context(func: Callable) -> Callable:
+    """Giữ context hiện tại (span cha) cho hàm sẽ chạy trên thread khác"""
+    ctx = contextvars.copy_context()
+    
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return ctx.run(func, *args, **kwargs)
+    return wrapper
+
+
+def timing_breakdown(root: Span) -> Dict[str, float]:
+    """
+    Tổng thời gian (ms) theo tên span trong trace của root (không tính root)
+    
+    Returns:
+        Dict: {'gemini.generate_chat_response': 812.4, 'db.product_context': 12.1, ...}
+    """
+    totals: Dict[str, float] = {}
+    for finished in list(root.trace.spans):
+        if finished is root:
+            continue
+        totals[finished.name] = totals.get(finished.name, 0.0) + finished.duration * 1000
+    return totals
+
+
+def server_timing(root: Span) -> str:
+    """Giá trị header Server-Timing: 'total;dur=900.1, gemini.generate_chat_response;dur=812.4, ...'"""
+    parts = [f"total;dur={root.duration * 1000:.1f}"]
+    for name, duration_ms in timing_breakdown(root).items():
+        parts.append(f"{name};dur={duration_ms:.1f}")
+    return ", ".join(parts)
+
+
+def _attribute_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def to_otlp(trace: _Trace, service_name: str) -> Dict[str, Any]:
+    """Chuyển trace sang OTLP/JSON (ExportTraceServiceRequest)"""
+    spans = []
+    for finished in list(trace.spans):
+        otlp_span = {
+            'traceId': trace.trace_id,
+            'spanId': finished.span_id,
+            'name': finished.name,
+            'kind': 2 if 'http.method' in finished.attributes else 1,  # SERVER / INTERNAL
+            'startTimeUnixNano': str(finished.start_ns),
+            'endTimeUnixNano': str(finished.end_ns),
+            'attributes': [
+                {'key': key, 'value': _attribute_value(value)}
+                for key, value in finished.attributes.items() if value is not None
+            ],
+            'status': {'code': 2, 'message': finished.error} if finished.error else {'code': 1}
+        }
+        if finished.parent is not None:
+            otlp_span['parentSpanId'] = finished.parent.span_id
+        spans.append(otlp_span)
+    
+    return {
+        'resourceSpans': [{
+            'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': service_name}}]},
+            'scopeSpans': [{'scope': {'name': 'product-vector-api'}, 'spans': spans}]
+        }]
+    }
+
+
+class TraceExporter:
+    """
+    Export trace đã kết thúc ra file JSON lines và/hoặc collector OTLP/HTTP trên thread nền
+    Queue đầy thì bỏ trace (không làm chậm request)
+    """
+    
+    def __init__(
+        self,
+        file_path: str = '',
+        otlp_endpoint: str = '',
+        service_name: str = 'product-vector-api',
+        max_queue: int = 1000
+    ):
+        self.file_path = file_path
+        self.otlp_endpoint = otlp_endpoint
+        self.service_name = service_name
+        self.enabled = bool(file_path or otlp_endpoint)
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.dropped = 0
+    
+    def export(self, trace: _Trace):
+        if not self.enabled:
+            return
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+    
+    def flush(self, timeout: float = 5.0):
+        """Chờ export hết các trace đang chờ (dùng khi shutdown)"""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+    
+    def _ensure_thread(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='trace-exporter', daemon=True)
+                self._thread.start()
+    
+    def _run(self):
+        while True:
+            trace = self._queue.get()
+            try:
+                payload = to_otlp(trace, self.service_name)
+                if self.file_path:
+                    self._write_file(payload)
+                if self.otlp_endpoint:
+                    requests.post(self.otlp_endpoint, json=payload, timeout=5)
+            except Exception as e:
+                logger.warning(f"[Tracing] Lỗi khi export trace {trace.trace_id}: {str(e)}")
+            finally:
+                self._queue.task_done()
+    
+    def _write_file(self, payload: Dict[str, Any]):
+        directory = os.path.dirname(self.file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.file_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(payload, ensure_ascii=False) + '\n')
+
+
+# Lazy singleton
+_trace_exporter_instance: Optional[TraceExporter] = None
+
+
+def get_trace_exporter() -> TraceExporter:
+    """Lấy instance TraceExporter (lazy init, singleton)."""
+    global _trace_exporter_instance
+    if _trace_exporter_instance is None:
+        _trace_exporter_instance = TraceExporter(
+            file_path=Config.TRACE_EXPORT_FILE,
+            otlp_endpoint=Config.TRACE_OTLP_ENDPOINT,
+            service_name=Config.TRACE_SERVICE_NAME
+        )
+    return _trace_exporter_instance
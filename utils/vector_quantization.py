@@ -0,0 +1,164 @@
+"""
+Helper nén và giảm chiều vector embedding.
+
+- float16 / int8 (scalar quantization): lưu vector đầy đủ với 1/2 hoặc 1/4 dung lượng float32
+- Cắt prefix `dimension` chiều đầu rồi chuẩn hóa lại: chỉ dùng cho benchmark minh họa, multimodalembedding@001
+  không phải model Matryoshka nên index giảm chiều dùng vector Vertex AI tạo với dimension nhỏ
+- Re-rank: chấm điểm lại các ứng viên bằng vector đầy đủ để bù phần recall bị mất khi giảm chiều
+"""
+import base64
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+# Các dimension mà multimodalembedding@001 của Vertex AI hỗ trợ
+SUPPORTED_EMBEDDING_DIMENSIONS = (128, 256, 512, 1408)
+
+# Độ chính xác dùng để lưu vector đầy đủ (phục vụ re-rank)
+SUPPORTED_PRECISIONS = ('float32', 'float16', 'int8')
+
+# Các key trong metadata Pinecone chứa vector đầy đủ đã nén
+FULL_VECTOR_KEY = '_fv'
+FULL_VECTOR_DTYPE_KEY = '_fv_dtype'
+FULL_VECTOR_SCALE_KEY = '_fv_scale'
+ENCODED_VECTOR_KEYS = (FULL_VECTOR_KEY, FULL_VECTOR_DTYPE_KEY, FULL_VECTOR_SCALE_KEY)
+
+
+def l2_normalize(values: Sequence[float]) -> np.ndarray:
+    """Chuẩn hóa vector (hoặc từng dòng của ma trận 2-D) về độ dài 1, giữ nguyên vector 0"""
+    vector = np.asarray(values, dtype=np.float32)
+    norms = np.linalg.norm(vector, axis=-1, keepdims=True)
+    norms[norms == 0.0] = 1.0
+    return vector / norms
+
+
+def reduce_dimension(values: Sequence[float], dimension: int) -> np.ndarray:
+    """
+    Giảm chiều theo kiểu Matryoshka: lấy `dimension` chiều đầu và chuẩn hóa lại
+    
+    Không hợp lệ với multimodalembedding@001 (không huấn luyện Matryoshka), chỉ dùng trong benchmark
+    
+    Args:
+        values: Vector đầy đủ hoặc ma trận 2-D (mỗi dòng một vector)
+        dimension: Số chiều cần giữ lại
+    
+    Returns:
+        np.ndarray: Vector float32 đã giảm chiều
+    """
+    vector = np.asarray(values, dtype=np.float32)
+    if dimension >= vector.shape[-1]:
+        return vector
+    return l2_normalize(vector[..., :dimension])
+
+
+def quantize_int8(values: Sequence[float]) -> tuple:
+    """
+    Scalar quantization đối xứng về int8
+    
+    Returns:
+        tuple: (np.ndarray int8, scale) với values ≈ codes * scale
+    """
+    vector = np.asarray(values, dtype=np.float32)
+    max_abs = float(np.max(np.abs(vector))) if vector.size else 0.0
+    scale = max_abs / 127.0 if max_abs > 0 else 1.0
+    codes = np.clip(np.rint(vector / scale), -127, 127).astype(np.int8)
+    return codes, scale
+
+
+def dequantize_int8(codes: np.ndarray, scale: float) -> np.ndarray:
+    """Giải nén int8 về float32"""
+    return codes.astype(np.float32) * np.float32(scale)
+
+
+def encode_vector(values: Sequence[float], precision: str = 'int8') -> Dict[str, Any]:
+    """
+    Nén vector đầy đủ thành các field metadata (base64) để lưu kèm trong Pinecone
+    
+    Args:
+        values: Vector đầy đủ
+        precision: 'float32', 'float16' hoặc 'int8'
+    
+    Returns:
+        Dict: {'_fv': str, '_fv_dtype': str, '_fv_scale': float (chỉ với int8)}
+    """
+    if precision not in SUPPORTED_PRECISIONS:
+        raise ValueError(f"Precision không hợp lệ: {precision}")
+    
+    vector = np.asarray(values, dtype=np.float32)
+    encoded = {FULL_VECTOR_DTYPE_KEY: precision}
+    if precision == 'int8':
+        codes, scale = quantize_int8(vector)
+        raw = codes.tobytes()
+        encoded[FULL_VECTOR_SCALE_KEY] = scale
+    else:
+        raw = vector.astype('<f2' if precision == 'float16' else '<f4').tobytes()
+    encoded[FULL_VECTOR_KEY] = base64.b64encode(raw).decode('ascii')
+    return encoded
+
+
+def decode_vector(metadata: Dict[str, Any]) -> Optional[np.ndarray]:
+    """Giải nén vector đầy đủ từ metadata, trả về None nếu metadata không chứa vector"""
+    data = metadata.get(FULL_VECTOR_KEY)
+    if not data:
+        return None
+    
+    raw = base64.b64decode(data)
+    precision = metadata.get(FULL_VECTOR_DTYPE_KEY, 'float32')
+    if precision == 'int8':
+        codes = np.frombuffer(raw, dtype=np.int8)
+        return dequantize_int8(codes, float(metadata.get(FULL_VECTOR_SCALE_KEY, 1.0)))
+    if precision == 'float16':
+        return np.frombuffer(raw, dtype='<f2').astype(np.float32)
+    return np.frombuffer(raw, dtype='<f4')
+
+
+def strip_encoded_vector(metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """Bỏ các field vector nén khỏi metadata trước khi trả về cho caller"""
+    if not any(key in metadata for key in ENCODED_VECTOR_KEYS):
+        return metadata
+    return {k: v for k, v in metadata.items() if k not in ENCODED_VECTOR_KEYS}
+
+
+def cosine_similarity(a: Sequence[float], b: Sequence[float]) -> float:
+    """Cosine similarity giữa 2 vector"""
+    va = np.asarray(a, dtype=np.float32)
+    vb = np.asarray(b, dtype=np.float32)
+    denom = float(np.linalg.norm(va) * np.linalg.norm(vb))
+    if denom == 0.0:
+        return 0.0
+    return float(np.dot(va, vb) / denom)
+
+
+def rerank_matches(
+    query_vector: Sequence[float],
+    matches: List[Dict[str, Any]],
+    top_k: int
+) -> List[Dict[str, Any]]:
+    """
+    Re-rank các kết quả search bằng vector đầy đủ lưu trong metadata
+    
+    Kết quả không có vector đầy đủ giữ nguyên score từ Pinecone.
+    
+    Args:
+        query_vector: Vector query đầy đủ (chưa giảm chiều)
+        matches: List dict với keys 'id', 'score', 'metadata'
+        top_k: Số lượng kết quả trả về sau re-rank
+    
+    Returns:
+        List kết quả đã sắp xếp lại theo score full precision
+    """
+    reranked = []
+    for match in matches:
+        metadata = match.get('metadata') or {}
+        full_vector = decode_vector(metadata)
+        score = match['score']
+        if full_vector is not None and full_vector.shape[-1] == len(query_vector):
+            score = cosine_similarity(query_vector, full_vector)
+        reranked.append({
+            'id': match['id'],
+            'score': score,
+            'metadata': strip_encoded_vector(metadata)
+        })
+    
+    reranked.sort(key=lambda x: x['score'], reverse=True)
+    return reranked[:top_k]